@@ -0,0 +1,213 @@
+# admission.py
+import asyncio
+import itertools
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+PRIORITIES = ('high', 'normal', 'low')
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """'high=1000,normal=5000' -> {'high': 1000, 'normal': 5000}"""
+    limits = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            key, value = item.split('=', 1)
+            limits[key.strip()] = int(value)
+    return limits
+
+
+class TokenBucket:
+    """Limitador token bucket: `rate` tokens/s con ráfagas de hasta `burst`"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def try_acquire(self, tokens: float = 1.0) -> Tuple[bool, float]:
+        """(admitido, segundos hasta que haya tokens suficientes)"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True, 0.0
+        return False, (tokens - self.tokens) / self.rate if self.rate else float('inf')
+
+
+class RateLimiter:
+    """Un token bucket por clave (p. ej. agente que envía tareas)"""
+
+    def __init__(self, rate: float, burst: float, idle_ttl: float = 600):
+        self.rate = rate
+        self.burst = burst
+        self.idle_ttl = idle_ttl
+        self.buckets: Dict[str, TokenBucket] = {}
+        self._last_prune = time.monotonic()
+
+    def allow(self, key: str) -> Tuple[bool, float]:
+        if not self.rate:
+            return True, 0.0
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        allowed = bucket.try_acquire()
+        self._prune()
+        return allowed
+
+    def _prune(self):
+        now = time.monotonic()
+        if now - self._last_prune < self.idle_ttl:
+            return
+        self._last_prune = now
+        # Un bucket inactivo más de idle_ttl está lleno: equivale a no tenerlo
+        self.buckets = {k: b for k, b in self.buckets.items() if now - b.updated < self.idle_ttl}
+
+
+class TaskQueue:
+    """
+    Cola de tareas acotada con una deque por prioridad.
+
+    `admit()` aplica los límites por prioridad, por tipo de tarea y total y
+    devuelve el motivo del rechazo; `put()` no aplica límites (reencolados
+    de tareas ya admitidas). `get()` entrega primero las de mayor prioridad
+    y, dentro de cada una, en orden de llegada.
+    """
+
+    def __init__(self, priority_limits: Dict[str, int] = None, type_limits: Dict[str, int] = None,
+                 max_total: int = None):
+        self.priority_limits = priority_limits or {}
+        self.type_limits = type_limits or {}
+        self.max_total = max_total
+        self.queues = {p: deque() for p in PRIORITIES}
+        self.type_counts: Dict[str, int] = {}
+        self._size = 0
+        self._not_empty = None  # Se crea dentro del loop
+        self._drained = deque(maxlen=1000)  # Instantes de salida, para estimar retry_after
+
+    @staticmethod
+    def _priority(task: Dict) -> str:
+        priority = task.get('priority', 'normal')
+        return priority if priority in PRIORITIES else 'normal'
+
+    def admit(self, task: Dict) -> Optional[str]:
+        """Encola si hay hueco; si no, devuelve el motivo ('queue_full:<límite>')"""
+        reason = self.rejection([task])
+        if reason:
+            return reason
+        self._append(task, self._priority(task))
+        return None
+
+    def rejection(self, tasks: List[Dict]) -> Optional[str]:
+        """Motivo por el que `tasks` no cabrían juntas en la cola (None si caben); no encola"""
+        if self.max_total is not None and self._size + len(tasks) > self.max_total:
+            return 'queue_full:total'
+        for priority, count in Counter(self._priority(t) for t in tasks).items():
+            limit = self.priority_limits.get(priority)
+            if limit is not None and len(self.queues[priority]) + count > limit:
+                return f"queue_full:priority={priority}"
+        for task_type, count in Counter(t.get('type', 'general') for t in tasks).items():
+            limit = self.type_limits.get(task_type)
+            if limit is not None and self.type_counts.get(task_type, 0) + count > limit:
+                return f"queue_full:type={task_type}"
+        return None
+
+    def retry_after(self, minimum: float = 1.0, maximum: float = 60.0) -> float:
+        """Segundos sugeridos antes de reintentar: lo que tarda en drenarse ~10% de la cola al ritmo reciente"""
+        now = time.monotonic()
+        recent = [t for t in self._drained if now - t <= 60]
+        if len(recent) < 2:
+            return maximum if self._size else minimum
+        rate = len(recent) / max(now - recent[0], 1e-3)
+        return round(min(maximum, max(minimum, self._size / rate / 10)), 2)
+
+    async def put(self, task: Dict, front: bool = False):
+        self._append(task, self._priority(task), front)
+
+    def put_nowait(self, task: Dict, front: bool = False):
+        self._append(task, self._priority(task), front)
+
+    def _append(self, task: Dict, priority: str, front: bool = False):
+        if front:
+            # Tareas que ya esperaron (p. ej. revocadas a un agente): primeras de su prioridad
+            self.queues[priority].appendleft(task)
+        else:
+            self.queues[priority].append(task)
+        task_type = task.get('type', 'general')
+        self.type_counts[task_type] = self.type_counts.get(task_type, 0) + 1
+        self._size += 1
+        if self._not_empty is not None:
+            self._not_empty.set()
+
+    async def get(self) -> Dict:
+        while not self._size:
+            if self._not_empty is None:
+                self._not_empty = asyncio.Event()
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+    def get_nowait(self) -> Dict:
+        for priority in PRIORITIES:
+            if self.queues[priority]:
+                return self._pop(priority, self.queues[priority].popleft())
+        raise asyncio.QueueEmpty()
+
+    def steal(self, count: int, predicate: Callable[[Dict], bool] = None) -> List[Dict]:
+        """Saca hasta `count` tareas del final de la cola, empezando por la menor prioridad"""
+        stolen = []
+        for priority in reversed(PRIORITIES):
+            if len(stolen) >= count:
+                break
+            queue = self.queues[priority]
+            # Una sola pasada: se parte la cola y se reconstruye una vez (sin remove por igualdad)
+            kept = []
+            for task in reversed(queue):
+                if len(stolen) < count and (predicate is None or predicate(task)):
+                    stolen.append(self._pop(priority, task))
+                else:
+                    kept.append(task)
+            if len(kept) != len(queue):
+                queue.clear()
+                queue.extend(reversed(kept))
+        return stolen
+
+    def take(self, priority: str, count: int, predicate: Callable[[Dict], bool],
+             scan_limit: int = 256) -> List[Dict]:
+        """Saca hasta `count` tareas de una prioridad, en orden de llegada, que cumplan `predicate`"""
+        queue = self.queues[priority]
+        taken = []
+        for task in list(itertools.islice(queue, scan_limit)):
+            if len(taken) >= count:
+                break
+            if predicate(task):
+                queue.remove(task)
+                taken.append(self._pop(priority, task))
+        return taken
+
+    def _pop(self, priority: str, task: Dict) -> Dict:
+        task_type = task.get('type', 'general')
+        self.type_counts[task_type] -= 1
+        if not self.type_counts[task_type]:
+            del self.type_counts[task_type]
+        self._size -= 1
+        self._drained.append(time.monotonic())
+        return task
+
+    def empty(self) -> bool:
+        return not self._size
+
+    def qsize(self) -> int:
+        return self._size
+
+    def stats(self) -> Dict:
+        return {
+            'total': self._size,
+            'by_priority': {p: len(q) for p, q in self.queues.items()},
+            'by_type': dict(self.type_counts)
+        }
@@ -0,0 +1,241 @@
+# crdt.py
+import json
+import time
+from typing import Any, Dict, Optional
+
+
+class VectorClock:
+    """Reloj vectorial {agent_id: contador} para ordenar escrituras entre agentes"""
+
+    def __init__(self, clock: Dict[str, int] = None):
+        self.clock = dict(clock or {})
+
+    def increment(self, node: str) -> 'VectorClock':
+        self.clock[node] = self.clock.get(node, 0) + 1
+        return self
+
+    def merge(self, other: 'VectorClock') -> 'VectorClock':
+        for node, count in other.clock.items():
+            if count > self.clock.get(node, 0):
+                self.clock[node] = count
+        return self
+
+    def compare(self, other: 'VectorClock') -> str:
+        """'before', 'after', 'equal' o 'concurrent' respecto a `other`"""
+        less = greater = False
+        for node in self.clock.keys() | other.clock.keys():
+            mine, theirs = self.clock.get(node, 0), other.clock.get(node, 0)
+            if mine < theirs:
+                less = True
+            elif mine > theirs:
+                greater = True
+        if less and greater:
+            return 'concurrent'
+        if less:
+            return 'before'
+        if greater:
+            return 'after'
+        return 'equal'
+
+    def to_dict(self) -> Dict[str, int]:
+        return dict(self.clock)
+
+
+class CRDT:
+    """Tipo replicado con merge conmutativo, asociativo e idempotente"""
+
+    type_name = None
+
+    def merge(self, other: 'CRDT') -> 'CRDT':
+        raise NotImplementedError
+
+    def value(self) -> Any:
+        raise NotImplementedError
+
+    def state(self) -> Dict:
+        raise NotImplementedError
+
+    def to_dict(self) -> Dict:
+        return {'__crdt__': self.type_name, 'state': self.state()}
+
+
+class GCounter(CRDT):
+    """Contador que solo crece: un contador por agente, merge por máximo"""
+
+    type_name = 'g_counter'
+
+    def __init__(self, counts: Dict[str, int] = None):
+        self.counts = dict(counts or {})
+
+    def increment(self, node: str, amount: int = 1):
+        if amount < 0:
+            raise ValueError("GCounter solo admite incrementos")
+        self.counts[node] = self.counts.get(node, 0) + amount
+        return self
+
+    def merge(self, other: 'GCounter') -> 'GCounter':
+        for node, count in other.counts.items():
+            if count > self.counts.get(node, 0):
+                self.counts[node] = count
+        return self
+
+    def value(self) -> int:
+        return sum(self.counts.values())
+
+    def state(self) -> Dict:
+        return dict(self.counts)
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'GCounter':
+        return cls(state)
+
+
+class PNCounter(CRDT):
+    """Contador con incrementos y decrementos (dos GCounter)"""
+
+    type_name = 'pn_counter'
+
+    def __init__(self, positive: GCounter = None, negative: GCounter = None):
+        self.positive = positive or GCounter()
+        self.negative = negative or GCounter()
+
+    def increment(self, node: str, amount: int = 1):
+        if amount >= 0:
+            self.positive.increment(node, amount)
+        else:
+            self.negative.increment(node, -amount)
+        return self
+
+    def decrement(self, node: str, amount: int = 1):
+        return self.increment(node, -amount)
+
+    def merge(self, other: 'PNCounter') -> 'PNCounter':
+        self.positive.merge(other.positive)
+        self.negative.merge(other.negative)
+        return self
+
+    def value(self) -> int:
+        return self.positive.value() - self.negative.value()
+
+    def state(self) -> Dict:
+        return {'p': self.positive.state(), 'n': self.negative.state()}
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'PNCounter':
+        return cls(GCounter(state.get('p')), GCounter(state.get('n')))
+
+
+class LWWMap(CRDT):
+    """Mapa last-write-wins por clave; empates resueltos por agent_id (determinista)"""
+
+    type_name = 'lww_map'
+
+    def __init__(self, entries: Dict[str, list] = None):
+        # clave -> [timestamp, agent_id, valor, borrado]
+        self.entries = {k: list(v) for k, v in (entries or {}).items()}
+
+    def set(self, node: str, key: str, value: Any, timestamp: float = None):
+        self._write(key, [timestamp or time.time(), node, value, False])
+        return self
+
+    def delete(self, node: str, key: str, timestamp: float = None):
+        self._write(key, [timestamp or time.time(), node, None, True])
+        return self
+
+    def _write(self, key: str, entry: list):
+        current = self.entries.get(key)
+        if current is None or (entry[0], entry[1]) > (current[0], current[1]):
+            self.entries[key] = entry
+
+    def merge(self, other: 'LWWMap') -> 'LWWMap':
+        for key, entry in other.entries.items():
+            self._write(key, list(entry))
+        return self
+
+    def value(self) -> Dict[str, Any]:
+        return {k: e[2] for k, e in self.entries.items() if not e[3]}
+
+    def state(self) -> Dict:
+        return {k: list(e) for k, e in self.entries.items()}
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'LWWMap':
+        return cls(state)
+
+
+class ORSet(CRDT):
+    """Observed-remove set: un add concurrente con un remove gana el add"""
+
+    type_name = 'or_set'
+
+    def __init__(self, elements: Dict[str, Dict] = None, tombstones=None, counters: Dict[str, int] = None):
+        # clave canónica -> {'value': elemento, 'tags': set(tags)}
+        self.elements = {k: {'value': e['value'], 'tags': set(e['tags'])}
+                         for k, e in (elements or {}).items()}
+        self.tombstones = set(tombstones or ())
+        self.counters = dict(counters or {})
+
+    @staticmethod
+    def _key(element: Any) -> str:
+        return json.dumps(element, sort_keys=True, default=str)
+
+    def add(self, node: str, element: Any):
+        self.counters[node] = self.counters.get(node, 0) + 1
+        key = self._key(element)
+        entry = self.elements.setdefault(key, {'value': element, 'tags': set()})
+        entry['tags'].add(f"{node}:{self.counters[node]}")
+        return self
+
+    def remove(self, element: Any):
+        entry = self.elements.get(self._key(element))
+        if entry:
+            self.tombstones.update(entry['tags'])
+        return self
+
+    def merge(self, other: 'ORSet') -> 'ORSet':
+        for key, entry in other.elements.items():
+            mine = self.elements.setdefault(key, {'value': entry['value'], 'tags': set()})
+            mine['tags'].update(entry['tags'])
+        self.tombstones.update(other.tombstones)
+        for node, count in other.counters.items():
+            if count > self.counters.get(node, 0):
+                self.counters[node] = count
+        return self
+
+    def value(self) -> list:
+        return [e['value'] for e in self.elements.values() if e['tags'] - self.tombstones]
+
+    def __contains__(self, element: Any) -> bool:
+        entry = self.elements.get(self._key(element))
+        return bool(entry and entry['tags'] - self.tombstones)
+
+    def state(self) -> Dict:
+        return {
+            'elements': {k: {'value': e['value'], 'tags': sorted(e['tags'])} for k, e in self.elements.items()},
+            'tombstones': sorted(self.tombstones),
+            'counters': dict(self.counters)
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'ORSet':
+        return cls(state.get('elements'), state.get('tombstones'), state.get('counters'))
+
+
+CRDT_TYPES = {cls.type_name: cls for cls in (GCounter, PNCounter, LWWMap, ORSet)}
+
+
+def is_crdt_value(value: Any) -> bool:
+    return isinstance(value, dict) and value.get('__crdt__') in CRDT_TYPES
+
+
+def crdt_from_dict(value: Dict) -> Optional[CRDT]:
+    """Reconstruye un CRDT desde su forma serializada ({'__crdt__': tipo, 'state': ...})"""
+    if not is_crdt_value(value):
+        return None
+    return CRDT_TYPES[value['__crdt__']].from_state(value.get('state') or {})
+
+
+def new_crdt(type_name: str) -> CRDT:
+    if type_name not in CRDT_TYPES:
+        raise ValueError(f"Tipo CRDT desconocido: {type_name}")
+    return CRDT_TYPES[type_name]()
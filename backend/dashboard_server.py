@@ -3,12 +3,19 @@ import eventlet
 eventlet.monkey_patch()
 
 import logging
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 from flask_socketio import SocketIO, emit
 import json
+import time
 from datetime import datetime
 import os
 
+from dashboard_state import create_state_backend
+from persistent_memory import PersistentMemory
+from task_analytics import TaskAnalytics
+from telemetry import TelemetrySystem
+from traffic_recorder import TrafficRecorder
+
 # Configure logging to be less verbose
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
@@ -27,59 +34,112 @@ socketio = SocketIO(
 )
 
 class DashboardManager:
-    def __init__(self):
-        self.agents = {}
-        self.task_queue = []
-        self.completed_tasks = []
-        self.active_collaborations = []
-        self.active_tasks = {}
-        
+    COMPLETED_HISTORY = 1000
+    MAX_QUEUED_TASKS = int(os.getenv('DASHBOARD_MAX_QUEUED_TASKS', '10000'))
+
+    def __init__(self, state=None):
+        # El estado vive en un backend intercambiable para poder compartirlo
+        # entre varios workers de gunicorn (ver dashboard_state.py)
+        self.state = state or create_state_backend()
+        self.telemetry = TelemetrySystem()
+        self.reports_counter = self.telemetry.counter(
+            'antigravity_dashboard_reports', 'Reportes recibidos de agentes', ['event']
+        )
+        self.telemetry.gauge('antigravity_dashboard_agents', 'Agentes conocidos').set_function(
+            lambda: self.state.hlen('agents'))
+        self.telemetry.gauge('antigravity_dashboard_tasks_in_queue', 'Tareas en cola').set_function(
+            lambda: self.state.hlen('task_queue'))
+        self.telemetry.gauge('antigravity_dashboard_tasks_completed', 'Tareas completadas').set_function(
+            lambda: self.state.counter('tasks_completed'))
+
+    @property
+    def agents(self):
+        return self.state.hgetall('agents')
+
+    @property
+    def task_queue(self):
+        return list(self.state.hgetall('task_queue').values())
+
+    @property
+    def active_tasks(self):
+        return self.state.hgetall('active_tasks')
+
+    @property
+    def completed_tasks(self):
+        return self.state.tail('completed_tasks', self.COMPLETED_HISTORY)
+
+    @property
+    def active_collaborations(self):
+        return self.state.tail('collaborations', self.COMPLETED_HISTORY)
+
+    def _emit(self, event, payload):
+        self.state.publish(event, payload)
+
     def update_agent_status(self, agent_id, status):
-        self.agents[agent_id] = {
-            **self.agents.get(agent_id, {}),
+        # Fusión atómica en el backend: con varios workers no se pierden actualizaciones
+        agent = self.state.hupdate('agents', agent_id, lambda current: {
+            **(current or {}),
             **status,
             'last_update': datetime.now().isoformat()
-        }
-        socketio.emit('agent_update', {
+        })
+        self._emit('agent_update', {
             'agent_id': agent_id,
-            'status': self.agents[agent_id]
+            'status': agent
         })
     
+    def _update_running(self, agent_id, change):
+        """Aplica `change` a las tareas en ejecución del agente y deriva status/current_task"""
+        def merge(current):
+            current = current or {}
+            running = dict(current.get('running_tasks') or {})
+            change(running)
+            tasks = list(running.values())
+            return {
+                **current,
+                'running_tasks': running,
+                'status': 'busy' if running else 'idle',
+                'current_task': tasks[-1] if tasks else None,
+                'last_update': datetime.now().isoformat()
+            }
+        agent = self.state.hupdate('agents', agent_id, merge)
+        self._emit('agent_update', {'agent_id': agent_id, 'status': agent})
+    
     def add_task(self, task):
+        if self.state.hlen('task_queue') >= self.MAX_QUEUED_TASKS:
+            # Cola llena: se rechaza en lugar de crecer sin límite
+            self._emit('task_rejected', {'task_id': task.get('id'), 'reason': 'queue_full'})
+            return None
         if 'id' not in task:
-            task['id'] = f"task_{len(self.completed_tasks) + len(self.task_queue)}"
+            task['id'] = f"task_{int(self.state.incr('tasks_created'))}"
         task['timestamp'] = datetime.now().isoformat()
-        self.task_queue.append(task)
-        socketio.emit('new_task', task)
+        self.state.hset('task_queue', task['id'], task)
+        self._emit('new_task', task)
         return task
     
     def start_task(self, task_id, agent_id):
-        to_remove = None
-        for t in self.task_queue:
-            if t['id'] == task_id:
-                to_remove = t
-                break
-        if to_remove:
-            self.task_queue.remove(to_remove)
-            self.active_tasks[task_id] = to_remove
-            self.active_tasks[task_id]['agent_id'] = agent_id
-            self.active_tasks[task_id]['start_time'] = datetime.now()
+        task = self.state.hdel('task_queue', task_id)
+        if task:
+            task['agent_id'] = agent_id
+            task['start_time'] = datetime.now().isoformat()
+            self.state.hset('active_tasks', task_id, task)
     
     def complete_task(self, task_id, result):
-        task = self.active_tasks.get(task_id)
+        task = self.state.hdel('active_tasks', task_id)
         if not task:
-            task = next((t for t in self.task_queue if t['id'] == task_id), None)
-            if task: self.task_queue.remove(task)
-        else:
-            del self.active_tasks[task_id]
+            task = self.state.hdel('task_queue', task_id)
             
         if task:
             task['completed_at'] = datetime.now().isoformat()
             task['result'] = result
-            if 'start_time' in task and isinstance(task['start_time'], datetime):
-                task['duration'] = (datetime.now() - task['start_time']).total_seconds()
-            self.completed_tasks.append(task)
-            socketio.emit('task_complete', task)
+            if task.get('start_time'):
+                started = datetime.fromisoformat(task['start_time'])
+                task['duration'] = (datetime.now() - started).total_seconds()
+                self.state.incr('duration_sum', task['duration'])
+                self.state.incr('duration_count')
+            self.state.append('completed_tasks', task, maxlen=self.COMPLETED_HISTORY)
+            self.state.incr('tasks_completed')
+            self._emit('task_complete', task)
+        return task
     
     def report_collaboration(self, from_agent, to_agent, task):
         collab = {
@@ -88,55 +148,115 @@ class DashboardManager:
             'task': task,
             'timestamp': datetime.now().isoformat()
         }
-        self.active_collaborations.append(collab)
-        socketio.emit('collaboration', collab)
+        self.state.append('collaborations', collab, maxlen=self.COMPLETED_HISTORY)
+        self.state.incr('collaborations')
+        self._emit('collaboration', collab)
     
     def get_system_metrics(self):
+        agents = self.agents
         return {
-            'total_agents': len(self.agents),
-            'active_agents': len([a for a in self.agents.values() if a.get('status') == 'busy']),
-            'tasks_in_queue': len(self.task_queue),
-            'tasks_completed': len(self.completed_tasks),
-            'active_collaborations': len(self.active_collaborations),
+            'total_agents': len(agents),
+            'active_agents': len([a for a in agents.values() if a.get('status') == 'busy']),
+            'tasks_in_queue': self.state.hlen('task_queue'),
+            'tasks_completed': int(self.state.counter('tasks_completed')),
+            'active_collaborations': int(self.state.counter('collaborations')),
             'avg_task_duration': self._calculate_avg_duration()
         }
     
     def _calculate_avg_duration(self):
-        if not self.completed_tasks: return 0
-        durations = [t.get('duration', 0) for t in self.completed_tasks if 'duration' in t]
-        if not durations: return 0
-        return sum(durations) / len(durations)
+        count = self.state.counter('duration_count')
+        if not count: return 0
+        return self.state.counter('duration_sum') / count
 
     def process_report(self, data):
         """Procesa datos unificados (Socket o HTTP)"""
         agent_id = data.get('agent_id', 'unknown')
         event_type = data.get('event')
+        self.reports_counter.labels(event_type or 'unknown').inc()
         
         if event_type == 'TASK_START':
             task_id = data['task_id']
             self.start_task(task_id, agent_id)
-            self.update_agent_status(agent_id, {'status': 'busy', 'current_task': data['task']})
+            self._update_running(agent_id, lambda running: running.__setitem__(task_id, data['task']))
         elif event_type == 'TASK_PROGRESS':
-            current = self.agents.get(agent_id, {})
-            if 'current_task' in current and current['current_task']:
-                current['current_task']['progress'] = data['progress']
-                self.update_agent_status(agent_id, current)
-        elif event_type == 'TASK_COMPLETE':
-            task_info = data.get('result', {}) # Or manage task_id
-            # Simplified completion logic for visualization
-            self.update_agent_status(agent_id, {'status': 'idle', 'current_task': None})
-            # Also emit general task complete if task ID matches active
-            # For simplicity we just ensure UI updates agent status
-            socketio.emit('task_complete', {'agent_id': agent_id, 'description': 'Tarea completada'})
+            task_id = data.get('task_id')
+            def set_progress(current):
+                running = (current or {}).get('running_tasks') or {}
+                task = running.get(task_id) if task_id else (current or {}).get('current_task')
+                if not task:
+                    return None
+                task['progress'] = data['progress']
+                if task_id and (current.get('current_task') or {}).get('id') == task_id:
+                    current['current_task']['progress'] = data['progress']
+                current['last_update'] = datetime.now().isoformat()
+                return current
+            agent = self.state.hupdate('agents', agent_id, set_progress)
+            if agent:
+                self._emit('agent_update', {'agent_id': agent_id, 'status': agent})
+        elif event_type in ('TASK_COMPLETE', 'TASK_ERROR'):
+            # Solo termina la tarea indicada: con varias en paralelo el agente sigue ocupado
+            task_id = data.get('task_id')
+            completed = task_id and self.complete_task(
+                task_id, data.get('result') if event_type == 'TASK_COMPLETE'
+                else {'status': 'error', 'error': data.get('error')})
+            self._update_running(agent_id, lambda running: running.pop(task_id, None) if task_id else running.clear())
+            if event_type == 'TASK_COMPLETE' and not completed:
+                # Tarea que el dashboard no tenía registrada: aviso mínimo para la UI
+                self._emit('task_complete', {'agent_id': agent_id, 'task_id': task_id, 'description': 'Tarea completada'})
             
         elif event_type == 'COLLABORATION_REQUEST':
             self.report_collaboration(agent_id, data['target_agent'], data['description'])
         elif event_type == 'IDLE_REQUEST':
             self.update_agent_status(agent_id, {'status': 'idle', 'requesting_work': True})
-            socketio.emit('work_available', {'agent_id': agent_id})
+            self._emit('work_available', {'agent_id': agent_id})
+
+
+class FleetAnalytics:
+    """Informes de flota sobre el historial de la memoria del agente (si existe en este host)"""
+    REFRESH_SECONDS = float(os.getenv('DASHBOARD_ANALYTICS_REFRESH_SECONDS', '5'))
+    MIN_BUCKET_SECONDS = 60
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.getenv('DASHBOARD_MEMORY_DB_PATH', os.getenv('MEMORY_DB_PATH', 'antigravity-memory.db'))
+        self.analytics = TaskAnalytics()
+        self.memory = None
+        self._synced_at = 0.0
+
+    def _sync(self):
+        if time.monotonic() - self._synced_at < self.REFRESH_SECONDS:
+            return
+        self._synced_at = time.monotonic()
+        if self.memory is None:
+            if not os.path.exists(self.db_path):
+                return
+            # Solo lectura: el dashboard no crea esquema ni toca la base del agente
+            self.memory = PersistentMemory(self.db_path, readonly=True)
+        self.analytics.sync(self.memory)
+
+    def report(self, days=None, bucket_seconds=3600):
+        self._sync()
+        try:
+            since = time.time() - float(days) * 86400 if days else None
+        except (TypeError, ValueError):
+            since = None
+        try:
+            bucket_seconds = float(bucket_seconds or 3600)
+        except (TypeError, ValueError):
+            bucket_seconds = 3600
+        # Intervalo mínimo; TaskAnalytics acota además el número de intervalos
+        bucket_seconds = max(bucket_seconds, self.MIN_BUCKET_SECONDS)
+        return self.analytics.fleet_report(since=since, bucket_seconds=bucket_seconds)
 
 
 dashboard = DashboardManager()
+fleet_analytics = FleetAnalytics()
+# Grabación opcional de /reports para reproducirla (replay_traffic.py)
+recorder = TrafficRecorder.from_env('DASHBOARD_RECORD_PATH')
+# Cada worker re-emite a sus clientes los eventos publicados en el backend compartido
+dashboard.state.start_listener(
+    lambda event, payload: socketio.emit(event, payload),
+    spawn=socketio.start_background_task
+)
 
 @app.route('/')
 def index():
@@ -144,15 +264,30 @@ def index():
 
 @app.route('/health')
 def health():
-    return json.dumps({'status': 'healthy', 'agents': len(dashboard.agents)})
+    return json.dumps({'status': 'healthy', 'agents': dashboard.state.hlen('agents')})
 
 # --- NEW: HTTP REST Endpoint for Reporting ---
 @app.route('/reports', methods=['POST'])
 def receive_report():
     data = request.json
+    if recorder:
+        recorder.record('http', 'report', data)
     dashboard.process_report(data)
     return jsonify({'status': 'received'})
 
+@app.route('/metrics')
+def metrics():
+    return Response(dashboard.telemetry.export_metrics('prometheus'),
+                    mimetype='text/plain; version=0.0.4')
+
+@app.route('/analytics/fleet')
+def fleet_report():
+    """Agregados por agente, tipo y hora; ?days=7&bucket=3600"""
+    return jsonify(fleet_analytics.report(
+        days=request.args.get('days', type=float),
+        bucket_seconds=request.args.get('bucket', 3600, type=int)
+    ))
+
 @app.route('/favicon.ico')
 def favicon():
     return "", 204
@@ -162,7 +297,7 @@ def handle_connect():
     emit('initial_state', {
         'agents': dashboard.agents,
         'task_queue': dashboard.task_queue,
-        'completed_tasks': dashboard.completed_tasks[-50:],
+        'completed_tasks': dashboard.state.tail('completed_tasks', 50),
         'metrics': dashboard.get_system_metrics()
     })
 
@@ -174,6 +309,11 @@ def handle_socket_report(data):
 def handle_metrics_request():
     emit('metrics_update', dashboard.get_system_metrics())
 
+@socketio.on('request_fleet_report')
+def handle_fleet_report_request(data=None):
+    data = data or {}
+    emit('fleet_report', fleet_analytics.report(days=data.get('days'), bucket_seconds=data.get('bucket', 3600)))
+
 if __name__ == '__main__':
     print("🚀 Dashboard Server running at http://0.0.0.0:8765")
     try:
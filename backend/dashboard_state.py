@@ -0,0 +1,324 @@
+# dashboard_state.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class MemoryStateBackend:
+    """Estado del dashboard en memoria del proceso (un solo worker)"""
+
+    shared = False
+
+    def __init__(self):
+        self._hashes = {}
+        self._lists = {}
+        self._counters = {}
+        self._subscribers = []
+
+    # --- Hashes (agents, task_queue, active_tasks) ---
+    def hset(self, table: str, key: str, value: Any):
+        self._hashes.setdefault(table, OrderedDict())[key] = value
+
+    def hget(self, table: str, key: str, default: Any = None) -> Any:
+        return self._hashes.get(table, {}).get(key, default)
+
+    def hdel(self, table: str, key: str) -> Optional[Any]:
+        return self._hashes.get(table, {}).pop(key, None)
+
+    def hupdate(self, table: str, key: str, update: Callable[[Optional[Any]], Any]) -> Optional[Any]:
+        """Lee-modifica-escribe `key`; si `update` devuelve None no se escribe nada"""
+        value = update(self.hget(table, key))
+        if value is not None:
+            self.hset(table, key, value)
+        return value
+
+    def hgetall(self, table: str) -> Dict[str, Any]:
+        return dict(self._hashes.get(table, {}))
+
+    def hlen(self, table: str) -> int:
+        return len(self._hashes.get(table, {}))
+
+    # --- Listas acotadas (completed_tasks, collaborations) ---
+    def append(self, table: str, value: Any, maxlen: int = None):
+        items = self._lists.get(table)
+        if items is None:
+            items = self._lists[table] = deque(maxlen=maxlen)
+        items.append(value)
+
+    def tail(self, table: str, count: int) -> List[Any]:
+        items = self._lists.get(table)
+        if not items:
+            return []
+        return list(items)[-count:]
+
+    # --- Contadores ---
+    def incr(self, name: str, amount: float = 1) -> float:
+        self._counters[name] = self._counters.get(name, 0) + amount
+        return self._counters[name]
+
+    def counter(self, name: str) -> float:
+        return self._counters.get(name, 0)
+
+    # --- Pub/Sub ---
+    def publish(self, event: str, payload: Any):
+        for callback in self._subscribers:
+            callback(event, payload)
+
+    def start_listener(self, callback: Callable[[str, Any], None],
+                       spawn: Callable = None):
+        """En memoria la entrega es síncrona: no hace falta hilo de escucha"""
+        self._subscribers.append(callback)
+
+
+class SQLiteStateBackend:
+    """
+    Estado y bus de eventos compartidos entre workers vía SQLite (WAL).
+
+    Cada worker escribe el estado en tablas comunes y publica los emits en
+    `dashboard_events`; un listener por worker sondea los eventos nuevos y
+    los re-emite a sus propios clientes Socket.IO.
+    """
+
+    shared = True
+
+    def __init__(self, db_path: str = "dashboard-state.db",
+                 poll_interval: float = 0.05, event_retention: int = 300, pool_size: int = 8):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.event_retention = event_retention
+        self.pool_size = pool_size
+        # Pool compartido: threading.local sería por greenlet con eventlet (una conexión por petición)
+        self._pool = []
+        self._pool_lock = threading.Lock()
+        self._init_schema()
+
+    def _open_connection(self):
+        conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False,
+                               isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """Toma una conexión del pool (o abre una) y la devuelve al terminar"""
+        with self._pool_lock:
+            conn = self._pool.pop() if self._pool else None
+        if conn is None:
+            conn = self._open_connection()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            with self._pool_lock:
+                if len(self._pool) < self.pool_size:
+                    self._pool.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def _init_schema(self):
+        with self._connection() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS dashboard_hash (
+                tbl TEXT,
+                key TEXT,
+                value TEXT,
+                seq INTEGER,
+                PRIMARY KEY (tbl, key)
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS dashboard_list (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tbl TEXT,
+                value TEXT
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_dashboard_list_tbl ON dashboard_list (tbl, id)")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS dashboard_counters (
+                name TEXT PRIMARY KEY,
+                value REAL
+            )
+            ''')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS dashboard_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event TEXT,
+                payload TEXT,
+                created_at REAL
+            )
+            ''')
+
+    # --- Hashes ---
+    @staticmethod
+    def _hset(conn, table: str, key: str, value: Any):
+        # Conservar el orden de inserción original al actualizar
+        conn.execute('''
+        INSERT INTO dashboard_hash (tbl, key, value, seq) VALUES (?, ?, ?, ?)
+        ON CONFLICT (tbl, key) DO UPDATE SET value = excluded.value
+        ''', (table, key, json.dumps(value, default=str), time.time_ns()))
+
+    def hset(self, table: str, key: str, value: Any):
+        with self._connection() as conn:
+            self._hset(conn, table, key, value)
+
+    def hget(self, table: str, key: str, default: Any = None) -> Any:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM dashboard_hash WHERE tbl = ? AND key = ?", (table, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def hdel(self, table: str, key: str) -> Optional[Any]:
+        with self._connection() as conn:
+            row = conn.execute(
+                "DELETE FROM dashboard_hash WHERE tbl = ? AND key = ? RETURNING value", (table, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def hupdate(self, table: str, key: str, update: Callable[[Optional[Any]], Any]) -> Optional[Any]:
+        """
+        Lee-modifica-escribe `key` dentro de una transacción BEGIN IMMEDIATE:
+        el bloqueo de escritura se toma antes de leer, así otro worker no puede
+        intercalar su propia escritura y perderse una de las dos.
+        """
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT value FROM dashboard_hash WHERE tbl = ? AND key = ?", (table, key)
+                ).fetchone()
+                value = update(json.loads(row[0]) if row else None)
+                if value is not None:
+                    self._hset(conn, table, key, value)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def hgetall(self, table: str) -> Dict[str, Any]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT key, value FROM dashboard_hash WHERE tbl = ? ORDER BY seq", (table,)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def hlen(self, table: str) -> int:
+        with self._connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM dashboard_hash WHERE tbl = ?", (table,)
+            ).fetchone()[0]
+
+    # --- Listas acotadas ---
+    def append(self, table: str, value: Any, maxlen: int = None):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO dashboard_list (tbl, value) VALUES (?, ?)",
+                (table, json.dumps(value, default=str))
+            )
+            if maxlen:
+                # Recorte por lista: los ids AUTOINCREMENT son comunes a todas
+                conn.execute('''
+                DELETE FROM dashboard_list WHERE tbl = ? AND id < (
+                    SELECT id FROM dashboard_list WHERE tbl = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+                )
+                ''', (table, table, maxlen - 1))
+
+    def tail(self, table: str, count: int) -> List[Any]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT value FROM dashboard_list WHERE tbl = ? ORDER BY id DESC LIMIT ?",
+                (table, count)
+            ).fetchall()
+        return [json.loads(r[0]) for r in reversed(rows)]
+
+    # --- Contadores ---
+    def incr(self, name: str, amount: float = 1) -> float:
+        with self._connection() as conn:
+            row = conn.execute('''
+            INSERT INTO dashboard_counters (name, value) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+            RETURNING value
+            ''', (name, amount)).fetchone()
+        return row[0]
+
+    def counter(self, name: str) -> float:
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM dashboard_counters WHERE name = ?", (name,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    # --- Pub/Sub ---
+    def publish(self, event: str, payload: Any):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO dashboard_events (event, payload, created_at) VALUES (?, ?, ?)",
+                (event, json.dumps(payload, default=str), time.time())
+            )
+
+    def poll(self, after_id: int, limit: int = 500) -> List[Tuple[int, str, Any]]:
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT id, event, payload FROM dashboard_events WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit)
+            ).fetchall()
+        return [(row_id, event, json.loads(payload)) for row_id, event, payload in rows]
+
+    def _last_event_id(self) -> int:
+        with self._connection() as conn:
+            row = conn.execute("SELECT MAX(id) FROM dashboard_events").fetchone()
+        return row[0] or 0
+
+    def _trim_events(self):
+        with self._connection() as conn:
+            conn.execute(
+                "DELETE FROM dashboard_events WHERE created_at < ?",
+                (time.time() - self.event_retention,)
+            )
+
+    def start_listener(self, callback: Callable[[str, Any], None],
+                       spawn: Callable = None):
+        """Arranca el bucle que re-emite los eventos publicados por cualquier worker"""
+        def listen():
+            last_id = self._last_event_id()
+            last_trim = time.time()
+            while True:
+                events = []
+                try:
+                    events = self.poll(last_id)
+                    for last_id, event, payload in events:
+                        callback(event, payload)
+                    if time.time() - last_trim > 60:
+                        self._trim_events()
+                        last_trim = time.time()
+                except Exception as e:
+                    print(f"⚠️ Error en listener de estado: {e}")
+                if not events:
+                    time.sleep(self.poll_interval)
+
+        if spawn:
+            spawn(listen)
+        else:
+            threading.Thread(target=listen, daemon=True).start()
+
+
+def create_state_backend(url: str = None):
+    """Crea el backend según DASHBOARD_STATE_BACKEND ('memory' o 'sqlite:///ruta.db')"""
+    url = url or os.getenv('DASHBOARD_STATE_BACKEND', 'memory')
+    if url == 'memory':
+        return MemoryStateBackend()
+    if url.startswith('sqlite://'):
+        prefix = 'sqlite:///' if url.startswith('sqlite:///') else 'sqlite://'
+        path = url[len(prefix):]
+        return SQLiteStateBackend(path or "dashboard-state.db")
+    raise ValueError(f"Backend de estado desconocido: {url}")
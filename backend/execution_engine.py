@@ -0,0 +1,186 @@
+# execution_engine.py
+import asyncio
+import os
+import re
+import shlex
+import signal
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+
+class OutputCapture:
+    """Guarda en memoria solo los primeros y los últimos bytes de una salida"""
+
+    def __init__(self, head_bytes: int, tail_bytes: int):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def feed(self, chunk: bytes):
+        self.total += len(chunk)
+        if len(self.head) < self.head_bytes:
+            take = self.head_bytes - len(self.head)
+            self.head += chunk[:take]
+            chunk = chunk[take:]
+        if chunk:
+            self.tail += chunk
+            if len(self.tail) > self.tail_bytes:
+                del self.tail[:len(self.tail) - self.tail_bytes]
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self.head) + len(self.tail)
+
+    def text(self) -> str:
+        head = self.head.decode(errors='replace')
+        tail = self.tail.decode(errors='replace')
+        if self.truncated:
+            omitted = self.total - len(self.head) - len(self.tail)
+            return f"{head}\n... [{omitted} bytes omitidos] ...\n{tail}"
+        return head + tail
+
+
+class ExecutionEngine:
+    """
+    Ejecuta comandos shell con salida en streaming.
+
+    La salida completa se escribe por bloques a ficheros de spool y en
+    memoria solo queda cabeza/cola acotadas. Soporta timeout por tarea,
+    límites de CPU/memoria (ulimit, POSIX) y un máximo de procesos
+    simultáneos.
+    """
+
+    def __init__(self, spool_dir: str = ".antigravity-spool", max_concurrent: int = 5,
+                 head_bytes: int = 4096, tail_bytes: int = 4096, chunk_size: int = 65536,
+                 default_timeout: float = 300, cpu_seconds: int = None, memory_mb: int = None,
+                 progress_interval: float = 1.0):
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.max_concurrent = max_concurrent
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.chunk_size = chunk_size
+        self.default_timeout = default_timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.progress_interval = progress_interval
+        self._semaphore = None  # Se crea dentro del loop
+
+    def _limited(self, command: str, cpu_seconds: Optional[int], memory_mb: Optional[int]) -> str:
+        """
+        Envuelve el comando con `ulimit` (POSIX): los límites los aplica el
+        propio shell hijo, sin preexec_fn (no es seguro con hilos).
+        """
+        if os.name != 'posix' or not (cpu_seconds or memory_mb):
+            return command
+        limits = []
+        if cpu_seconds:
+            limits.append(f"ulimit -t {int(cpu_seconds)}")
+        if memory_mb:
+            limits.append(f"ulimit -v {int(memory_mb) * 1024}")
+        return f"{' && '.join(limits)} && exec /bin/sh -c {shlex.quote(command)}"
+
+    def _spool_name(self, run_id: str) -> str:
+        """Nombre de fichero seguro para un id arbitrario (sin separadores) y único por ejecución"""
+        return f"{re.sub(r'[^A-Za-z0-9_-]', '_', str(run_id))[:64]}-{uuid.uuid4().hex[:8]}"
+
+    async def run_shell(self, command: str, timeout: float = None, cpu_seconds: int = None,
+                        memory_mb: int = None, on_progress: Callable[[Dict], None] = None,
+                        task_id: str = None) -> Dict:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        async with self._semaphore:
+            return await self._run(command, timeout or self.default_timeout,
+                                   cpu_seconds or self.cpu_seconds, memory_mb or self.memory_mb,
+                                   on_progress, task_id or uuid.uuid4().hex[:12])
+
+    async def _run(self, command, timeout, cpu_seconds, memory_mb, on_progress, run_id) -> Dict:
+        start = time.monotonic()
+        spool_name = self._spool_name(run_id)
+        stdout_path = self.spool_dir / f"{spool_name}.stdout"
+        stderr_path = self.spool_dir / f"{spool_name}.stderr"
+        stdout = OutputCapture(self.head_bytes, self.tail_bytes)
+        stderr = OutputCapture(self.head_bytes, self.tail_bytes)
+
+        proc = await asyncio.create_subprocess_shell(
+            self._limited(command, cpu_seconds, memory_mb),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True  # Grupo propio para poder matar a los hijos
+        )
+
+        progress = {'last': start}
+
+        def report():
+            now = time.monotonic()
+            if on_progress and now - progress['last'] >= self.progress_interval:
+                progress['last'] = now
+                on_progress({
+                    'elapsed': now - start,
+                    'stdout_bytes': stdout.total,
+                    'stderr_bytes': stderr.total
+                })
+
+        async def pump(stream, capture, path):
+            with open(path, 'wb') as spool:
+                while True:
+                    chunk = await stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    spool.write(chunk)
+                    capture.feed(chunk)
+                    report()
+
+        timed_out = False
+        pumps = asyncio.gather(pump(proc.stdout, stdout, stdout_path),
+                               pump(proc.stderr, stderr, stderr_path))
+        try:
+            await asyncio.wait_for(asyncio.shield(pumps), timeout)
+            await proc.wait()
+        except asyncio.TimeoutError:
+            timed_out = True
+            self._kill(proc)
+            await proc.wait()
+            await pumps
+        finally:
+            # Cancelación (revocación, apagado): el proceso no sobrevive a la tarea
+            if proc.returncode is None:
+                self._kill(proc)
+                # Los pumps siguen vivos bajo el shield: cerrarlos antes de borrar el spool
+                pumps.cancel()
+                await asyncio.gather(pumps, return_exceptions=True)
+                await proc.wait()  # SIGKILL: recoger el proceso es inmediato
+                stdout_path.unlink(missing_ok=True)
+                stderr_path.unlink(missing_ok=True)
+
+        truncated = stdout.truncated or stderr.truncated
+        result = {
+            'stdout': stdout.text(),
+            'stderr': stderr.text(),
+            'code': proc.returncode,
+            'timed_out': timed_out,
+            'truncated': truncated,
+            'stdout_bytes': stdout.total,
+            'stderr_bytes': stderr.total,
+            'duration': time.monotonic() - start
+        }
+        if truncated:
+            # La salida completa queda en el spool para quien la necesite
+            result['spool'] = {'stdout': str(stdout_path), 'stderr': str(stderr_path)}
+        else:
+            stdout_path.unlink(missing_ok=True)
+            stderr_path.unlink(missing_ok=True)
+        return result
+
+    def _kill(self, proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError, AttributeError):
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,206 @@
+# executors.py
+import shlex
+import shutil
+from pathlib import Path
+from string import Template
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+import requests
+
+EXECUTION_MODES = ('async', 'thread', 'process')
+
+
+class ExecutorRegistry:
+    """
+    Registro de ejecutores por tipo de tarea.
+
+    Cada ejecutor declara cómo se despacha:
+    - 'async': coroutine `func(task, agent)` en el event loop (E/S no bloqueante)
+    - 'thread': `func(task)` en el pool de hilos (E/S bloqueante)
+    - 'process': `func(task)` en el pool de procesos (CPU); debe ser una
+      función de módulo y recibir/devolver datos serializables
+
+    `cacheable=True` declara el ejecutor puro (mismo resultado para la misma
+    tarea, sin efectos): solo sus resultados se guardan en caché.
+    """
+
+    def __init__(self):
+        self._executors = {}
+        self._cacheable = set()
+
+    def register(self, task_type: str, mode: str = 'async', cacheable: bool = False):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"Modo de ejecución desconocido: {mode}")
+
+        def decorator(func):
+            self._executors[task_type] = (func, mode)
+            if cacheable:
+                self._cacheable.add(task_type)
+            else:
+                self._cacheable.discard(task_type)
+            return func
+        return decorator
+
+    def _resolve(self, task_type: str) -> str:
+        if task_type in self._executors:
+            return task_type
+        if 'general' in self._executors:
+            return 'general'
+        raise KeyError(f"No hay ejecutor para: {task_type}")
+
+    def get(self, task_type: str) -> Tuple[Callable, str]:
+        """Ejecutor para el tipo (o el de 'general' si no hay uno específico)"""
+        return self._executors[self._resolve(task_type)]
+
+    def is_cacheable(self, task_type: str) -> bool:
+        try:
+            return self._resolve(task_type) in self._cacheable
+        except KeyError:
+            return False
+
+    def task_types(self):
+        return list(self._executors)
+
+
+registry = ExecutorRegistry()
+register_executor = registry.register
+
+
+@register_executor('shell_commands', mode='async')
+async def execute_shell(task: Dict, agent) -> Dict:
+    cmd = task.get('command')
+    if not cmd:
+        return {'status': 'skipped', 'note': "shell_commands sin 'command'"}
+    return await agent.execution_engine.run_shell(
+        cmd,
+        timeout=task.get('timeout'),
+        on_progress=agent._progress_reporter(task),
+        task_id=task['id']
+    )
+
+
+@register_executor('git_operations', mode='async')
+async def execute_git(task: Dict, agent) -> Dict:
+    """Ejecuta `git <args>` (task['args'] lista o cadena) en task['cwd']"""
+    args = task.get('args') or task.get('command', 'status')
+    if isinstance(args, str):
+        args = shlex.split(args)
+    if args and args[0] == 'git':
+        args = args[1:]
+    cmd = shlex.join(['git', *args])
+    if task.get('cwd'):
+        cmd = f"cd {shlex.quote(task['cwd'])} && {cmd}"
+    return await agent.execution_engine.run_shell(
+        cmd,
+        timeout=task.get('timeout'),
+        on_progress=agent._progress_reporter(task),
+        task_id=task['id']
+    )
+
+
+@register_executor('data_processing', mode='process', cacheable=True)
+def execute_data_processing(task: Dict) -> Dict:
+    """Estadísticas sobre task['data'] (lista numérica); corre en el pool de procesos"""
+    data = np.asarray(task.get('data', []), dtype=float)
+    operation = task.get('operation', 'stats')
+    if data.size == 0:
+        return {'status': 'completed', 'operation': operation, 'count': 0}
+
+    if operation == 'sum':
+        return {'status': 'completed', 'operation': operation, 'value': float(data.sum())}
+    if operation == 'sort':
+        return {'status': 'completed', 'operation': operation, 'values': np.sort(data).tolist()}
+    if operation == 'histogram':
+        counts, edges = np.histogram(data, bins=int(task.get('bins', 10)))
+        return {'status': 'completed', 'operation': operation,
+                'counts': counts.tolist(), 'edges': edges.tolist()}
+
+    p50, p95, p99 = np.percentile(data, [50, 95, 99])
+    return {
+        'status': 'completed',
+        'operation': 'stats',
+        'count': int(data.size),
+        'mean': float(data.mean()),
+        'std': float(data.std()),
+        'min': float(data.min()),
+        'max': float(data.max()),
+        'p50': float(p50),
+        'p95': float(p95),
+        'p99': float(p99)
+    }
+
+
+@register_executor('file_operations', mode='thread')
+def execute_file_operation(task: Dict) -> Dict:
+    """read / write / append / list / stat / copy sobre task['path']"""
+    operation = task.get('operation', 'stat')
+    path = Path(task.get('path', '.'))
+
+    if operation == 'read':
+        max_bytes = int(task.get('max_bytes', 65536))
+        with open(path, 'rb') as f:
+            content = f.read(max_bytes + 1)
+        return {'status': 'completed', 'operation': operation, 'path': str(path),
+                'content': content[:max_bytes].decode(errors='replace'),
+                'truncated': len(content) > max_bytes}
+    if operation in ('write', 'append'):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'a' if operation == 'append' else 'w', encoding='utf-8') as f:
+            written = f.write(task.get('content', ''))
+        return {'status': 'completed', 'operation': operation, 'path': str(path), 'bytes': written}
+    if operation == 'list':
+        entries = sorted(p.name + ('/' if p.is_dir() else '') for p in path.iterdir())
+        limit = int(task.get('limit', 1000))
+        return {'status': 'completed', 'operation': operation, 'path': str(path),
+                'entries': entries[:limit], 'total': len(entries)}
+    if operation == 'copy':
+        destination = shutil.copy2(path, task['destination'])
+        return {'status': 'completed', 'operation': operation, 'path': str(path),
+                'destination': str(destination)}
+
+    stat = path.stat()
+    return {'status': 'completed', 'operation': 'stat', 'path': str(path),
+            'size': stat.st_size, 'modified': stat.st_mtime, 'is_dir': path.is_dir()}
+
+
+@register_executor('api_calls', mode='thread')
+def execute_api_call(task: Dict) -> Dict:
+    """Petición HTTP (task['url'], 'method', 'json', 'headers'); devuelve el cuerpo acotado"""
+    response = requests.request(
+        task.get('method', 'GET'),
+        task['url'],
+        json=task.get('json'),
+        headers=task.get('headers'),
+        timeout=float(task.get('timeout', 30))
+    )
+    max_bytes = int(task.get('max_bytes', 65536))
+    return {
+        'status': 'completed',
+        'http_status': response.status_code,
+        'content_type': response.headers.get('Content-Type'),
+        'body': response.content[:max_bytes].decode(errors='replace'),
+        'truncated': len(response.content) > max_bytes
+    }
+
+
+@register_executor('code_generation', mode='thread')
+def execute_code_generation(task: Dict) -> Dict:
+    """Renderiza task['template'] con task['variables'] y opcionalmente lo escribe en output_path"""
+    code = Template(task.get('template', '')).safe_substitute(task.get('variables', {}))
+    result = {'status': 'completed', 'lines': code.count('\n') + 1 if code else 0}
+    if task.get('output_path'):
+        output = Path(task['output_path'])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(code, encoding='utf-8')
+        result['output_path'] = str(output)
+    else:
+        result['code'] = code
+    return result
+
+
+@register_executor('general', mode='async')
+async def execute_general(task: Dict, agent) -> Dict:
+    if task.get('command'):
+        return await execute_shell(task, agent)
+    return {'status': 'completed', 'note': f"Executed {task.get('type', 'general')}"}
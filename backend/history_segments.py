@@ -0,0 +1,105 @@
+# history_segments.py
+"""
+Segmentos columnares comprimidos (npz) para el historial de tareas archivado.
+
+Cada partición archivada es un fichero `.npz` con una entrada por columna,
+que np.load descomprime solo al acceder: una consulta lee únicamente las
+columnas que usa. Codificación por tipo de columna:
+  - numéricas (duration, recorded_at): float64, NaN para nulos;
+  - de baja cardinalidad (agent_id, task_type, status): diccionario
+    `<col>__dict` + códigos `<col>__codes` (int32);
+  - texto libre: bytes UTF-8 concatenados `<col>__data` + `<col>__offsets`.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+COLUMNS = ('task_id', 'agent_id', 'task_type', 'description', 'status', 'start_time', 'end_time',
+           'duration', 'result', 'metadata', 'recorded_at')
+NUMERIC_COLUMNS = frozenset({'duration', 'recorded_at'})
+DICTIONARY_COLUMNS = frozenset({'agent_id', 'task_type', 'status'})
+
+
+def _encode_strings(values: Sequence[Optional[str]]) -> Dict[str, np.ndarray]:
+    encoded = [(v if v is not None else '').encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return {'data': np.frombuffer(b''.join(encoded), dtype=np.uint8), 'offsets': offsets}
+
+
+def write_segment(path, rows: Iterable[Sequence], period_start: float, period_end: float) -> int:
+    """Escribe filas (en el orden de COLUMNS) como segmento; devuelve el nº de filas"""
+    rows = list(rows)
+    columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+    arrays = {}
+    for name, values in zip(COLUMNS, columns):
+        if name in NUMERIC_COLUMNS:
+            arrays[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        elif name in DICTIONARY_COLUMNS:
+            dictionary, codes = np.unique(np.array([v or '' for v in values], dtype=str), return_inverse=True)
+            arrays[f'{name}__dict'] = dictionary
+            arrays[f'{name}__codes'] = codes.astype(np.int32)
+        else:
+            for part, array in _encode_strings(values).items():
+                arrays[f'{name}__{part}'] = array
+    meta = {'rows': len(rows), 'period_start': period_start, 'period_end': period_end}
+    arrays['__meta__'] = np.array(json.dumps(meta))
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+    return len(rows)
+
+
+class Segment:
+    """Lectura perezosa de un segmento; usar como context manager"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._npz = np.load(self.path, allow_pickle=False)
+        self.meta = json.loads(str(self._npz['__meta__']))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._npz.close()
+
+    @property
+    def rows(self) -> int:
+        return self.meta['rows']
+
+    def numeric(self, name: str) -> np.ndarray:
+        return self._npz[name]
+
+    def dictionary(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(diccionario, códigos) de una columna de baja cardinalidad"""
+        return self._npz[f'{name}__dict'], self._npz[f'{name}__codes']
+
+    def codes(self, name: str, value: str) -> Optional[np.ndarray]:
+        """Máscara booleana de filas con `name == value` (None si el valor no aparece)"""
+        dictionary = self._npz[f'{name}__dict']
+        index = np.searchsorted(dictionary, value)
+        if index >= len(dictionary) or dictionary[index] != value:
+            return None
+        return self._npz[f'{name}__codes'] == index
+
+    def column(self, name: str) -> List:
+        """Columna decodificada como lista de Python"""
+        if name in NUMERIC_COLUMNS:
+            return [None if np.isnan(v) else float(v) for v in self._npz[name]]
+        if name in DICTIONARY_COLUMNS:
+            return self._npz[f'{name}__dict'][self._npz[f'{name}__codes']].tolist()
+        data = self._npz[f'{name}__data'].tobytes()
+        offsets = self._npz[f'{name}__offsets']
+        return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
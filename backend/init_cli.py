@@ -7,16 +7,23 @@ import argparse
 from pathlib import Path
 import json
 import random
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import websockets
+from websockets.protocol import State
 from dotenv import load_dotenv
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from intelligent_cache import IntelligentCache
+from intelligent_cache import IntelligentCache, task_fingerprint
+from maintenance import OnlineMaintenance
 from persistent_memory import PersistentMemory
 from reporting_protocol import AgentReporter
+from execution_engine import ExecutionEngine
+from executors import registry as executor_registry
+from result_store import ResultStore, is_failed_result, start_result_server
+from streaming_stats import BloomFilter
 from sync_manager import SyncManager, DistributedCache
-from telemetry import TelemetrySystem, StructuredLogger
+from telemetry import TelemetrySystem, StructuredLogger, JsonLinesSink, default_console_sink, monitor
 
 class AntiGravityCLI:
     def __init__(self, config_path=".antigravityrc"):
@@ -32,12 +39,32 @@ class AntiGravityCLI:
         self.reporter = None
         self.sync_manager = None
         self.distributed_cache = None
+        self.execution_engine = None
+        self.result_store = None
+        self.thread_pool = None
+        self.maintenance = None
+        self.process_pool = None
+        self.running_tasks = {}  # task_id (o batch_id) -> tarea o lote en ejecución
+        self.pending_tasks = {}  # task_id -> elemento en cola aún no empezado (revocable)
+        self.cache_filter = None    # Huellas de tareas en caché (se anuncian en HEARTBEAT)
+        self.context_filter = None  # Claves de contexto replicadas localmente
+        self._affinity_dirty = True
+        self._affinity_built_at = 0.0
         
-        self.status = 'initializing'
+        self._connection_status = 'initializing'
         self.task_queue = None # Will init in start
         self.ws_connection = None
         self.reconnect_delay = 5
 
+    @property
+    def status(self):
+        """'busy' mientras haya tareas en ejecución; si no, el estado de la conexión"""
+        return 'busy' if self.running_tasks else self._connection_status
+
+    @status.setter
+    def status(self, value):
+        self._connection_status = value
+
     def _load_config(self):
         config = {}
         config_path = Path(".antigravityrc")
@@ -61,7 +88,33 @@ class AntiGravityCLI:
             'ENABLE_REALTIME_REPORTING': 'true',
             'AUTO_REQUEST_TASKS': 'true',
             'HEARTBEAT_INTERVAL_MS': '5000',
-            'IDLE_TIMEOUT_SECONDS': '10'
+            'IDLE_TIMEOUT_SECONDS': '10',
+            'SPOOL_DIR': '.antigravity-spool',
+            'TASK_TIMEOUT_SECONDS': '300',
+            'TASK_CPU_SECONDS': '',
+            'TASK_MEMORY_MB': '',
+            'EXECUTOR_THREADS': '8',
+            'EXECUTOR_PROCESSES': '',
+            'RESULT_STORE_DIR': '.antigravity-results',
+            'RESULT_INLINE_MAX_BYTES': '8192',
+            'RESULT_SERVER_HOST': '127.0.0.1',
+            'RESULT_SERVER_PORT': '8790',
+            'RESULT_PUBLIC_URL': '',
+            'AFFINITY_FILTER_CAPACITY': '4096',
+            'AFFINITY_REBUILD_SECONDS': '300',
+            'HEARTBEAT_MAX_PENDING_IDS': '100',
+            'MAINTENANCE_INTERVAL_SECONDS': '60',
+            'MAINTENANCE_BUDGET_MS': '50',
+            'MAINTENANCE_MAX_DEFERRALS': '10',
+            'TASK_HISTORY_RETENTION_DAYS': '30',
+            'TASK_HISTORY_PARTITION': 'day',
+            'TASK_HISTORY_ARCHIVE_DIR': '',
+            'TASK_HISTORY_ARCHIVE_RETENTION_DAYS': '365',
+            'RESULT_RETENTION_DAYS': '7',
+            'LOG_LEVEL': 'INFO',
+            'LOG_FILE': '',
+            'LOG_MAX_BYTES': str(10 * 1024 * 1024),
+            'LOG_BACKUP_COUNT': '5'
         }
         for k, v in defaults.items():
             if k not in config: config[k] = v
@@ -70,18 +123,68 @@ class AntiGravityCLI:
     async def _init_components(self):
         """Asynchronous component initialization"""
         self.telemetry = TelemetrySystem()
-        self.logger = StructuredLogger(self.agent_id, self.telemetry)
+        sinks = [default_console_sink()]
+        if self.config.get('LOG_FILE'):
+            sinks.append(JsonLinesSink(
+                self.config['LOG_FILE'],
+                max_bytes=int(self.config['LOG_MAX_BYTES']),
+                backup_count=int(self.config['LOG_BACKUP_COUNT'])
+            ))
+        self.logger = StructuredLogger(self.agent_id, self.telemetry,
+                                       level=self.config['LOG_LEVEL'], sinks=sinks)
+        self.tasks_counter = self.telemetry.counter(
+            'antigravity_agent_tasks', 'Tareas ejecutadas por el agente', ['task_type', 'status']
+        )
         
         cache_path = self.config.get('CACHE_DIR', '.antigravity-cache')
         self.cache = IntelligentCache(
             cache_dir=cache_path,
             max_size_mb=int(self.config['CACHE_MAX_SIZE_MB'])
         )
-        self.memory = PersistentMemory(self.config['MEMORY_DB_PATH'])
+        self.memory = PersistentMemory(
+            self.config['MEMORY_DB_PATH'],
+            partition_by=self.config['TASK_HISTORY_PARTITION'],
+            archive_dir=self.config['TASK_HISTORY_ARCHIVE_DIR'] or None
+        )
         self.reporter = AgentReporter(self.agent_id, self.config['REPORT_ENDPOINT'])
         
         self.sync_manager = SyncManager()
-        self.distributed_cache = DistributedCache(self.sync_manager)
+        self.distributed_cache = DistributedCache(self.sync_manager, telemetry=self.telemetry)
+        self.distributed_cache.register_agent_cache(self.agent_id)
+        self.sync_manager.add_read_listener(self._on_context_read)
+        self._rebuild_affinity_filters()
+        
+        self.execution_engine = ExecutionEngine(
+            spool_dir=self.config['SPOOL_DIR'],
+            max_concurrent=int(self.config['MAX_CONCURRENT_TASKS']),
+            default_timeout=float(self.config['TASK_TIMEOUT_SECONDS']),
+            cpu_seconds=int(self.config['TASK_CPU_SECONDS']) if self.config['TASK_CPU_SECONDS'] else None,
+            memory_mb=int(self.config['TASK_MEMORY_MB']) if self.config['TASK_MEMORY_MB'] else None
+        )
+        
+        # Sin RESULT_PUBLIC_URL no hay servidor de resultados: todo viaja inline
+        self.result_store = ResultStore(
+            self.config['RESULT_STORE_DIR'],
+            inline_max_bytes=int(self.config['RESULT_INLINE_MAX_BYTES']),
+            base_url=self.config['RESULT_PUBLIC_URL'] or None
+        )
+        
+        # Pools para ejecutores bloqueantes ('thread') y de CPU ('process', se crea al primer uso)
+        self.thread_pool = ThreadPoolExecutor(
+            max_workers=int(self.config['EXECUTOR_THREADS']), thread_name_prefix='executor'
+        )
+        
+        self.maintenance = OnlineMaintenance(
+            memory_db=self.config['MEMORY_DB_PATH'],
+            cache_dir=cache_path,
+            spool_dir=self.config['SPOOL_DIR'],
+            result_dir=self.config['RESULT_STORE_DIR'],
+            retention_days=int(self.config['TASK_HISTORY_RETENTION_DAYS']),
+            result_retention_days=int(self.config['RESULT_RETENTION_DAYS']),
+            archive_retention_days=int(self.config['TASK_HISTORY_ARCHIVE_RETENTION_DAYS']),
+            budget=int(self.config['MAINTENANCE_BUDGET_MS']) / 1000,
+            memory=self.memory
+        )
         
         self.task_queue = asyncio.Queue()
         
@@ -91,17 +194,46 @@ class AntiGravityCLI:
         # Init components inside the running loop
         await self._init_components()
         self.logger.info("🚀 Iniciando AntiGravity CLI Agent")
-        await self._connection_manager()
+        if self.config['RESULT_PUBLIC_URL'] and self.config['RESULT_SERVER_PORT']:
+            try:
+                await start_result_server(self.result_store, self.config['RESULT_SERVER_HOST'],
+                                          int(self.config['RESULT_SERVER_PORT']))
+            except OSError as e:
+                self.logger.warning("Servidor de resultados no disponible (%s): resultados inline", e)
+                self.result_store.base_url = None
+        maintenance = None
+        if float(self.config['MAINTENANCE_INTERVAL_SECONDS']) > 0:
+            maintenance = asyncio.create_task(self._maintenance_worker())
+        try:
+            await self._connection_manager()
+        finally:
+            if maintenance:
+                maintenance.cancel()
+            self.thread_pool.shutdown(wait=False, cancel_futures=True)
+            if self.process_pool:
+                self.process_pool.shutdown(wait=False, cancel_futures=True)
+
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        """Crea el pool de procesos solo si algún ejecutor mode='process' llega a usarse"""
+        if self.process_pool is None:
+            self.process_pool = ProcessPoolExecutor(
+                max_workers=int(self.config['EXECUTOR_PROCESSES'] or os.cpu_count() or 1)
+            )
+        return self.process_pool
 
     async def _connection_manager(self):
         while True:
+            tasks = []
             try:
                 await self._connect_to_coordination_server()
                 await self._register_agent()
                 self.reconnect_delay = 5
                 
+                # Un procesador por slot: las tareas de thread/process corren en paralelo
                 tasks = [
-                    asyncio.create_task(self._task_processor()),
+                    asyncio.create_task(self._task_processor())
+                    for _ in range(int(self.config['MAX_CONCURRENT_TASKS']))
+                ] + [
                     asyncio.create_task(self._heartbeat_worker()),
                     asyncio.create_task(self._auto_request_worker()),
                     asyncio.create_task(self.sync_manager.start_sync_worker()),
@@ -115,10 +247,15 @@ class AntiGravityCLI:
                 await asyncio.gather(*tasks)
             except Exception as e:
                 if self.logger:
-                    self.logger.error(f"❌ Desconectado: {e}")
+                    self.logger.error("❌ Desconectado: %s", e)
                 else:
                     print(f"❌ Error crítico: {e}")
                 self.ws_connection = None
+            finally:
+                # Los workers de la conexión anterior no deben sobrevivir al reintento
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
                 
             print(f"🔄 Reintentando en {self.reconnect_delay}s...")
             await asyncio.sleep(self.reconnect_delay)
@@ -139,11 +276,31 @@ class AntiGravityCLI:
                 'type': self.config['AGENT_TYPE'],
                 'capabilities': caps,
                 'max_concurrent_tasks': int(self.config['MAX_CONCURRENT_TASKS']),
+                'supports_batches': True,
                 'status': 'idle'
             }
         }
         if self.ws_connection:
             await self.ws_connection.send(json.dumps(reg_data))
+            # Tras (re)conectar, vuelve a suscribirse a todo lo leído hasta ahora
+            await self._subscribe_context(sorted(self.sync_manager.read_keys))
+
+    async def _subscribe_context(self, keys):
+        """Pide al coordinador los cambios de estas claves (responde con un resync completo)"""
+        if keys and self.ws_connection:
+            await self.ws_connection.send(json.dumps({
+                'type': 'CONTEXT_SUBSCRIBE',
+                'agent_id': self.agent_id,
+                'keys': keys
+            }))
+
+    def _on_context_read(self, context_key):
+        """Primera lectura local de una clave: suscripción en segundo plano"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Sin loop: se suscribe al registrarse
+        loop.create_task(self._subscribe_context([context_key]))
 
     async def _request_task_from_coordinator(self):
         if self.ws_connection:
@@ -161,105 +318,339 @@ class AntiGravityCLI:
                 data = json.loads(message)
                 if data.get('type') == 'TASK_ASSIGNMENT':
                     task = data.get('task')
+                    self.pending_tasks[task['id']] = task
                     await self.task_queue.put(task)
-                    self.logger.info(f"📥 Tarea recibida: {task.get('id')}")
+                    self.logger.info("📥 Tarea recibida: %s", task.get('id'))
+                elif data.get('type') == 'TASK_BATCH_ASSIGNMENT':
+                    # Un lote ocupa un único slot de procesamiento
+                    batch = {'batch_id': data['batch_id'], 'tasks': data.get('tasks', [])}
+                    for task in batch['tasks']:
+                        self.pending_tasks[task['id']] = batch
+                    await self.task_queue.put(batch)
+                    self.logger.info("📥 Lote recibido: %s (%d tareas)", data['batch_id'], len(batch['tasks']))
+                elif data.get('type') == 'TASK_REVOKE':
+                    await self._revoke_tasks(data.get('task_ids', []))
+                elif data.get('type') == 'CONTEXT_UPDATE_BATCH':
+                    await self._apply_context_updates(data.get('updates', []))
+                    for update in data.get('updates', []):
+                        if update.get('context_key') not in self.context_filter:
+                            self.context_filter.add(update['context_key'])
+                            self._affinity_dirty = True
         except websockets.exceptions.ConnectionClosed:
             raise Exception("Connection closed")
 
+    async def _revoke_tasks(self, task_ids):
+        """
+        Retira de la cola local las tareas aún no empezadas que pide el
+        coordinador y le confirma cuáles eran (las ya empezadas siguen aquí).
+        """
+        revoked = []
+        for task_id in task_ids:
+            item = self.pending_tasks.pop(task_id, None)
+            if item is None:
+                continue
+            if 'batch_id' in item:
+                item['tasks'] = [t for t in item['tasks'] if t['id'] != task_id]
+            else:
+                item['revoked'] = True
+            revoked.append(task_id)
+        if revoked:
+            self.logger.info("↩️  %d tareas revocadas por el coordinador", len(revoked))
+        if self.ws_connection:
+            await self.ws_connection.send(json.dumps({
+                'type': 'TASK_REVOKED',
+                'agent_id': self.agent_id,
+                'task_ids': revoked
+            }))
+
+    async def _apply_context_updates(self, updates):
+        """Aplica deltas de contexto replicados; pide resync si hay huecos de versión"""
+        stale = [u['context_key'] for u in updates if not self.sync_manager.apply_remote_update(u)]
+        if stale and self.ws_connection:
+            await self.ws_connection.send(json.dumps({
+                'type': 'CONTEXT_RESYNC_REQUEST',
+                'agent_id': self.agent_id,
+                'keys': stale
+            }))
+
+    async def publish_shared_crdt(self, context_key):
+        """
+        Publica una réplica CRDT local (obtenida con sync_manager.get_crdt).
+        Las escrituras sobre la réplica son locales; esto solo las propaga.
+        """
+        entry = self.sync_manager.publish_crdt(self.agent_id, context_key)
+        if self.ws_connection:
+            await self.ws_connection.send(json.dumps({
+                'type': 'CONTEXT_SYNC',
+                'agent_id': self.agent_id,
+                'context_key': context_key,
+                'value': entry['value'],
+                'vclock': entry['vclock'],
+                'timestamp': entry['timestamp']
+            }))
+        return entry
+
     async def _task_processor(self):
         while True:
-            if not self.ws_connection or self.ws_connection.closed:
+            if not self.ws_connection or self.ws_connection.state is not State.OPEN:
                 await asyncio.sleep(1)
                 continue
             try:
                 task = await asyncio.wait_for(self.task_queue.get(), timeout=1.0)
+                if task.get('revoked') or ('batch_id' in task and not task['tasks']):
+                    # Revocada mientras esperaba: ya se reasignó a otro agente
+                    self.task_queue.task_done()
+                    continue
+                for started in task['tasks'] if 'batch_id' in task else [task]:
+                    self.pending_tasks.pop(started['id'], None)
+                running_id = task.get('batch_id') or task['id']
+                self.running_tasks[running_id] = task
                 try:
-                    await self._execute_task(task)
+                    if 'batch_id' in task:
+                        await self._execute_batch(task)
+                    else:
+                        await self._execute_task(task)
                 except Exception as e:
-                    self.logger.error(f"Error tarea: {e}")
-                    self.reporter.report_error(str(e))
+                    self.logger.error("Error tarea: %s", e)
+                    self.reporter.report_error(str(e), task_id=running_id)
+                    await self._report_failure(task, str(e))
                 finally:
+                    self.running_tasks.pop(running_id, None)
                     self.task_queue.task_done()
             except asyncio.TimeoutError:
                 continue
             except Exception:
                 await asyncio.sleep(1)
 
+    async def _report_failure(self, item, error):
+        """Completa con error una tarea o lote que falló: el coordinador la libera y avanza su grafo"""
+        if not self.ws_connection:
+            return
+        failure = {'status': 'error', 'error': error}
+        if 'batch_id' in item:
+            message = {
+                'type': 'TASK_BATCH_COMPLETE',
+                'agent_id': self.agent_id,
+                'batch_id': item['batch_id'],
+                'results': [{'task_id': t['id'], 'result': failure, 'duration': None} for t in item['tasks']]
+            }
+        else:
+            message = {'type': 'TASK_COMPLETE', 'agent_id': self.agent_id, 'task': item, 'result': failure}
+        try:
+            await self.ws_connection.send(json.dumps(message))
+        except websockets.exceptions.ConnectionClosed:
+            pass  # Al cerrarse la conexión el coordinador reencola sus tareas
+
+    @monitor('agent.execute_task')
     async def _execute_task(self, task):
-        self.status = 'busy'
-        self.current_task = task
         self.reporter.start_task(task['id'], task['description'])
         
+        result, record = await self._run_task(task)
+        
+        if self.ws_connection:
+            await self.ws_connection.send(json.dumps({
+                'type': 'TASK_COMPLETE',
+                'agent_id': self.agent_id,
+                'task': task,
+                'result': result
+            }))
+            
+        self.reporter.complete_task(result=result, task_id=task['id'])
+        self.memory.store_task(record)
+        
+        if self.config['AUTO_REQUEST_TASKS'] == 'true':
+            await self._request_task_from_coordinator()
+
+    @monitor('agent.execute_batch')
+    async def _execute_batch(self, batch):
+        """
+        Ejecuta un lote de tareas pequeñas en orden y devuelve una sola
+        completación; el reporte HTTP y la escritura en memoria también son
+        uno por lote. Un fallo solo afecta a su tarea.
+        """
+        tasks = batch['tasks']
+        if not tasks:
+            return
+        self.reporter.start_task(batch['batch_id'], f"Lote de {len(tasks)} tareas {tasks[0]['type']}")
+        
+        results, records = [], []
+        for task in tasks:
+            try:
+                result, record = await self._run_task(task)
+                records.append(record)
+                duration = record['duration']
+            except Exception as e:
+                self.logger.error("Error tarea %s del lote: %s", task.get('id'), e)
+                self.tasks_counter.labels(task['type'], 'failed').inc()
+                result, duration = {'status': 'error', 'error': str(e)}, None
+            results.append({'task_id': task['id'], 'result': result, 'duration': duration})
+        
+        if self.ws_connection:
+            await self.ws_connection.send(json.dumps({
+                'type': 'TASK_BATCH_COMPLETE',
+                'agent_id': self.agent_id,
+                'batch_id': batch['batch_id'],
+                'results': results
+            }))
+        
+        failed = sum(is_failed_result(r['result']) for r in results)
+        self.reporter.complete_task(result={'batch_id': batch['batch_id'], 'tasks': len(tasks), 'failed': failed},
+                                    task_id=batch['batch_id'])
+        if records:
+            self.memory.store_tasks(records)
+        
+        if self.config['AUTO_REQUEST_TASKS'] == 'true':
+            await self._request_task_from_coordinator()
+
+    async def _run_task(self, task):
+        """Resultado de una tarea (de caché o ejecutándola) y su registro para la memoria"""
         start_time = asyncio.get_event_loop().time()
-        cache_key = f"task:{task['type']}:{hash(str(task.get('description')))}"
+        fingerprint = task_fingerprint(task)
+        cache_key = f"task:{fingerprint}"
         
-        cached = self.cache.get(cache_key)
+        # Solo ejecutores puros o tareas marcadas `cacheable`: repetir un efecto no se sirve de caché
+        cacheable = task.get('cacheable', executor_registry.is_cacheable(task['type'])) is True
+        cached = self.cache.get(cache_key) if cacheable else None
         if cached:
             self.logger.info("✅ Obtenido de caché")
             result = cached
         else:
-            self.logger.info(f"Ejecutando: {task['description']}")
+            self.logger.info("Ejecutando: %s", task['description'])
             result = await self._route_and_execute(task)
-            self.cache.set(cache_key, result, context=task)
+            # Resultados grandes: se guardan una vez y viaja solo la referencia
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.thread_pool, self.result_store.offload, result
+            )
+            if cacheable and not is_failed_result(result):
+                # La huella ya identifica el trabajo: sin contexto, para que get() la encuentre
+                self.cache.set(cache_key, result)
+                self.cache_filter.add(fingerprint)
+                self._affinity_dirty = True
             
         dur = asyncio.get_event_loop().time() - start_time
         
-        if self.ws_connection:
-            await self.ws_connection.send(json.dumps({
-                'type': 'TASK_COMPLETE',
-                'agent_id': self.agent_id,
-                'task': task,
-                'result': result
-            }))
-            
-        self.reporter.complete_task(result=result)
-        self.memory.store_task({
+        status = 'failed' if is_failed_result(result) else 'completed'
+        self.telemetry.record_metric("task.duration", dur, tags={'task_type': task['type']})
+        self.tasks_counter.labels(task['type'], status).inc()
+        return result, {
             'task_id': task['id'],
             'agent_id': self.agent_id,
             'task_type': task['type'],
             'description': task['description'],
-            'status': 'completed',
+            'status': status,
             'start_time': start_time,
             'end_time': asyncio.get_event_loop().time(),
             'duration': dur,
             'result': result
-        })
-        self.telemetry.record_metric(f"task.{task['type']}.duration", dur)
-        self.telemetry.record_metric(f"task.{task['type']}.success", 1)
-        
-        self.current_task = None
-        self.status = 'idle'
-        if self.config['AUTO_REQUEST_TASKS'] == 'true':
-            await self._request_task_from_coordinator()
+        }
 
+    @monitor('agent.route_and_execute')
     async def _route_and_execute(self, task):
-        t_type = task['type']
-        if t_type == 'shell_commands':
-            cmd = task.get('command')
-            if cmd:
-                proc = await asyncio.create_subprocess_shell(
-                    cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
-                stdout, stderr = await proc.communicate()
-                return {'stdout': stdout.decode(), 'stderr': stderr.decode(), 'code': proc.returncode}
-        
-        await asyncio.sleep(1)
-        return {'status': 'completed', 'note': f"Executed {t_type}"}
+        executor, mode = executor_registry.get(task['type'])
+        if mode == 'async':
+            return await executor(task, self)
+        pool = self._get_process_pool() if mode == 'process' else self.thread_pool
+        return await asyncio.get_running_loop().run_in_executor(pool, executor, task)
+
+    def _progress_reporter(self, task):
+        """Callback de progreso: TASK_PROGRESS al coordinador y al dashboard sin bloquear el loop"""
+        loop = asyncio.get_running_loop()
+        estimated = task.get('estimated_duration')
+
+        def on_progress(info):
+            percent = min(99, int(info['elapsed'] / estimated * 100)) if estimated else 0
+            message = f"{info['stdout_bytes']} bytes de salida ({info['elapsed']:.0f}s)"
+            loop.run_in_executor(None, self.reporter.update_progress, percent, message, task['id'])
+            if self.ws_connection:
+                asyncio.ensure_future(self.ws_connection.send(json.dumps({
+                    'type': 'TASK_PROGRESS',
+                    'agent_id': self.agent_id,
+                    'task_id': task['id'],
+                    'progress': percent,
+                    **info
+                })))
+        return on_progress
+
+    def _rebuild_affinity_filters(self):
+        """
+        Reconstruye los filtros de Bloom desde la caché y el contexto locales.
+        Los filtros no admiten borrados: rehacerlos de vez en cuando descarta
+        las entradas expiradas o desalojadas.
+        """
+        fingerprints = [key[len('task:'):] for key in self.cache.keys('task:')]
+        context_keys = list(self.sync_manager.shared_context)
+        capacity = int(self.config['AFFINITY_FILTER_CAPACITY'])
+        self.cache_filter = BloomFilter(max(capacity, 2 * len(fingerprints)))
+        self.cache_filter.update(fingerprints)
+        self.context_filter = BloomFilter(max(capacity, 2 * len(context_keys)))
+        self.context_filter.update(context_keys)
+        self._affinity_built_at = asyncio.get_event_loop().time()
+        self._affinity_dirty = True
+
+    def _affinity_summary(self):
+        """Filtros para el HEARTBEAT; solo si cambiaron desde el último envío"""
+        now = asyncio.get_event_loop().time()
+        if (now - self._affinity_built_at > float(self.config['AFFINITY_REBUILD_SECONDS'])
+                or self.cache_filter.count > 2 * int(self.config['AFFINITY_FILTER_CAPACITY'])):
+            self._rebuild_affinity_filters()
+        if not self._affinity_dirty:
+            return None
+        self._affinity_dirty = False
+        return {'cache': self.cache_filter.to_dict(), 'context': self.context_filter.to_dict()}
 
     async def _heartbeat_worker(self):
         interval = int(self.config['HEARTBEAT_INTERVAL_MS']) / 1000
+        # Conexión nueva: el coordinador aún no conoce los filtros
+        self._affinity_dirty = True
         while True:
             await asyncio.sleep(interval)
+            self.distributed_cache.export_stats()
             if self.ws_connection:
+                # Profundidad de la cola local e ids pendientes (los más recientes, revocables)
+                pending_ids = list(self.pending_tasks)[-int(self.config['HEARTBEAT_MAX_PENDING_IDS']):]
+                heartbeat = {
+                    'type': 'HEARTBEAT',
+                    'agent_id': self.agent_id,
+                    'status': self.status,
+                    'queue_depth': len(self.pending_tasks),
+                    'pending_task_ids': pending_ids
+                }
+                affinity = self._affinity_summary()
+                if affinity:
+                    heartbeat['affinity'] = affinity
                 try:
-                    await self.ws_connection.send(json.dumps({
-                        'type': 'HEARTBEAT',
-                        'agent_id': self.agent_id,
-                        'status': self.status
-                    }))
-                except: pass
+                    await self.ws_connection.send(json.dumps(heartbeat))
+                except:
+                    self._affinity_dirty = self._affinity_dirty or bool(affinity)
+
+    async def _maintenance_worker(self):
+        """
+        Mantenimiento online de baja prioridad: un paso acotado (presupuesto
+        MAINTENANCE_BUDGET_MS por base) cuando el agente está ocioso, o tras
+        MAINTENANCE_MAX_DEFERRALS intervalos ocupado. Si queda trabajo, el
+        siguiente paso llega enseguida en lugar de esperar al intervalo.
+        """
+        interval = float(self.config['MAINTENANCE_INTERVAL_SECONDS'])
+        max_deferrals = int(self.config['MAINTENANCE_MAX_DEFERRALS'])
+        deferrals = 0
+        delay = interval
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(delay)
+            if self.status == 'busy' and deferrals < max_deferrals:
+                deferrals += 1
+                delay = interval
+                continue
+            deferrals = 0
+            try:
+                done = await loop.run_in_executor(None, self.maintenance.step)
+            except Exception as e:
+                self.logger.error("Error en mantenimiento: %s", e)
+                done = True
+            delay = interval if done else 1.0
+            if done and any(self.maintenance.totals.values()):
+                self.logger.info("🧹 Mantenimiento: %s", self.maintenance.totals)
+                self.maintenance.totals = dict.fromkeys(self.maintenance.totals, 0)
 
     async def _auto_request_worker(self):
         if self.config['AUTO_REQUEST_TASKS'] != 'true': return
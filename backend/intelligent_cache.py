@@ -6,7 +6,21 @@ import sqlite3
 import shutil
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+
+# Campos que identifican el envío y no el trabajo: no entran en la huella
+VOLATILE_TASK_FIELDS = frozenset({
+    'id', 'priority', 'timestamp', 'created_at', 'delegated_from', 'submitted_by', 'to',
+    'graph_id', 'depends_on', 'estimated_duration', 'bench_injected_at'
+})
+
+
+def task_fingerprint(task: Dict) -> str:
+    """Huella estable del trabajo de una tarea (igual en agente y coordinador)"""
+    payload = {k: v for k, v in task.items() if k not in VOLATILE_TASK_FIELDS}
+    content = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
 
 class IntelligentCache:
     def __init__(self, cache_dir=".antigravity-cache", max_size_mb=500):
@@ -22,6 +36,7 @@ class IntelligentCache:
     def _init_db(self):
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS cache_entries (
             key TEXT PRIMARY KEY,
@@ -131,6 +146,16 @@ class IntelligentCache:
         conn.commit()
         conn.close()
         
+    def keys(self, prefix: str = '') -> List[str]:
+        """Claves vigentes (no expiradas), opcionalmente filtradas por prefijo"""
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute(
+            "SELECT key FROM cache_entries WHERE substr(key, 1, ?) = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (len(prefix), prefix, datetime.now().timestamp())
+        ).fetchall()
+        conn.close()
+        return [row[0] for row in rows]
+        
     def _generate_key(self, key: str, context: Optional[Dict]) -> str:
         if not context:
             return key
@@ -0,0 +1,89 @@
+# json_delta.py
+from typing import Any, Dict, List
+
+_MISSING = object()
+
+
+def _escape(token: str) -> str:
+    return str(token).replace('~', '~0').replace('/', '~1')
+
+
+def _unescape(token: str) -> str:
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def json_diff(old: Any, new: Any, path: str = '') -> List[Dict]:
+    """
+    Calcula un delta estilo JSON Patch (RFC 6902: add/remove/replace) entre dos valores.
+
+    Solo se desciende en diccionarios; listas y escalares distintos se
+    reemplazan completos.
+    """
+    if old is new:
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key, old_value in old.items():
+            child_path = f"{path}/{_escape(key)}"
+            new_value = new.get(key, _MISSING)
+            if new_value is _MISSING:
+                ops.append({'op': 'remove', 'path': child_path})
+            elif old_value is not new_value and old_value != new_value:
+                ops.extend(json_diff(old_value, new_value, child_path))
+        for key, new_value in new.items():
+            if key not in old:
+                ops.append({'op': 'add', 'path': f"{path}/{_escape(key)}", 'value': new_value})
+        return ops
+    if old != new or type(old) is not type(new):
+        return [{'op': 'replace', 'path': path, 'value': new}]
+    return []
+
+
+def apply_patch(doc: Any, ops: List[Dict]) -> Any:
+    """Aplica un delta y devuelve un documento nuevo (copia solo los nodos tocados)"""
+    copied = set()
+    for op in ops:
+        path = op['path']
+        if path == '':
+            if op['op'] == 'remove':
+                doc = None
+            else:
+                doc = op['value']
+            copied = set()
+            continue
+
+        tokens = [_unescape(t) for t in path.split('/')[1:]]
+        if id(doc) not in copied:
+            doc = _shallow_copy(doc)
+            copied.add(id(doc))
+        parent = doc
+        for token in tokens[:-1]:
+            child = parent[_index(parent, token)]
+            if id(child) not in copied:
+                child = _shallow_copy(child)
+                copied.add(id(child))
+                parent[_index(parent, token)] = child
+            parent = child
+
+        last = _index(parent, tokens[-1])
+        if op['op'] == 'remove':
+            del parent[last]
+        elif op['op'] == 'add' and isinstance(parent, list):
+            parent.insert(len(parent) if last == '-' else last, op['value'])
+        else:
+            parent[last] = op['value']
+    return doc
+
+
+def _shallow_copy(value: Any) -> Any:
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+def _index(container: Any, token: str):
+    if isinstance(container, list):
+        return token if token == '-' else int(token)
+    return token
@@ -1,96 +1,136 @@
 # maintenance.py
+"""
+Mantenimiento de las bases SQLite y directorios de trabajo del agente.
+
+Modo online (por defecto dentro del agente): cada paso hace un trozo
+acotado de trabajo con presupuesto de tiempo (borrados por bloques,
+archivado de una partición de historial, `incremental_vacuum` de unas
+pocas páginas y checkpoint PASSIVE del WAL), de modo que nunca hay una
+ventana stop-the-world. Sin VACUUM completo.
+
+Uso manual (repite pasos hasta terminar):
+    python backend/maintenance.py
+    python backend/maintenance.py --convert   # una vez: activa auto_vacuum=incremental (hace VACUUM)
+"""
 import os
 import sys
 import sqlite3
 import time
-import shutil
-from datetime import datetime, timedelta
+import argparse
+from datetime import datetime
 from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Tuple
 
-# Configuración
+from persistent_memory import PersistentMemory, partition_period
+
+# Configuración: mismas rutas (relativas al directorio de trabajo) que usa el agente
 BASE_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
-CACHE_DIR = BASE_DIR.parent / ".antigravity-cache"
+CACHE_DIR = Path(os.getenv('CACHE_DIR', '.antigravity-cache'))
 OUTPUT_LOGS = BASE_DIR.parent / "logs"
-DB_PATH = BASE_DIR / "antigravity-memory.db"
+DB_PATH = Path(os.getenv('MEMORY_DB_PATH', 'antigravity-memory.db'))
+SPOOL_DIR = Path(os.getenv('SPOOL_DIR', '.antigravity-spool'))
+RESULT_STORE_DIR = Path(os.getenv('RESULT_STORE_DIR', '.antigravity-results'))
+
+AUTO_VACUUM_INCREMENTAL = 2
 
 def log(message):
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}")
 
-def cleanup_cache():
-    """Limpia archivos de caché antiguos"""
-    log("🧹 Iniciando limpieza de caché...")
-    
-    if not CACHE_DIR.exists():
-        log("No hay directorio de caché.")
-        return
+def connect(path: Path) -> sqlite3.Connection:
+    """Conexión en modo WAL: los lectores no bloquean al escritor ni viceversa"""
+    conn = sqlite3.connect(path, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
 
-    # Limpiar archivos .json antiguos (> 7 días no accedidos)
-    cleaned_count = 0
-    size_freed = 0
-    
-    # Conectar a la DB de caché para consistencia
-    cache_meta_db = CACHE_DIR / "cache_meta.db"
-    if cache_meta_db.exists():
-        try:
-            conn = sqlite3.connect(cache_meta_db)
-            cursor = conn.cursor()
-            
-            # Borrar entradas expiradas
-            cursor.execute("SELECT path FROM cache_entries WHERE expires_at < ?", (time.time(),))
-            rows = cursor.fetchall()
-            
-            for row in rows:
-                path = Path(row[0])
-                if path.exists():
-                    size_freed += path.stat().st_size
-                    path.unlink()
-                    cleaned_count += 1
-            
-            cursor.execute("DELETE FROM cache_entries WHERE expires_at < ?", (time.time(),))
-            conn.commit()
-            
-            # Vacuum para recuperar espacio
-            cursor.execute("VACUUM")
-            conn.close()
-            log(f"Caché optimizada: {cleaned_count} archivos eliminados, {size_freed/1024/1024:.2f} MB liberados.")
-        except Exception as e:
-            log(f"Error limpiando DB de caché: {e}")
-            
-def optimize_memory_db():
-    """Optimiza la base de datos de memoria persistente"""
-    log("🧠 Optimizando memoria persistente...")
-    
-    if not DB_PATH.exists():
-        log("No hay base de datos de memoria.")
-        return
+def ensure_incremental_vacuum(conn: sqlite3.Connection, path: Path, force: bool = False) -> bool:
+    """
+    Activa auto_vacuum=incremental. En una base existente solo surte efecto
+    tras un VACUUM completo, que únicamente se hace con force=True (--convert):
+    online solo se fija el pragma.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+        return True
+    conn.execute(f"PRAGMA auto_vacuum={AUTO_VACUUM_INCREMENTAL}")
+    if force:
+        conn.execute("VACUUM")
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+        return True
+    log(f"{path.name}: auto_vacuum pendiente (ejecutar maintenance.py --convert fuera de horas)")
+    return False
 
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Eliminar tareas muy antiguas (> 30 días) excepto hitos importantes
-        thirty_days_ago = (datetime.now() - timedelta(days=30)).isoformat()
-        cursor.execute("DELETE FROM task_history WHERE start_time < ? AND status != 'failed'", (thirty_days_ago,))
-        deleted_count = cursor.rowcount
-        
+def incremental_vacuum(conn: sqlite3.Connection, max_pages: int = 1024) -> Tuple[int, int]:
+    """Devuelve al sistema hasta max_pages páginas libres; (liberadas, libres restantes)"""
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if not before or conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        return 0, 0
+    # executescript avanza la sentencia hasta el final (execute solo libera una página)
+    conn.executescript(f"PRAGMA incremental_vacuum({max_pages});")
+    after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return before - after, after
+
+def checkpoint(conn: sqlite3.Connection) -> Optional[tuple]:
+    """Checkpoint PASSIVE: copia lo que pueda del WAL sin esperar a lectores ni escritores"""
+    return conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+
+def cleanup_cache(conn: sqlite3.Connection, chunk_size: int = 500, budget: float = 0.05) -> Dict:
+    """Entradas de caché expiradas: fichero y metadatos, por bloques"""
+    deadline = time.monotonic() + budget
+    stats = {'removed': 0, 'bytes': 0, 'done': False}
+    while True:
+        rows = conn.execute(
+            "SELECT key, path, size FROM cache_entries WHERE expires_at < ? LIMIT ?",
+            (time.time(), chunk_size)
+        ).fetchall()
+        for key, path, size in rows:
+            try:
+                os.remove(path)
+                stats['bytes'] += size or 0
+            except OSError:
+                pass
+        conn.executemany("DELETE FROM cache_entries WHERE key = ?", [(row[0],) for row in rows])
         conn.commit()
-        
-        # Reconstruir índices y compactar
-        cursor.execute("VACUUM")
-        cursor.execute("ANALYZE")
-        
-        conn.close()
-        log(f"Memoria optimizada: {deleted_count} registros antiguos purgados.")
-    except Exception as e:
-        log(f"Error optimizando memoria: {e}")
+        stats['removed'] += len(rows)
+        if len(rows) < chunk_size:
+            stats['done'] = True
+            return stats
+        if time.monotonic() >= deadline:
+            return stats
+
+def segment_time(path: Path) -> float:
+    """Fin del periodo de un segmento archivado (por su nombre); mtime si no es de partición"""
+    period = partition_period(path.stem)
+    return period[1] if period else path.stat().st_mtime
+
+def cleanup_files(paths: Iterator[Path], max_age_seconds: float, budget: float = 0.05,
+                  age_of: Callable[[Path], float] = None) -> Tuple[int, bool]:
+    """
+    Borra los ficheros más antiguos que max_age_seconds (spool huérfano,
+    resultados caducados). La antigüedad es la mtime salvo que `age_of`
+    dé otra referencia. `paths` es un iterador que se puede reanudar en
+    el siguiente paso; (borrados, iterador agotado).
+    """
+    deadline = time.monotonic() + budget
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for path in paths:
+        if time.monotonic() >= deadline:
+            return removed, False
+        try:
+            if path.is_file() and (age_of(path) if age_of else path.stat().st_mtime) < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed, True
 
 def rotate_logs():
     """Rota y comprime logs antiguos"""
     log("📝 Rotando logs del sistema...")
-    
+
     if not OUTPUT_LOGS.exists():
         return
-        
+
     for log_file in OUTPUT_LOGS.glob("*.log"):
         # Si es mayor a 10MB o más antiguo de 24h
         if log_file.stat().st_size > 10 * 1024 * 1024:
@@ -100,13 +140,116 @@ def rotate_logs():
             log_file.rename(new_name)
             log(f"Log rotado: {log_file.name} -> {new_name.name}")
 
+
+class OnlineMaintenance:
+    """
+    Mantenimiento incremental: `step()` hace como mucho `budget` segundos de
+    trabajo por base. Pensado para llamarse periódicamente en un hilo.
+    """
+
+    def __init__(self, memory_db=DB_PATH, cache_dir=CACHE_DIR, spool_dir=SPOOL_DIR,
+                 result_dir=RESULT_STORE_DIR, retention_days: int = 30, result_retention_days: int = 7,
+                 archive_retention_days: int = 365, spool_max_age_hours: float = 24, budget: float = 0.05,
+                 vacuum_pages: int = 1024, memory: Optional[PersistentMemory] = None):
+        self.memory_db = Path(memory_db)
+        self.memory = memory
+        self.cache_db = Path(cache_dir) / "cache_meta.db"
+        self.spool_dir = Path(spool_dir)
+        self.result_dir = Path(result_dir)
+        self.retention_days = retention_days
+        self.result_retention_days = result_retention_days
+        self.archive_retention_days = archive_retention_days
+        self.spool_max_age_hours = spool_max_age_hours
+        self.budget = budget
+        self.vacuum_pages = vacuum_pages
+        self._prepared = set()
+        self._scans = {}  # directorio -> recorrido en curso (se reanuda entre pasos)
+        self.totals = {'partitions_archived': 0, 'cache_removed': 0, 'pages_freed': 0, 'files_removed': 0}
+
+    def _open(self, path: Path) -> Optional[sqlite3.Connection]:
+        if not path.exists():
+            return None
+        conn = connect(path)
+        if path not in self._prepared:
+            ensure_incremental_vacuum(conn, path)
+            self._prepared.add(path)
+        return conn
+
+    def step(self) -> bool:
+        """Un paso acotado; True si no queda trabajo pendiente"""
+        done = True
+        conn = self._open(self.cache_db)
+        if conn:
+            try:
+                stats = cleanup_cache(conn, budget=self.budget)
+                self.totals['cache_removed'] += stats['removed']
+                freed, free_left = incremental_vacuum(conn, self.vacuum_pages)
+                self.totals['pages_freed'] += freed
+                checkpoint(conn)
+                done = done and stats['done'] and not free_left
+            finally:
+                conn.close()
+
+        if self.memory is None and self.memory_db.exists():
+            self.memory = PersistentMemory(str(self.memory_db))
+        conn = self._open(self.memory_db)
+        if conn:
+            try:
+                # Historial: una partición caducada por paso pasa a segmento comprimido (DROP TABLE)
+                archived = self.memory.archive_partitions(self.retention_days, limit=1)
+                self.totals['partitions_archived'] += len(archived)
+                freed, free_left = incremental_vacuum(conn, self.vacuum_pages)
+                self.totals['pages_freed'] += freed
+                checkpoint(conn)
+                done = done and not archived and not free_left
+            finally:
+                conn.close()
+
+        directories = [(self.spool_dir, self.spool_max_age_hours * 3600, None),
+                       (self.result_dir, self.result_retention_days * 86400, None)]
+        if self.memory is not None:
+            # Los segmentos caducan por el periodo que cubren, no por cuándo se archivaron
+            directories.append((self.memory.archive_dir, self.archive_retention_days * 86400, segment_time))
+        for directory, max_age, age_of in directories:
+            if not directory.exists():
+                continue
+            if directory not in self._scans:
+                self._scans[directory] = directory.rglob('*')
+            removed, finished = cleanup_files(self._scans[directory], max_age, self.budget, age_of)
+            self.totals['files_removed'] += removed
+            if finished:
+                del self._scans[directory]
+            done = done and finished
+        return done
+
+
 def main():
-    log("=== EJECUTANDO MANTENIMIENTO NOCTURNO (3:00 AM) ===")
-    
-    cleanup_cache()
-    optimize_memory_db()
+    parser = argparse.ArgumentParser(description='Mantenimiento de bases y directorios del agente')
+    parser.add_argument('--convert', action='store_true',
+                        help='Activa auto_vacuum=incremental aunque requiera un VACUUM completo')
+    parser.add_argument('--retention-days', type=int, default=30,
+                        help='Días de historial en SQLite antes de archivarlo en segmentos')
+    parser.add_argument('--archive-retention-days', type=int, default=365)
+    args = parser.parse_args()
+
+    log("=== EJECUTANDO MANTENIMIENTO ===")
+    if args.convert:
+        for path in (CACHE_DIR / "cache_meta.db", DB_PATH):
+            if path.exists():
+                conn = connect(path)
+                ensure_incremental_vacuum(conn, path, force=True)
+                conn.close()
+                log(f"{path}: auto_vacuum=incremental")
+
+    maintenance = OnlineMaintenance(retention_days=args.retention_days,
+                                     archive_retention_days=args.archive_retention_days)
+    while not maintenance.step():
+        time.sleep(0.01)  # Deja pasar a los escritores entre pasos
     rotate_logs()
-    
+
+    totals = maintenance.totals
+    log(f"Caché: {totals['cache_removed']} entradas; memoria: {totals['partitions_archived']} particiones archivadas; "
+        f"{totals['pages_freed']} páginas liberadas; {totals['files_removed']} ficheros eliminados")
     log("=== MANTENIMIENTO COMPLETADO ===")
 
 if __name__ == "__main__":
@@ -1,6 +1,8 @@
 # master_coordinator.py (Optimized)
 import asyncio
 import json
+import time
+import uuid
 from datetime import datetime
 from typing import Dict, List
 import websockets
@@ -12,19 +14,97 @@ import signal
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from task_router import IntelligentTaskRouter
+from intelligent_cache import task_fingerprint
 from sync_manager import SyncManager
-from telemetry import TelemetrySystem
+from telemetry import TelemetrySystem, monitor
+from result_store import is_failed_result, is_result_ref
+from traffic_recorder import TrafficRecorder
+from admission import PRIORITIES, TaskQueue, RateLimiter, parse_limits
+from task_graph import TaskGraph, TaskGraphError
+
+
+def _parse_timestamp(value):
+    """Hora de escritura enviada por el agente (ISO 8601); None si falta o no es válida"""
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
 
 class MasterCoordinator:
+    # Se desvía una tarea pedida por un agente si otro ocioso la acabaría antes (< 80%)
+    LATENCY_SWITCH_RATIO = 0.8
+    # Una revocación sin respuesta en este tiempo deja de bloquear nuevas al mismo agente
+    REVOKE_TIMEOUT_SECONDS = 10
+
     def __init__(self):
         self.agents = {}
-        self.task_queue = asyncio.Queue()
+        # Cola acotada por prioridad/tipo y límite de ritmo por conexión que envía tareas
+        self.task_queue = TaskQueue(
+            priority_limits=parse_limits(os.getenv('COORDINATOR_QUEUE_LIMITS', 'high=2000,normal=5000,low=2000')),
+            type_limits=parse_limits(os.getenv('COORDINATOR_TYPE_LIMITS', '')),
+            max_total=int(os.getenv('COORDINATOR_MAX_QUEUE', '10000'))
+        )
+        self.submit_limiter = RateLimiter(
+            rate=float(os.getenv('COORDINATOR_SUBMIT_RATE', '50')),
+            burst=float(os.getenv('COORDINATOR_SUBMIT_BURST', '200'))
+        )
+        self.socket_agents = {}  # websocket -> agent_id registrado en esa conexión
         self.active_tasks = {}
         self.completed_tasks = []
-        self.router = IntelligentTaskRouter()
         self.sync_manager = SyncManager()
         self.telemetry = TelemetrySystem()
+        self.router = IntelligentTaskRouter(telemetry=self.telemetry)
         self.server = None
+        self._delegation_seq = 0
+        self.message_handlers = {}
+        self.task_graphs = {}  # graph_id -> TaskGraph en curso
+        self.graph_submitters = {}  # graph_id -> websocket de quien lo envió
+        self.max_graph_tasks = int(os.getenv('COORDINATOR_MAX_GRAPH_TASKS', '1000'))
+        self.max_graphs = int(os.getenv('COORDINATOR_MAX_GRAPHS', '100'))  # Grafos en curso a la vez
+        # Lotes de tareas pequeñas del mismo tipo (1 = desactivado)
+        self.batch_max_tasks = int(os.getenv('COORDINATOR_BATCH_MAX_TASKS', '1'))
+        self.batch_budget = float(os.getenv('COORDINATOR_BATCH_BUDGET_SECONDS', '2.0'))
+        self.batch_types = set(filter(None, os.getenv('COORDINATOR_BATCH_TYPES', '').split(',')))
+        # Work stealing entre agentes: cola local mínima para revocar tareas (0 = desactivado)
+        self.revoke_min_depth = int(os.getenv('COORDINATOR_REVOKE_MIN_DEPTH', '2'))
+        self.revocations = {}  # agent_id -> instante de la revocación en curso
+        # Grabación opcional del tráfico entrante para reproducirlo (replay_traffic.py)
+        self.recorder = TrafficRecorder.from_env('COORDINATOR_RECORD_PATH')
+        self._init_metrics()
+        
+    def _init_metrics(self):
+        """Métricas con etiquetas expuestas en /metrics"""
+        self.assigned_counter = self.telemetry.counter(
+            'antigravity_coordinator_tasks_assigned', 'Tareas asignadas', ['task_type'])
+        self.revoked_counter = self.telemetry.counter(
+            'antigravity_coordinator_tasks_revoked', 'Tareas revocadas a agentes sobrecargados y reasignadas')
+        self.rejected_counter = self.telemetry.counter(
+            'antigravity_coordinator_tasks_rejected', 'Tareas rechazadas por control de admisión', ['reason'])
+        self.duration_histogram = self.telemetry.histogram(
+            'antigravity_coordinator_task_duration_seconds', 'Duración de tareas (asignación a completación)',
+            ['task_type'])
+        self.telemetry.gauge('antigravity_coordinator_agents', 'Agentes registrados').set_function(
+            lambda: len(self.agents))
+        self.telemetry.gauge('antigravity_coordinator_tasks_in_queue', 'Tareas en cola').set_function(
+            lambda: self.task_queue.qsize())
+        self.telemetry.gauge('antigravity_coordinator_active_tasks', 'Tareas en ejecución').set_function(
+            lambda: len(self.active_tasks))
+    
+    async def start_metrics_server(self, host='0.0.0.0', port=9108):
+        """Sirve /metrics en formato Prometheus (opcional)"""
+        from aiohttp import web
+        
+        async def metrics(request):
+            return web.Response(text=self.telemetry.export_metrics('prometheus'),
+                                content_type='text/plain')
+        
+        app = web.Application()
+        app.router.add_get('/metrics', metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        print(f"📈 Métricas del coordinador en http://{host}:{port}/metrics")
         
     async def start_server(self, host='0.0.0.0', port=8766):
         """Inicia servidor de coordinación"""
@@ -40,12 +120,18 @@ class MasterCoordinator:
             else:
                 raise e
     
-    async def handle_connection(self, websocket, path):
+    async def handle_connection(self, websocket, path=None):
         """Maneja conexión de agente"""
         agent_id = None
+        recorder = self.recorder
+        connection = recorder.new_connection() if recorder else None
+        if recorder:
+            recorder.record('ws', 'open', connection=connection)
         
         try:
             async for message in websocket:
+                if recorder:
+                    recorder.record('ws', 'msg', message, connection=connection)
                 data = json.loads(message)
                 message_type = data.get('type')
                 
@@ -60,24 +146,71 @@ class MasterCoordinator:
                     
                 elif message_type == 'TASK_COMPLETE':
                     await self.handle_task_completion(data)
+                
+                elif message_type == 'TASK_BATCH_COMPLETE':
+                    await self.handle_batch_completion(data)
+                
+                elif message_type == 'TASK_REVOKED':
+                    await self.handle_task_revoked(data)
+                
+                elif message_type == 'TASK_PROGRESS':
+                    active = self.active_tasks.get(data.get('task_id'))
+                    if active:
+                        active['progress'] = data.get('progress')
+                        active['last_progress'] = datetime.now()
                     
                 elif message_type == 'TASK_DELEGATION':
-                    await self.handle_delegation(data)
+                    await self.handle_delegation(data, websocket)
+                
+                elif message_type == 'TASK_GRAPH_SUBMIT':
+                    await self.handle_graph_submit(data, websocket)
                     
                 elif message_type == 'CONTEXT_SYNC':
-                    if agent_id:
+                    # LWW usa la hora del escritor, no la de llegada
+                    written_at = _parse_timestamp(data.get('timestamp'))
+                    if agent_id and 'context_key' in data:
+                        # Clave compartida con reloj vectorial (valores CRDT se fusionan)
+                        await self.sync_manager.update_context(
+                            agent_id,
+                            data['context_key'],
+                            data['value'],
+                            vclock=data.get('vclock'),
+                            timestamp=written_at
+                        )
+                    elif agent_id:
                         await self.sync_manager.update_context(
                             agent_id,
                             'agent_context',
-                            data['context']
+                            data['context'],
+                            timestamp=written_at
                         )
+                
+                elif message_type == 'CONTEXT_SUBSCRIBE':
+                    if agent_id:
+                        self.sync_manager.subscribe(agent_id, data.get('keys', []))
+                        await self.send_context_resync(agent_id, data.get('keys', []))
+                
+                elif message_type == 'CONTEXT_RESYNC_REQUEST':
+                    if agent_id:
+                        await self.send_context_resync(agent_id, data.get('keys', []))
+                
+                elif message_type in self.message_handlers:
+                    # Mensajes adicionales registrados por subclases/extensiones
+                    await self.message_handlers[message_type](data, websocket)
                     
         except websockets.exceptions.ConnectionClosed:
-            if agent_id:
+            pass
+        finally:
+            self.socket_agents.pop(websocket, None)
+            # Solo si el agente no se ha vuelto a registrar ya por otra conexión
+            if agent_id and self.agents.get(agent_id, {}).get('websocket') is websocket:
                 # print(f"❌ Agente {agent_id} desconectado") # Logging menos ruidoso
-                if agent_id in self.agents:
-                    self.agents[agent_id]['status'] = 'disconnected'
-                    await self.broadcast_system_status()
+                self.sync_manager.unregister_transport(agent_id)
+                self.agents[agent_id]['status'] = 'disconnected'
+                await self.requeue_agent_tasks(agent_id)
+                await self.broadcast_system_status()
+            if recorder:
+                recorder.record('ws', 'close', connection=connection)
     
     async def register_agent(self, agent_data, websocket):
         """Registra nuevo agente"""
@@ -93,9 +226,14 @@ class MasterCoordinator:
         # Registrar en router
         self.router.register_agent(
             agent_id,
-            agent_data['capabilities']
+            agent_data['capabilities'],
+            performance_profile={'max_concurrent_tasks': agent_data.get('max_concurrent_tasks', 1)}
         )
         
+        # Las actualizaciones de contexto suscritas se entregan por este socket
+        self.sync_manager.register_transport(agent_id, websocket.send)
+        self.socket_agents[websocket] = agent_id
+        
         print(f"✅ Agente registrado: {agent_id}")
         
         # Broadcast actualización
@@ -103,21 +241,31 @@ class MasterCoordinator:
         
         return agent_id
     
+    @monitor('coordinator.assign_task_to_agent')
     async def assign_task_to_agent(self, requesting_agent_id=None):
         """Asigna tarea a agente"""
         if self.task_queue.empty():
+            if requesting_agent_id:
+                # Sin trabajo en cola: quizá otro agente acumula tareas sin empezar
+                await self.revoke_from_overloaded()
             return
         
         task = await self.task_queue.get()
+        tasks = [task]
         
         # Rutear al mejor agente
         try:
             best_agent_id = None
-            if requesting_agent_id and self._can_handle_task(requesting_agent_id, task):
+            routed = False
+            preferred = self._preferred_idle_agent(task, requesting_agent_id)
+            if preferred:
+                best_agent_id = preferred
+            elif requesting_agent_id and self._can_handle_task(requesting_agent_id, task):
                 best_agent_id = requesting_agent_id
             else:
                 try:
                     best_agent_id = self.router.route_task(task)
+                    routed = True
                 except:
                     if requesting_agent_id:
                         best_agent_id = requesting_agent_id
@@ -128,24 +276,114 @@ class MasterCoordinator:
                 return
 
             agent = self.agents[best_agent_id]
+            tasks = [task] + self._batch_companions(best_agent_id, task)
             
-            # Enviar tarea
-            await agent['websocket'].send(json.dumps({
-                'type': 'TASK_ASSIGNMENT',
-                'task': task
-            }))
+            # Enviar tarea (o lote de tareas pequeñas del mismo tipo)
+            if len(tasks) > 1:
+                self._delegation_seq += 1
+                batch_id = f"batch_{self._delegation_seq}"
+                await agent['websocket'].send(json.dumps({
+                    'type': 'TASK_BATCH_ASSIGNMENT',
+                    'batch_id': batch_id,
+                    'tasks': tasks
+                }))
+            else:
+                batch_id = None
+                await agent['websocket'].send(json.dumps({
+                    'type': 'TASK_ASSIGNMENT',
+                    'task': task
+                }))
             
-            self.active_tasks[task['id']] = {
-                'task': task,
-                'agent': best_agent_id,
-                'started_at': datetime.now()
-            }
+            for index, assigned in enumerate(tasks):
+                if index or not routed:
+                    # route_task ya contó la primera; el resto también ocupa al agente
+                    self.router.record_assignment(best_agent_id)
+                self.active_tasks[assigned['id']] = {
+                    'task': assigned,
+                    'agent': best_agent_id,
+                    'started_at': datetime.now(),
+                    'batch_id': batch_id
+                }
+                self.assigned_counter.labels(assigned.get('type', 'general')).inc()
             
-            print(f"📤 Tarea {task['id']} asignada a {best_agent_id}")
+            if batch_id:
+                print(f"📤 Lote {batch_id} ({len(tasks)} tareas {task.get('type')}) asignado a {best_agent_id}")
+            else:
+                print(f"📤 Tarea {task['id']} asignada a {best_agent_id}")
+            
+            if preferred:
+                # El agente que pidió trabajo sigue libre: recibe la siguiente
+                await self.assign_task_to_agent(requesting_agent_id)
             
         except Exception as e:
             print(f"❌ Error asignando tarea: {e}")
-            await self.task_queue.put(task)
+            for pending in tasks:
+                self.active_tasks.pop(pending['id'], None)
+                await self.task_queue.put(pending)
+    
+    def _preferred_idle_agent(self, task, requesting_agent_id):
+        """
+        Agente ocioso al que conviene más la tarea que al que la pide: en modo
+        latencia, el de menor finalización prevista si mejora claramente la
+        del solicitante; en modo score, uno que probablemente la tenga en caché.
+        """
+        if not requesting_agent_id or requesting_agent_id not in self.router.agents:
+            return None
+        if self.router.objective == 'latency':
+            candidates = [a for a in self.idle_agent_ids()
+                          if a != requesting_agent_id and a in self.router.agents
+                          and self._can_handle_task(a, task)]
+            if not candidates:
+                return None
+            fingerprint = task_fingerprint(task)
+            quantile = self.router.objective_quantile(task)
+            predicted = {a: self.router.predict_completion(a, task, quantile, fingerprint)
+                         for a in candidates + [requesting_agent_id]}
+            best = min(candidates, key=predicted.get)
+            if predicted[best] < predicted[requesting_agent_id] * self.LATENCY_SWITCH_RATIO:
+                return best
+            return None
+        holders = self.router.cache_holders(task)
+        if not holders or requesting_agent_id in holders:
+            return None
+        idle = set(self.idle_agent_ids())
+        for agent_id in holders:
+            if agent_id in idle and self._can_handle_task(agent_id, task):
+                return agent_id
+        return None
+    
+    def _batch_companions(self, agent_id, task):
+        """
+        Tareas en cola del mismo tipo y prioridad que caben en un lote con `task`:
+        hasta batch_max_tasks y mientras la duración esperada total no supere
+        batch_budget. Solo para agentes que anuncian soporte de lotes.
+        """
+        task_type = task.get('type', 'general')
+        if (self.batch_max_tasks <= 1 or not self.agents[agent_id].get('supports_batches')
+                or (self.batch_types and task_type not in self.batch_types)
+                or agent_id not in self.router.agents):
+            return []
+        
+        def expected(t):
+            return t.get('estimated_duration') or self.router.expected_service_time(agent_id, t)
+        
+        budget = self.batch_budget - expected(task)
+        if budget < 0:
+            return []
+        
+        def fits(candidate):
+            nonlocal budget
+            if candidate.get('type', 'general') != task_type:
+                return False
+            cost = expected(candidate)
+            if cost > budget:
+                return False
+            budget -= cost
+            return True
+        
+        priority = task.get('priority', 'normal')
+        return self.task_queue.take(priority if priority in PRIORITIES else 'normal',
+                                    self.batch_max_tasks - 1, fits)
     
     def _can_handle_task(self, agent_id, task):
         """Verifica si agente puede manejar tarea"""
@@ -154,60 +392,225 @@ class MasterCoordinator:
             return False
         return 'general' in agent.get('capabilities', []) or task['type'] in agent.get('capabilities', [])
     
+    @monitor('coordinator.handle_task_completion')
     async def handle_task_completion(self, data):
         """Maneja completación de tarea"""
         task_info = data.get('task', {})
-        task_id = task_info.get('id')
         agent_id = data.get('agent_id')
         
-        if task_id in self.active_tasks:
-            active_info = self.active_tasks[task_id]
-            duration = (datetime.now() - active_info['started_at']).total_seconds()
-            
-            self.router.report_task_completion(
-                agent_id,
-                active_info['task'],
-                success=True,
-                duration=duration
-            )
-            
-            self.completed_tasks.append({
-                **active_info,
-                'completed_at': datetime.now(),
-                'duration': duration,
-                'result': data.get('result')
-            })
-            
-            del self.active_tasks[task_id]
-            
-            print(f"✅ Tarea {task_id} completada por {agent_id} en {duration:.2f}s")
-            
+        if await self._complete_task(agent_id, task_info.get('id'), data.get('result')):
             if agent_id in self.agents:
                 self.agents[agent_id]['status'] = 'idle'
             
             await self.broadcast_system_status()
     
-    async def handle_delegation(self, data):
+    @monitor('coordinator.handle_batch_completion')
+    async def handle_batch_completion(self, data):
+        """Completación de un lote: cada tarea como si llegase sola, un único broadcast"""
+        agent_id = data.get('agent_id')
+        completed = 0
+        for item in data.get('results', []):
+            if await self._complete_task(agent_id, item.get('task_id'), item.get('result'),
+                                         item.get('duration')):
+                completed += 1
+        print(f"📦 Lote {data.get('batch_id')}: {completed} tareas completadas por {agent_id}")
+        if completed:
+            if agent_id in self.agents:
+                self.agents[agent_id]['status'] = 'idle'
+            await self.broadcast_system_status()
+    
+    async def _complete_task(self, agent_id, task_id, result, duration=None):
+        """Registra el resultado de una tarea activa; False si no estaba asignada"""
+        if task_id not in self.active_tasks:
+            return False
+        
+        active_info = self.active_tasks[task_id]
+        if duration is None:
+            duration = (datetime.now() - active_info['started_at']).total_seconds()
+        
+        self.router.report_task_completion(
+            agent_id,
+            active_info['task'],
+            success=not is_failed_result(result),
+            duration=duration
+        )
+        self.duration_histogram.labels(active_info['task'].get('type', 'general')).observe(duration)
+        
+        self.completed_tasks.append({
+            **active_info,
+            'completed_at': datetime.now(),
+            'duration': duration,
+            'result': result
+        })
+        
+        del self.active_tasks[task_id]
+        
+        graph_id = active_info['task'].get('graph_id')
+        if graph_id in self.task_graphs:
+            await self.advance_graph(graph_id, task_id, result)
+        
+        print(f"✅ Tarea {task_id} completada por {agent_id} en {duration:.2f}s")
+        if is_result_ref(result):
+            ref = result['result_ref']
+            print(f"   📦 Resultado por referencia: {ref['digest'][:12]} ({ref['size']} bytes)")
+        return True
+    
+    def _submitter(self, websocket) -> str:
+        """
+        Clave del límite de ritmo: el agente registrado en la conexión o la
+        propia conexión; nunca el 'from' del mensaje, que elige el cliente.
+        """
+        if websocket is None:
+            return 'internal'
+        return self.socket_agents.get(websocket) or f"conn:{id(websocket)}"
+    
+    async def handle_delegation(self, data, websocket=None):
         """Maneja delegación entre agentes"""
         from_agent = data.get('from')
         to_agent = data.get('to')
         task = data.get('task')
         
+        allowed, retry_after = self.submit_limiter.allow(self._submitter(websocket))
+        if not allowed:
+            await self.reject_task(websocket, task, 'rate_limited', retry_after)
+            return
+        
         print(f"🤝 Delegación: {from_agent} → {to_agent}")
         
+        # El id lo genera el coordinador (único también entre shards): uno elegido por el
+        # cliente podría pisar una tarea activa, en cola o de un grafo y secuestrar su completación
+        task = {k: v for k, v in task.items() if k != 'graph_id'}
         new_task = {
-            'id': f"task_{len(self.completed_tasks) + len(self.active_tasks)}_del",
+            **task,
+            'id': f"task_{uuid.uuid4().hex[:16]}_del",
+            'client_task_id': task.get('id'),
             'type': task.get('type', 'general'),
             'description': task.get('description', str(task)),
             'delegated_from': from_agent,
-            'priority': 'normal'
+            'priority': task.get('priority', 'normal')
         }
         
-        await self.task_queue.put(new_task)
+        reason = self.task_queue.admit(new_task)
+        if reason:
+            await self.reject_task(websocket, new_task, reason, self.task_queue.retry_after())
+            return
         
         if to_agent in self.agents and self.agents[to_agent]['status'] == 'idle':
             await self.assign_task_to_agent(to_agent)
     
+    async def handle_graph_submit(self, data, websocket=None):
+        """Recibe un DAG de tareas y despacha en paralelo las que no tienen dependencias"""
+        from_agent = data.get('from')
+        graph_data = data.get('graph', {})
+        tasks = graph_data.get('tasks', [])
+        self._delegation_seq += 1
+        graph_id = graph_data.get('id') or f"graph_{self._delegation_seq}"
+        
+        allowed, retry_after = self.submit_limiter.allow(self._submitter(websocket))
+        if not allowed:
+            await self.reject_task(websocket, {'id': graph_id}, 'rate_limited', retry_after)
+            return
+        if len(tasks) > self.max_graph_tasks or graph_id in self.task_graphs:
+            reason = 'graph_too_large' if len(tasks) > self.max_graph_tasks else 'duplicate_graph_id'
+            await self.reject_task(websocket, {'id': graph_id}, reason, 0)
+            return
+        if len(self.task_graphs) >= self.max_graphs:
+            await self.reject_task(websocket, {'id': graph_id}, 'too_many_graphs', self.task_queue.retry_after())
+            return
+        try:
+            graph = TaskGraph(graph_id, tasks, submitted_by=from_agent)
+        except TaskGraphError as e:
+            await self.reject_task(websocket, {'id': graph_id}, f"invalid_graph:{e}", 0)
+            return
+        # El grafo entero cuenta contra los límites de la cola: sus tareas se encolan
+        # después (al liberarse sus dependencias) sin volver a pasar por admit
+        reason = self.task_queue.rejection(list(graph.tasks.values()))
+        if reason:
+            await self.reject_task(websocket, {'id': graph_id}, reason, self.task_queue.retry_after())
+            return
+        
+        self.task_graphs[graph_id] = graph
+        if websocket is not None:
+            self.graph_submitters[graph_id] = websocket
+        ready = graph.ready_tasks()
+        for task in ready:
+            await self.task_queue.put(task)
+        print(f"🕸️  Grafo {graph_id}: {len(tasks)} tareas, {len(ready)} listas")
+        await self._send_to_submitter(graph_id, {
+            'type': 'TASK_GRAPH_ACCEPTED',
+            'graph_id': graph_id,
+            'tasks': len(tasks),
+            'ready': len(ready)
+        })
+        await self.dispatch_to_idle_agents()
+    
+    async def advance_graph(self, graph_id, task_id, result):
+        """Tarea de un grafo completada: libera sus dependientes o cancela si falló"""
+        graph = self.task_graphs[graph_id]
+        if is_failed_result(result):
+            cancelled = graph.fail(task_id, result)
+            if cancelled:
+                print(f"⚠️  Grafo {graph_id}: {task_id} falló, {len(cancelled)} tareas canceladas")
+        else:
+            # Los resultados grandes ya llegan como referencia (result_store): pasan tal cual
+            for task in graph.complete(task_id, result):
+                await self.task_queue.put(task)
+            await self.dispatch_to_idle_agents()
+        
+        if graph.is_done:
+            del self.task_graphs[graph_id]
+            summary = graph.summary()
+            print(f"🏁 Grafo {graph_id} terminado en {summary['duration']:.2f}s")
+            await self._send_to_submitter(graph_id, {'type': 'TASK_GRAPH_COMPLETE', **summary})
+            self.graph_submitters.pop(graph_id, None)
+    
+    async def _send_to_submitter(self, graph_id, message):
+        websocket = self.graph_submitters.get(graph_id)
+        if websocket is None:
+            return
+        try:
+            await websocket.send(json.dumps(message, default=str))
+        except websockets.exceptions.ConnectionClosed:
+            self.graph_submitters.pop(graph_id, None)
+    
+    def idle_agent_ids(self):
+        """Agentes ociosos y sin tarea asignada pendiente de completar"""
+        busy = {info['agent'] for info in self.active_tasks.values()}
+        return [agent_id for agent_id, agent in self.agents.items()
+                if agent['status'] == 'idle' and agent_id not in busy]
+    
+    async def dispatch_to_idle_agents(self):
+        """Reparte tareas en cola entre los agentes ociosos (una por agente)"""
+        for agent_id in self.idle_agent_ids():
+            if self.task_queue.empty():
+                break
+            await self.assign_task_to_agent(agent_id)
+    
+    async def reject_task(self, websocket, task, reason, retry_after):
+        """Responde TASK_REJECTED al emisor para que reintente pasado retry_after"""
+        self.rejected_counter.labels(reason.split(':')[0]).inc()
+        if websocket is None:
+            return
+        try:
+            await websocket.send(json.dumps({
+                'type': 'TASK_REJECTED',
+                'task_id': (task or {}).get('id'),
+                'reason': reason,
+                'retry_after': round(retry_after, 2)
+            }))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+    
+    async def send_context_resync(self, agent_id, keys):
+        """Envía el valor completo de las claves pedidas (suscripción o hueco de versiones)"""
+        agent = self.agents.get(agent_id)
+        updates = [u for u in (self.sync_manager.full_update(k) for k in keys) if u]
+        if agent and updates:
+            await agent['websocket'].send(json.dumps({
+                'type': 'CONTEXT_UPDATE_BATCH',
+                'updates': updates
+            }, default=str))
+    
     async def handle_heartbeat(self, data):
         """Maneja heartbeat de agente"""
         agent_id = data.get('agent_id')
@@ -215,25 +618,100 @@ class MasterCoordinator:
         if agent_id in self.agents:
             self.agents[agent_id]['last_heartbeat'] = datetime.now()
             self.agents[agent_id]['status'] = data.get('status', 'idle')
+            if 'affinity' in data:
+                self.router.update_agent_affinity(agent_id, data['affinity'])
+            if 'queue_depth' in data:
+                self.agents[agent_id]['queue_depth'] = data['queue_depth']
+                self.agents[agent_id]['pending_task_ids'] = data.get('pending_task_ids', [])
+                if self.revoke_min_depth and data['queue_depth'] >= self.revoke_min_depth:
+                    await self.revoke_from_overloaded()
+    
+    async def revoke_from_overloaded(self):
+        """
+        Work stealing entre agentes: si hay agentes ociosos y la cola global
+        está vacía, revoca la mitad de las tareas no empezadas (las más
+        recientes) del agente con más cola local. Se reasignan al confirmar
+        el agente con TASK_REVOKED.
+        """
+        if not self.revoke_min_depth or not self.task_queue.empty():
+            return
+        if not any(not self.agents[a].get('queue_depth') for a in self.idle_agent_ids()):
+            return
+        now = time.monotonic()
+        candidates = [
+            (agent_id, agent) for agent_id, agent in self.agents.items()
+            if agent.get('queue_depth', 0) >= self.revoke_min_depth and agent.get('pending_task_ids')
+            and 'websocket' in agent and now - self.revocations.get(agent_id, 0) > self.REVOKE_TIMEOUT_SECONDS
+        ]
+        if not candidates:
+            return
+        victim_id, victim = max(candidates, key=lambda c: c[1]['queue_depth'])
+        count = max(1, victim['queue_depth'] // 2)
+        task_ids = [t for t in victim['pending_task_ids'][-count:]
+                    if self.active_tasks.get(t, {}).get('agent') == victim_id]
+        if not task_ids:
+            return
+        self.revocations[victim_id] = now
+        # Vista local hasta el próximo heartbeat
+        victim['queue_depth'] -= len(task_ids)
+        victim['pending_task_ids'] = victim['pending_task_ids'][:-count]
+        try:
+            await victim['websocket'].send(json.dumps({'type': 'TASK_REVOKE', 'task_ids': task_ids}))
+            print(f"↩️  Revocando {len(task_ids)} tareas a {victim_id} (cola local {victim['queue_depth'] + len(task_ids)})")
+        except websockets.exceptions.ConnectionClosed:
+            self.revocations.pop(victim_id, None)
+    
+    async def requeue_agent_tasks(self, agent_id):
+        """Agente desconectado: sus tareas asignadas vuelven a la cola para otro agente"""
+        task_ids = [task_id for task_id, info in self.active_tasks.items() if info['agent'] == agent_id]
+        for task_id in task_ids:
+            info = self.active_tasks.pop(task_id)
+            await self.task_queue.put(info['task'], front=True)
+        self.router.mark_disconnected(agent_id)
+        if task_ids:
+            print(f"↩️  {len(task_ids)} tareas de {agent_id} devueltas a la cola")
+            await self.dispatch_to_idle_agents()
+    
+    async def handle_task_revoked(self, data):
+        """El agente confirmó qué tareas no había empezado: vuelven a la cola y se reasignan"""
+        agent_id = data.get('agent_id')
+        self.revocations.pop(agent_id, None)
+        requeued = 0
+        for task_id in data.get('task_ids', []):
+            info = self.active_tasks.get(task_id)
+            if not info or info['agent'] != agent_id:
+                continue
+            del self.active_tasks[task_id]
+            await self.task_queue.put(info['task'], front=True)
+            requeued += 1
+        if requeued:
+            self.router.release_assignment(agent_id, requeued)
+            self.revoked_counter.inc(requeued)
+            await self.dispatch_to_idle_agents()
+    
+    def system_status(self):
+        """Resumen del estado (lo que se difunde en SYSTEM_STATUS_UPDATE)"""
+        return {
+            'total_agents': len(self.agents),
+            'active_agents': len([a for a in self.agents.values() if a['status'] == 'busy']),
+            'idle_agents': len([a for a in self.agents.values() if a['status'] == 'idle']),
+            'tasks_in_queue': self.task_queue.qsize(),
+            'queue': self.task_queue.stats(),
+            'active_tasks': len(self.active_tasks),
+            'completed_tasks': len(self.completed_tasks)
+        }
     
     async def broadcast_system_status(self):
         """Broadcast estado del sistema a todos los agentes"""
-        status = {
+        message = json.dumps({
             'type': 'SYSTEM_STATUS_UPDATE',
-            'status': {
-                'total_agents': len(self.agents),
-                'active_agents': len([a for a in self.agents.values() if a['status'] == 'busy']),
-                'idle_agents': len([a for a in self.agents.values() if a['status'] == 'idle']),
-                'tasks_in_queue': self.task_queue.qsize(),
-                'active_tasks': len(self.active_tasks),
-                'completed_tasks': len(self.completed_tasks)
-            }
-        }
+            'status': self.system_status()
+        })
         
         for agent in self.agents.values():
             if 'websocket' in agent:
                 try:
-                    await agent['websocket'].send(json.dumps(status))
+                    await agent['websocket'].send(message)
                 except:
                     pass
     
@@ -265,7 +743,17 @@ async def main():
         coordinator.monitor_agents()
     )
     
-    await asyncio.gather(server_task, monitor_task)
+    # Entrega de actualizaciones de contexto a suscriptores
+    sync_task = asyncio.create_task(
+        coordinator.sync_manager.start_sync_worker()
+    )
+    
+    # Endpoint /metrics opcional
+    metrics_port = os.getenv('COORDINATOR_METRICS_PORT')
+    if metrics_port:
+        await coordinator.start_metrics_server('0.0.0.0', int(metrics_port))
+    
+    await asyncio.gather(server_task, monitor_task, sync_task)
 
 
 if __name__ == '__main__':
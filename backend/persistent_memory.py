@@ -1,36 +1,111 @@
 # persistent_memory.py
 import sqlite3
 import json
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Any, Tuple
+
+import numpy as np
+
+from history_segments import COLUMNS as HISTORY_COLUMNS, Segment, write_segment
+
+PARTITION_PREFIX = 'task_history_'
+PARTITION_SPANS = {'d': 1, 'w': 7}  # Prefijo del periodo -> días
+
+
+def partition_name(timestamp: float, partition_by: str = 'day') -> str:
+    """Partición de historial de un instante: task_history_dAAAAMMDD o task_history_wAAAAMMDD (lunes)"""
+    day = date.fromtimestamp(timestamp)
+    if partition_by == 'week':
+        return f"{PARTITION_PREFIX}w{(day - timedelta(days=day.weekday())):%Y%m%d}"
+    return f"{PARTITION_PREFIX}d{day:%Y%m%d}"
+
+
+def partition_period(name: str) -> Optional[Tuple[float, float]]:
+    """(inicio, fin) en epoch del periodo que cubre una partición; None si el nombre no es de partición"""
+    suffix = name[len(PARTITION_PREFIX):] if name.startswith(PARTITION_PREFIX) else ''
+    if len(suffix) != 9 or suffix[0] not in PARTITION_SPANS or not suffix[1:].isdigit():
+        return None
+    start = datetime.strptime(suffix[1:], '%Y%m%d')
+    return start.timestamp(), (start + timedelta(days=PARTITION_SPANS[suffix[0]])).timestamp()
+
 
 class PersistentMemory:
-    def __init__(self, db_path="antigravity-memory.db"):
+    """
+    Memoria persistente del agente en SQLite.
+
+    El historial de tareas se particiona por día o semana en tablas
+    task_history_<periodo>; la vista `task_history` las une para las
+    consultas de siempre. Una partición vieja se archiva como segmento
+    columnar comprimido (history_segments) y se elimina con DROP TABLE,
+    sin borrados fila a fila. get_agent_performance consulta particiones
+    vivas y segmentos archivados.
+    """
+
+    def __init__(self, db_path="antigravity-memory.db", partition_by: str = 'day', archive_dir=None,
+                 readonly: bool = False):
         self.db_path = db_path
-        self._init_schema()
+        self.partition_by = partition_by
+        self.archive_dir = Path(archive_dir) if archive_dir else Path(db_path).with_name(
+            f"{Path(db_path).stem}-archive")
+        self.readonly = readonly
+        self._partitions = set()
+        # Solo lectura (p. ej. analítica del dashboard): ni esquema ni escrituras
+        if not readonly:
+            self._init_schema()
         
     def _get_connection(self):
+        if self.readonly:
+            uri = f"{Path(self.db_path).absolute().as_uri()}?mode=ro"
+            return sqlite3.connect(uri, uri=True, check_same_thread=False)
         return sqlite3.connect(self.db_path, check_same_thread=False)
 
+    @contextmanager
+    def _schema_change(self, conn):
+        """
+        DDL de particiones y vista en una sola transacción BEGIN IMMEDIATE:
+        listar + DROP VIEW + CREATE VIEW es atómico frente a otros hilos y
+        procesos (sin ella, sqlite3 ejecuta cada DDL en autocommit).
+        """
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
     def _init_schema(self):
         conn = self._get_connection()
         cursor = conn.cursor()
+        # WAL: el mantenimiento online y los lectores no bloquean las escrituras del agente
+        cursor.execute("PRAGMA journal_mode=WAL")
         
-        # Tabla de tareas
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS task_history (
-            task_id TEXT PRIMARY KEY,
-            agent_id TEXT,
-            task_type TEXT,
-            description TEXT,
-            status TEXT,
-            start_time TEXT,
-            end_time TEXT,
-            duration REAL,
-            result JSON,
-            metadata JSON
-        )
-        ''')
+        with self._schema_change(conn):
+            # Historial sin particionar (versiones anteriores): pasa a ser la partición actual
+            legacy = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'task_history'"
+            ).fetchone()
+            if legacy:
+                # start_time/end_time son relojes del loop, no fechas: recorded_at (epoch) da la antigüedad
+                columns = {row[1] for row in cursor.execute("PRAGMA table_info(task_history)")}
+                if 'recorded_at' not in columns:
+                    cursor.execute("ALTER TABLE task_history ADD COLUMN recorded_at REAL")
+                    cursor.execute("UPDATE task_history SET recorded_at = ?", (time.time(),))
+                current = partition_name(time.time(), self.partition_by)
+                if cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (current,)).fetchone():
+                    cursor.execute(f"INSERT OR IGNORE INTO {current} SELECT {', '.join(HISTORY_COLUMNS)} FROM task_history")
+                    cursor.execute("DROP TABLE task_history")
+                else:
+                    cursor.execute(f"ALTER TABLE task_history RENAME TO {current}")
+                    # _ensure_partition no la tocará (ya existe): su índice se crea aquí
+                    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{current}_agent ON {current} (agent_id, recorded_at)")
+            # Las particiones se crean con la primera tarea de su periodo
+            self._rebuild_view(conn)
         
         # Tabla de conocimiento (Knowledge Base)
         cursor.execute('''
@@ -61,28 +136,139 @@ class PersistentMemory:
         
     def store_task(self, task_data: Dict):
         """Almacena o actualiza una tarea"""
+        self.store_tasks([task_data])
+        
+    def _ensure_partition(self, conn, name: str):
+        """Crea la partición si no existe (y rehace la vista)"""
+        if name in self._partitions:
+            return
+        with self._schema_change(conn):
+            conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {name} (
+                task_id TEXT PRIMARY KEY,
+                agent_id TEXT,
+                task_type TEXT,
+                description TEXT,
+                status TEXT,
+                start_time TEXT,
+                end_time TEXT,
+                duration REAL,
+                result JSON,
+                metadata JSON,
+                recorded_at REAL
+            )
+            ''')
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_agent ON {name} (agent_id, recorded_at)")
+            self._rebuild_view(conn)
+
+    def _rebuild_view(self, conn):
+        """Vista `task_history` = UNION ALL de las particiones vivas (dentro de _schema_change)"""
+        self._partitions = set(self._list_partitions(conn))
+        columns = ', '.join(HISTORY_COLUMNS)
+        selects = [f"SELECT {columns} FROM {name}" for name in sorted(self._partitions)]
+        if not selects:
+            selects = [f"SELECT {', '.join(f'NULL AS {c}' for c in HISTORY_COLUMNS)} WHERE 0"]
+        conn.execute("DROP VIEW IF EXISTS task_history")
+        conn.execute(f"CREATE VIEW task_history AS {' UNION ALL '.join(selects)}")
+
+    @staticmethod
+    def _list_partitions(conn) -> List[str]:
+        rows = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?", (PARTITION_PREFIX + '%',)
+        ).fetchall()
+        return sorted(row[0] for row in rows if partition_period(row[0]))
+
+    def list_partitions(self) -> List[str]:
         conn = self._get_connection()
-        cursor = conn.cursor()
+        try:
+            return self._list_partitions(conn)
+        finally:
+            conn.close()
         
-        cursor.execute('''
-        INSERT OR REPLACE INTO task_history 
-        (task_id, agent_id, task_type, description, status, start_time, end_time, duration, result, metadata)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            task_data.get('task_id'),
-            task_data.get('agent_id'),
-            task_data.get('task_type'),
-            task_data.get('description'),
-            task_data.get('status'),
-            str(task_data.get('start_time')),
-            str(task_data.get('end_time')),
-            task_data.get('duration'),
-            json.dumps(task_data.get('result', {})),
-            json.dumps(task_data.get('metadata', {}))
-        ))
+    def store_tasks(self, tasks: List[Dict]):
+        """Almacena o actualiza varias tareas en una sola transacción (lotes)"""
+        now = time.time()
+        by_partition: Dict[str, List[tuple]] = {}
+        for task_data in tasks:
+            recorded_at = task_data.get('recorded_at') or now
+            by_partition.setdefault(partition_name(recorded_at, self.partition_by), []).append((
+                task_data.get('task_id'),
+                task_data.get('agent_id'),
+                task_data.get('task_type'),
+                task_data.get('description'),
+                task_data.get('status'),
+                str(task_data.get('start_time')),
+                str(task_data.get('end_time')),
+                task_data.get('duration'),
+                json.dumps(task_data.get('result', {})),
+                json.dumps(task_data.get('metadata', {})),
+                recorded_at
+            ))
         
-        conn.commit()
-        conn.close()
+        conn = self._get_connection()
+        try:
+            for name, rows in by_partition.items():
+                try:
+                    self._insert_rows(conn, name, rows)
+                except sqlite3.OperationalError:
+                    # Otra conexión archivó la partición: se recrea y se reintenta
+                    self._partitions.discard(name)
+                    self._insert_rows(conn, name, rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _insert_rows(self, conn, name: str, rows: List[tuple]):
+        self._ensure_partition(conn, name)
+        conn.executemany(f'''
+        INSERT OR REPLACE INTO {name}
+        ({', '.join(HISTORY_COLUMNS)})
+        VALUES ({', '.join('?' * len(HISTORY_COLUMNS))})
+        ''', rows)
+
+    def drop_partition(self, name: str):
+        """Elimina una partición entera (DROP TABLE: sin borrado fila a fila)"""
+        if not partition_period(name):
+            raise ValueError(f"No es una partición de historial: {name}")
+        conn = self._get_connection()
+        try:
+            with self._schema_change(conn):
+                conn.execute(f"DROP TABLE IF EXISTS {name}")
+                self._rebuild_view(conn)
+        finally:
+            conn.close()
+
+    def archive_partition(self, name: str) -> int:
+        """Guarda la partición como segmento comprimido y la elimina; devuelve las filas archivadas"""
+        start, end = partition_period(name)
+        conn = self._get_connection()
+        try:
+            rows = conn.execute(f"SELECT {', '.join(HISTORY_COLUMNS)} FROM {name}").fetchall()
+        finally:
+            conn.close()
+        path = self.archive_dir / f"{name}.npz"
+        if path.exists():
+            # Filas tardías de un periodo ya archivado: se añaden al segmento existente
+            with Segment(path) as segment:
+                rows = list(zip(*(segment.column(c) for c in HISTORY_COLUMNS))) + rows
+        count = write_segment(path, rows, start, end)
+        self.drop_partition(name)
+        return count
+
+    def archive_partitions(self, older_than_days: float, limit: Optional[int] = None) -> List[str]:
+        """Archiva las particiones cuyo periodo terminó hace más de `older_than_days` días"""
+        cutoff = time.time() - older_than_days * 86400
+        aged = [name for name in self.list_partitions() if partition_period(name)[1] <= cutoff]
+        for name in aged[:limit]:
+            self.archive_partition(name)
+        return aged[:limit]
+
+    def segments(self, since: Optional[float] = None) -> List[Path]:
+        """Segmentos archivados cuyo periodo termina después de `since`"""
+        if not self.archive_dir.exists():
+            return []
+        paths = sorted(self.archive_dir.glob(f"{PARTITION_PREFIX}*.npz"))
+        return [p for p in paths if partition_period(p.stem) and (since is None or partition_period(p.stem)[1] > since)]
         
     def learn_from_history(self, task_type: str, limit: int = 10) -> List[Dict]:
         """Recupera tareas pasadas para aprender"""
@@ -130,33 +316,48 @@ class PersistentMemory:
         conn.close()
         
     def get_agent_performance(self, agent_id: str, days: int = 7) -> Dict:
-        """Obtiene métricas de performance de un agente"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        
-        start_date = (datetime.now() - timedelta(days=days)).isoformat()
-        
-        cursor.execute('''
-        SELECT 
-            COUNT(*) as total,
-            SUM(CASE WHEN status='completed' THEN 1 ELSE 0 END) as successful,
-            AVG(duration) as avg_dur
-        FROM task_history 
-        WHERE agent_id = ? AND start_time > ?
-        ''', (agent_id, start_date))
+        """Obtiene métricas de performance de un agente (particiones vivas y segmentos archivados)"""
+        cutoff = time.time() - days * 86400
+        total = successful = 0
+        duration_sum = 0.0
+        duration_count = 0
         
-        row = cursor.fetchone()
-        conn.close()
+        conn = self._get_connection()
+        try:
+            for name in self._list_partitions(conn):
+                if partition_period(name)[1] <= cutoff:
+                    continue
+                row = conn.execute(f'''
+                SELECT 
+                    COUNT(*),
+                    SUM(CASE WHEN status='completed' THEN 1 ELSE 0 END),
+                    SUM(duration),
+                    COUNT(duration)
+                FROM {name}
+                WHERE agent_id = ? AND recorded_at > ?
+                ''', (agent_id, cutoff)).fetchone()
+                total += row[0] or 0
+                successful += row[1] or 0
+                duration_sum += row[2] or 0
+                duration_count += row[3] or 0
+        finally:
+            conn.close()
         
-        if not row:
-            return {}
-            
-        total = row[0] or 0
-        successful = row[1] or 0
-        avg_dur = row[2] or 0
+        for path in self.segments(since=cutoff):
+            with Segment(path) as segment:
+                mask = segment.codes('agent_id', agent_id)
+                if mask is None:
+                    continue
+                mask &= segment.numeric('recorded_at') > cutoff
+                completed = segment.codes('status', 'completed')
+                durations = segment.numeric('duration')[mask]
+                total += int(mask.sum())
+                successful += int((mask & completed).sum()) if completed is not None else 0
+                duration_sum += float(np.nansum(durations))
+                duration_count += int(np.count_nonzero(~np.isnan(durations)))
         
         return {
             'total_tasks': total,
             'success_rate': (successful / total) if total > 0 else 0,
-            'avg_duration': avg_dur
+            'avg_duration': (duration_sum / duration_count) if duration_count else 0
         }
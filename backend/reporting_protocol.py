@@ -23,27 +23,30 @@ class AgentReporter:
             'timestamp': datetime.now().isoformat()
         })
         
-    def update_progress(self, progress: int, status_message: str):
+    def update_progress(self, progress: int, status_message: str, task_id: str = None):
         """Actualiza progreso"""
         self._send_report({
             'event': 'TASK_PROGRESS',
+            'task_id': task_id,
             'progress': progress,
             'message': status_message,
             'timestamp': datetime.now().isoformat()
         })
         
-    def complete_task(self, result: Dict = None):
+    def complete_task(self, result: Dict = None, task_id: str = None):
         """Reporta tarea completada"""
         self._send_report({
             'event': 'TASK_COMPLETE',
+            'task_id': task_id,
             'result': result,
             'timestamp': datetime.now().isoformat()
         })
         
-    def report_error(self, error_message: str):
+    def report_error(self, error_message: str, task_id: str = None):
         """Reporta error"""
         self._send_report({
             'event': 'TASK_ERROR',
+            'task_id': task_id,
             'error': error_message,
             'timestamp': datetime.now().isoformat()
         })
@@ -0,0 +1,192 @@
+# result_store.py
+import hashlib
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import requests
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ResultStore:
+    """
+    Almacén local de resultados direccionado por contenido (sha256).
+
+    Los resultados que superan `inline_max_bytes` se guardan una sola vez
+    y por la red viaja solo una referencia ({'digest', 'size', 'url'}) con
+    un resumen. Los consumidores recuperan el contenido bajo demanda con
+    `load()`, desde disco si es local o por streaming HTTP si no.
+    """
+
+    def __init__(self, root: str = ".antigravity-results", inline_max_bytes: int = 8192,
+                 base_url: str = None, summary_chars: int = 256, chunk_size: int = 65536):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.inline_max_bytes = inline_max_bytes
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.summary_chars = summary_chars
+        self.chunk_size = chunk_size
+
+    def path(self, digest: str) -> Path:
+        if not _DIGEST_RE.match(digest):
+            raise ValueError(f"Digest inválido: {digest}")
+        return self.root / digest[:2] / digest[2:]
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).exists()
+
+    def url(self, digest: str) -> Optional[str]:
+        return f"{self.base_url}/results/{digest}" if self.base_url else None
+
+    def put_bytes(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        target = self.path(digest)
+        if not target.exists():
+            self._write_atomic(target, [data])
+        return digest
+
+    def put_file(self, source: str, remove_source: bool = False) -> Dict:
+        """Ingresa un fichero por bloques (p. ej. el spool de un comando)"""
+        hasher = hashlib.sha256()
+        size = 0
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                hasher.update(chunk)
+                size += len(chunk)
+        digest = hasher.hexdigest()
+        target = self.path(digest)
+        if not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if remove_source:
+                os.replace(source, target)
+            else:
+                with open(source, 'rb') as f:
+                    self._write_atomic(target, iter(lambda: f.read(self.chunk_size), b''))
+        if remove_source and os.path.exists(source):
+            os.unlink(source)
+        return self._ref(digest, size, 'application/octet-stream')
+
+    def _write_atomic(self, target: Path, chunks):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=target.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _ref(self, digest: str, size: int, content_type: str) -> Dict:
+        return {'digest': digest, 'size': size, 'content_type': content_type, 'url': self.url(digest)}
+
+    def offload(self, result: Any) -> Any:
+        """
+        Sustituye un resultado grande por {'result_ref': ..., 'summary': ...}.
+
+        Los ficheros de spool de salida completa se ingresan también y se
+        sustituyen por referencias en 'outputs'. Sin `base_url` (no hay
+        servidor que las sirva) el resultado se devuelve tal cual.
+        """
+        if not isinstance(result, dict) or not self.base_url:
+            return result
+        if result.get('spool'):
+            result = dict(result)
+            result['outputs'] = {name: self.put_file(path, remove_source=True)
+                                 for name, path in result.pop('spool').items()
+                                 if os.path.exists(path)}
+
+        encoded = json.dumps(result, default=str).encode()
+        if len(encoded) <= self.inline_max_bytes:
+            return result
+        digest = self.put_bytes(encoded)
+        return {
+            'status': result.get('status', 'completed'),
+            'result_ref': self._ref(digest, len(encoded), 'application/json'),
+            'summary': self._summarize(result)
+        }
+
+    def _summarize(self, result: Dict) -> Dict:
+        summary = {}
+        for key, value in result.items():
+            if key == 'outputs' or value is None or isinstance(value, (bool, int, float)):
+                summary[key] = value
+            elif isinstance(value, str):
+                summary[key] = value if len(value) <= self.summary_chars else value[:self.summary_chars] + '…'
+            elif isinstance(value, (list, dict)):
+                summary[key] = f"<{type(value).__name__} de {len(value)} elementos>"
+        return summary
+
+    def open(self, digest: str):
+        return open(self.path(digest), 'rb')
+
+    def load(self, ref: Dict) -> Any:
+        """Recupera el contenido de una referencia (local o vía su URL, en streaming)"""
+        digest = ref['digest']
+        if not self.exists(digest):
+            if not ref.get('url'):
+                raise KeyError(f"Resultado {digest} no disponible localmente y sin URL")
+            self._fetch(ref['url'], digest)
+        if ref.get('content_type') == 'application/json':
+            with self.open(digest) as f:
+                return json.load(f)
+        return self.path(digest)
+
+    def _fetch(self, url: str, digest: str):
+        hasher = hashlib.sha256()
+
+        def chunks(response):
+            for chunk in response.iter_content(self.chunk_size):
+                hasher.update(chunk)
+                yield chunk
+
+        target = self.path(digest)
+        with requests.get(url, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            self._write_atomic(target, chunks(response))
+        if hasher.hexdigest() != digest:
+            target.unlink(missing_ok=True)
+            raise ValueError(f"Contenido de {url} no coincide con su digest")
+
+
+def is_result_ref(result: Any) -> bool:
+    return isinstance(result, dict) and isinstance(result.get('result_ref'), dict)
+
+
+def is_failed_result(result: Any) -> bool:
+    """Error explícito, comando con código distinto de 0 o con timeout (también por referencia)"""
+    if not isinstance(result, dict):
+        return False
+    if result.get('status') in ('failed', 'error'):
+        return True
+    fields = result.get('summary', result) if is_result_ref(result) else result
+    return bool(fields.get('timed_out')) or fields.get('code') not in (None, 0)
+
+
+async def start_result_server(store: ResultStore, host: str = '127.0.0.1', port: int = 8790):
+    """Sirve GET /results/{digest} en streaming (con soporte de Range) vía aiohttp"""
+    from aiohttp import web
+
+    async def get_result(request):
+        digest = request.match_info['digest']
+        try:
+            path = store.path(digest)
+        except ValueError:
+            raise web.HTTPBadRequest(text='digest inválido')
+        if not path.exists():
+            raise web.HTTPNotFound()
+        return web.FileResponse(path, chunk_size=store.chunk_size,
+                                headers={'ETag': f'"{digest}"',
+                                         'Cache-Control': 'public, max-age=31536000, immutable'})
+
+    app = web.Application()
+    app.router.add_get('/results/{digest}', get_result)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
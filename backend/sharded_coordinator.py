@@ -0,0 +1,344 @@
+# sharded_coordinator.py
+"""
+Modo shardeado del coordinador.
+
+Un proceso frontal acepta las conexiones WebSocket y las reenvía, sin
+re-serializar, a N procesos shard (MasterCoordinator). Cada agente se
+asigna a un shard por hash estable de su agent_id, y cada shard tiene
+sus agentes y su partición de la cola. El frontal sondea el estado de
+los shards por un canal de control y equilibra la carga robando tareas
+del shard más cargado para los shards con agentes ociosos y cola vacía.
+Los SYSTEM_STATUS_UPDATE que llegan a los agentes se sustituyen por el
+estado agregado de todos los shards. Las TASK_DELEGATION se envían al
+shard del agente destino (`to`), aunque la conexión esté en otro.
+
+El canal de control (SHARD_*) se sirve en un puerto aparte que solo
+escucha en loopback; el frontal descarta esos tipos en el tráfico de
+los clientes.
+
+Uso:
+    python backend/sharded_coordinator.py --shards 4 --port 8766
+
+Limitación: el contexto compartido (SyncManager) es local a cada shard.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import zlib
+from typing import Any, Dict, List, Optional
+
+import websockets
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from master_coordinator import MasterCoordinator
+
+STATUS_PREFIX = '{"type": "SYSTEM_STATUS_UPDATE"'
+CONTROL_PREFIX = 'SHARD_'
+SUMMED_FIELDS = ('total_agents', 'active_agents', 'idle_agents', 'tasks_in_queue',
+                 'active_tasks', 'completed_tasks')
+
+
+def shard_for(key: str, shards: int) -> int:
+    """Shard de una clave; crc32 es estable entre procesos (hash() no lo es)"""
+    return zlib.crc32(key.encode()) % shards
+
+
+def is_control_message(message) -> bool:
+    """True si el mensaje es del canal de control (SHARD_*), que un cliente no puede enviar"""
+    if not isinstance(message, str) or CONTROL_PREFIX not in message:
+        return False
+    try:
+        data = json.loads(message)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(data, dict) and str(data.get('type', '')).startswith(CONTROL_PREFIX)
+
+
+class ShardCoordinator(MasterCoordinator):
+    """MasterCoordinator que además atiende el canal de control del frontal"""
+
+    def __init__(self, shard_index: int):
+        super().__init__()
+        self.shard_index = shard_index
+        # Fuera de message_handlers: solo se atienden en el puerto de control
+        self.control_handlers = {
+            'SHARD_STATS_REQUEST': self.handle_stats_request,
+            'SHARD_STEAL_REQUEST': self.handle_steal_request,
+            'SHARD_INJECT': self.handle_inject,
+        }
+
+    async def start_control_server(self, port: int):
+        """Canal de control del frontal: solo en loopback, separado del de los agentes"""
+        await websockets.serve(self.handle_control, '127.0.0.1', port, max_size=None)
+
+    async def handle_control(self, websocket, path=None):
+        try:
+            async for message in websocket:
+                data = json.loads(message)
+                handler = self.control_handlers.get(data.get('type'))
+                if handler:
+                    await handler(data, websocket)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def handle_stats_request(self, data, websocket):
+        status = self.system_status()
+        status['idle_agents'] = len(self.idle_agent_ids())
+        await websocket.send(json.dumps({
+            'type': 'SHARD_STATS',
+            'shard': self.shard_index,
+            'status': status
+        }))
+
+    async def handle_steal_request(self, data, websocket):
+        """Cede tareas en cola (las de menor prioridad primero) a otro shard"""
+        # Las tareas de un grafo se quedan: su avance lo sigue este shard
+        tasks = self.task_queue.steal(int(data.get('count', 1)), lambda t: 'graph_id' not in t)
+        await websocket.send(json.dumps({
+            'type': 'SHARD_STOLEN',
+            'shard': self.shard_index,
+            'thief': data.get('thief'),
+            'tasks': tasks
+        }, default=str))
+
+    async def handle_inject(self, data, websocket):
+        """Recibe tareas robadas de otro shard y las asigna a agentes ociosos"""
+        for task in data.get('tasks', []):
+            await self.task_queue.put(task)
+        await self.dispatch_to_idle_agents()
+
+
+def run_shard(index: int, host: str, port: int, control_port: int):
+    """Proceso shard: un coordinador completo escuchando en un puerto interno"""
+    async def main():
+        coordinator = ShardCoordinator(index)
+        await coordinator.start_control_server(control_port)
+        asyncio.create_task(coordinator.monitor_agents())
+        asyncio.create_task(coordinator.sync_manager.start_sync_worker())
+        await coordinator.start_server(host, port)
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+class ShardFront:
+    """Proceso frontal: enruta conexiones a shards, agrega estado y reparte trabajo"""
+
+    def __init__(self, shard_urls: List[str], control_urls: List[str],
+                 poll_interval: float = 0.5, steal_batch: int = 8):
+        self.shard_urls = shard_urls
+        self.control_urls = control_urls
+        self.poll_interval = poll_interval
+        self.steal_batch = steal_batch
+        self.shard_status: Dict[int, Dict] = {}
+        self.control: Dict[int, Any] = {}
+        self.pending_steals = set()  # Shards ladrones con un robo en curso
+        self.steals = 0
+
+    @property
+    def shards(self) -> int:
+        return len(self.shard_urls)
+
+    def pick_shard(self, first_message: str) -> int:
+        """Shard para una conexión nueva, según su primer mensaje"""
+        try:
+            data = json.loads(first_message)
+        except json.JSONDecodeError:
+            data = {}
+        if data.get('type') == 'AGENT_REGISTER':
+            return shard_for(data['agent']['agent_id'], self.shards)
+        if data.get('type') == 'TASK_DELEGATION' and data.get('to'):
+            return shard_for(data['to'], self.shards)
+        # Emisores anónimos: el shard con menos tareas en cola
+        return min(range(self.shards),
+                   key=lambda i: self.shard_status.get(i, {}).get('tasks_in_queue', 0))
+
+    def route_shard(self, message, default: int) -> int:
+        """Shard de un mensaje del cliente: las delegaciones van al shard del agente `to`"""
+        if not isinstance(message, str) or 'TASK_DELEGATION' not in message:
+            return default
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            return default
+        if data.get('type') == 'TASK_DELEGATION' and data.get('to'):
+            return shard_for(data['to'], self.shards)
+        return default
+
+    async def handle_client(self, websocket, path=None):
+        try:
+            first = await websocket.recv()
+        except websockets.exceptions.ConnectionClosed:
+            return
+        if is_control_message(first):
+            await websocket.close(1008, 'control messages not allowed')
+            return
+        index = self.pick_shard(first)
+        async with websockets.connect(self.shard_urls[index], max_size=None) as upstream:
+            await upstream.send(first)
+            # Conexiones extra (perezosas) a otros shards para delegaciones dirigidas a sus agentes
+            upstreams = {index: upstream}
+            extra_pumps = []
+
+            async def to_client(shard, ws):
+                try:
+                    async for message in ws:
+                        if isinstance(message, str) and message.startswith(STATUS_PREFIX):
+                            message = self.merge_status(shard, message)
+                        await websocket.send(message)
+                finally:
+                    if shard != index:
+                        upstreams.pop(shard, None)
+
+            async def upstream_for(shard):
+                ws = upstreams.get(shard)
+                if ws is None:
+                    ws = upstreams[shard] = await websockets.connect(self.shard_urls[shard], max_size=None)
+                    extra_pumps.append(asyncio.create_task(to_client(shard, ws)))
+                return ws
+
+            async def to_shard():
+                async for message in websocket:
+                    if is_control_message(message):
+                        continue  # El canal de control no se expone a los clientes
+                    target = await upstream_for(self.route_shard(message, index))
+                    await target.send(message)
+
+            pumps = [asyncio.create_task(to_shard()), asyncio.create_task(to_client(index, upstream))]
+            try:
+                await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for pump in pumps + extra_pumps:
+                    pump.cancel()
+                await asyncio.gather(*pumps, *extra_pumps, return_exceptions=True)
+                for shard, ws in list(upstreams.items()):
+                    if shard != index:
+                        await ws.close()
+
+    def merge_status(self, index: int, message: str) -> str:
+        """Sustituye el estado de un shard por la suma de todos"""
+        status = json.loads(message)['status']
+        self.shard_status[index] = {**self.shard_status.get(index, {}), **status}
+        merged = {field: sum(s.get(field, 0) for s in self.shard_status.values()) for field in SUMMED_FIELDS}
+        merged['shards'] = self.shards
+        return json.dumps({'type': 'SYSTEM_STATUS_UPDATE', 'status': merged})
+
+    async def control_loop(self, index: int):
+        """Canal de control con un shard: sondeo de estado y respuestas de robo"""
+        while True:
+            try:
+                async with websockets.connect(self.control_urls[index], max_size=None) as ws:
+                    self.control[index] = ws
+                    poller = asyncio.create_task(self._poll(ws))
+                    try:
+                        async for message in ws:
+                            await self._on_control_message(json.loads(message))
+                    finally:
+                        poller.cancel()
+            except (OSError, websockets.exceptions.WebSocketException):
+                pass
+            self.control.pop(index, None)
+            await asyncio.sleep(1)
+
+    async def _poll(self, ws):
+        while True:
+            await ws.send(json.dumps({'type': 'SHARD_STATS_REQUEST'}))
+            await asyncio.sleep(self.poll_interval)
+
+    async def _on_control_message(self, data: Dict):
+        message_type = data.get('type')
+        if message_type == 'SHARD_STATS':
+            self.shard_status[data['shard']] = data['status']
+            await self.balance()
+        elif message_type == 'SHARD_STOLEN':
+            thief = data.get('thief')
+            self.pending_steals.discard(thief)
+            if not data['tasks']:
+                return
+            if thief in self.control:
+                self.steals += len(data['tasks'])
+                target = thief
+                # El ladrón ya no está ocioso hasta el próximo sondeo
+                self.shard_status.get(thief, {})['idle_agents'] = 0
+            else:
+                # El ladrón cayó: las tareas vuelven al donante (o a cualquier shard vivo)
+                donor = data.get('shard')
+                target = donor if donor in self.control else next(iter(self.control), None)
+                if target is None:
+                    print(f"⚠️  {len(data['tasks'])} tareas robadas sin shard vivo al que devolverlas")
+                    return
+            await self.control[target].send(json.dumps({'type': 'SHARD_INJECT', 'tasks': data['tasks']}))
+
+    async def balance(self):
+        """Work stealing: shards con agentes ociosos y cola vacía roban al más cargado"""
+        if len(self.shard_status) < 2:
+            return
+        thieves = [i for i, s in self.shard_status.items()
+                   if s.get('idle_agents') and not s.get('tasks_in_queue') and i not in self.pending_steals]
+        for thief in thieves:
+            donor = max(self.shard_status, key=lambda i: self.shard_status[i].get('tasks_in_queue', 0))
+            queued = self.shard_status[donor].get('tasks_in_queue', 0)
+            if donor == thief or not queued or donor not in self.control:
+                continue
+            count = max(1, min(queued // 2, self.shard_status[thief]['idle_agents'] * self.steal_batch))
+            self.pending_steals.add(thief)
+            # Se descuenta ya para no pedir dos veces lo mismo antes del próximo sondeo
+            self.shard_status[donor]['tasks_in_queue'] = queued - count
+            await self.control[donor].send(json.dumps({
+                'type': 'SHARD_STEAL_REQUEST',
+                'count': count,
+                'thief': thief
+            }))
+
+    async def serve(self, host: str, port: int):
+        # SIGTERM termina el servidor con normalidad para que main() pare los shards
+        stop = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        except NotImplementedError:
+            pass
+        for index in range(self.shards):
+            asyncio.create_task(self.control_loop(index))
+        async with websockets.serve(self.handle_client, host, port, max_size=None):
+            print(f"🚀 Coordinador shardeado en ws://{host}:{port} ({self.shards} shards)")
+            await stop.wait()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Coordinador maestro shardeado')
+    parser.add_argument('--shards', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--shard-base-port', type=int, default=8800)
+    parser.add_argument('--shard-control-base-port', type=int, default=8900)
+    args = parser.parse_args(argv)
+
+    processes = []
+    for index in range(args.shards):
+        process = multiprocessing.Process(
+            target=run_shard, daemon=True,
+            args=(index, '127.0.0.1', args.shard_base_port + index, args.shard_control_base_port + index)
+        )
+        process.start()
+        processes.append(process)
+
+    front = ShardFront([f"ws://127.0.0.1:{args.shard_base_port + i}" for i in range(args.shards)],
+                       [f"ws://127.0.0.1:{args.shard_control_base_port + i}" for i in range(args.shards)])
+    try:
+        asyncio.run(front.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\n👋 Cerrando coordinador shardeado")
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+# streaming_stats.py
+import base64
+import hashlib
+import math
+from typing import Dict, Iterable, Optional
+
+
+class RunningMoments:
+    """Media, varianza, min y max incrementales (Welford), combinables entre sí"""
+
+    __slots__ = ('count', 'mean', 'm2', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'RunningMoments'):
+        """Combina otro acumulador (algoritmo paralelo de Chan)"""
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.total, self.min, self.max = other.total, other.min, other.max
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std_dev(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class LogBucketSketch:
+    """
+    Sketch de cuantiles con buckets logarítmicos (estilo DDSketch).
+
+    Garantiza error relativo `relative_accuracy` en cualquier cuantil con
+    memoria proporcional al rango dinámico de los valores, no a su número.
+    """
+
+    __slots__ = ('relative_accuracy', 'gamma', '_log_gamma', 'min_value',
+                 'positive', 'negative', 'zero_count', 'count')
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _bucket_value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float, count: int = 1):
+        self.count += count
+        if value > self.min_value:
+            index = self._index(value)
+            self.positive[index] = self.positive.get(index, 0) + count
+        elif value < -self.min_value:
+            index = self._index(-value)
+            self.negative[index] = self.negative.get(index, 0) + count
+        else:
+            self.zero_count += count
+
+    def merge(self, other: 'LogBucketSketch'):
+        """Suma los buckets de otro sketch con la misma precisión"""
+        if other.gamma != self.gamma:
+            raise ValueError("No se pueden combinar sketches con distinta precisión")
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Cuantil aproximado (q en [0, 1]), mismo criterio de rango que un percentil ordenado"""
+        if self.count == 0:
+            return None
+        rank = min(int(self.count * q), self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._bucket_value(index)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._bucket_value(index)
+        return self._bucket_value(max(self.positive)) if self.positive else 0.0
+
+    def copy(self) -> 'LogBucketSketch':
+        clone = LogBucketSketch(self.relative_accuracy, self.min_value)
+        clone.merge(self)
+        return clone
+
+
+class BloomFilter:
+    """
+    Filtro de Bloom para anunciar conjuntos de claves en poco espacio.
+
+    Sin falsos negativos; la tasa de falsos positivos se fija al crearlo
+    para `capacity` elementos. Usa doble hashing sobre un único blake2b.
+    Se serializa a base64 para viajar en mensajes JSON.
+    """
+
+    __slots__ = ('size', 'hashes', 'bits', 'count')
+
+    def __init__(self, capacity: int = 4096, error_rate: float = 0.01):
+        capacity = max(1, capacity)
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.size += -self.size % 8
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(self.size // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, keys: Iterable[str]):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def to_dict(self) -> Dict:
+        return {
+            'size': self.size,
+            'hashes': self.hashes,
+            'count': self.count,
+            'bits': base64.b64encode(bytes(self.bits)).decode('ascii')
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'BloomFilter':
+        bloom = cls.__new__(cls)
+        bloom.size = int(data['size'])
+        bloom.hashes = int(data['hashes'])
+        bloom.count = int(data.get('count', 0))
+        bloom.bits = bytearray(base64.b64decode(data['bits']))
+        if len(bloom.bits) * 8 != bloom.size:
+            raise ValueError("Filtro de Bloom con tamaño inconsistente")
+        return bloom
@@ -1,83 +1,432 @@
 # sync_manager.py
 import asyncio
+import copy
 import json
 from datetime import datetime
-from typing import Dict, List, Set, Any
+from collections import OrderedDict, deque
+from typing import Dict, List, Set, Any, Optional
 import hashlib
+import time
+
+from crdt import VectorClock, CRDT, crdt_from_dict, is_crdt_value, new_crdt
+from json_delta import json_diff, apply_patch
+
+class ContextHistory:
+    """
+    Historial compacto de una clave: snapshots cada `snapshot_interval`
+    versiones más los deltas intermedios. Reconstruir la versión N cuesta
+    como mucho `snapshot_interval` deltas, no todo el historial.
+    """
+
+    def __init__(self, snapshot_interval: int = 20, max_snapshots: int = 5):
+        self.snapshot_interval = snapshot_interval
+        self.max_snapshots = max_snapshots
+        self.snapshots = {}  # version -> valor completo
+        self.deltas = {}     # version -> delta respecto a version - 1
+
+    def record(self, version: int, value: Any, delta: List[Dict], snapshot: bool = False):
+        # El delta se guarda también en las versiones con snapshot: deltas_since no se corta en ellas
+        self.deltas[version] = delta
+        if snapshot or not self.snapshots or version % self.snapshot_interval == 0:
+            self.snapshots[version] = copy.deepcopy(value)
+            self._compact()
+
+    def _compact(self):
+        """Descarta los snapshots más viejos y los deltas que ya no se pueden usar"""
+        if len(self.snapshots) <= self.max_snapshots:
+            return
+        versions = sorted(self.snapshots)
+        for version in versions[:-self.max_snapshots]:
+            del self.snapshots[version]
+        oldest = min(self.snapshots)
+        for version in [v for v in self.deltas if v <= oldest]:
+            del self.deltas[version]
+
+    @property
+    def oldest_version(self) -> int:
+        return min(self.snapshots) if self.snapshots else 0
+
+    def get_version(self, version: int) -> Any:
+        base = max((v for v in self.snapshots if v <= version), default=None)
+        if base is None:
+            raise KeyError(f"Versión {version} compactada o inexistente")
+        value = self.snapshots[base]
+        for v in range(base + 1, version + 1):
+            value = apply_patch(value, self.deltas[v])
+        # apply_patch comparte los nodos no tocados con el snapshot: el llamante recibe una copia
+        return copy.deepcopy(value)
+
+    def deltas_since(self, version: int, current: int) -> Optional[List[Dict]]:
+        """Delta acumulado de `version` a `current` (None si ya no es reconstruible)"""
+        ops = []
+        for v in range(version + 1, current + 1):
+            if v in self.deltas:
+                ops.extend(self.deltas[v])
+            else:
+                return None
+        return ops
+
+
+class SubscriberOutbox:
+    """
+    Cola acotada de actualizaciones pendientes para un suscriptor.
+
+    - 'coalesce': una entrada por clave; deltas consecutivos se encadenan y,
+      si hay hueco de versiones, el suscriptor pedirá un resync.
+    - 'drop_oldest': cola FIFO que descarta lo más antiguo al llenarse.
+
+    Las claves descartadas o cuyo envío falló quedan en `stale` y se
+    entregan en el siguiente drain con el valor completo (delta None).
+    """
+
+    def __init__(self, max_pending: int = 256, policy: str = 'coalesce', max_delta_ops: int = 256):
+        self.max_pending = max_pending
+        self.policy = policy
+        self.max_delta_ops = max_delta_ops
+        self.pending = OrderedDict() if policy == 'coalesce' else deque(maxlen=max_pending)
+        self.dropped = 0
+        self.stale = set()
+
+    def mark_stale(self, keys):
+        self.stale.update(keys)
+
+    def put(self, update: Dict):
+        if self.policy != 'coalesce':
+            if len(self.pending) == self.max_pending:
+                self.dropped += 1
+                self.stale.add(self.pending[0]['context_key'])
+            self.pending.append(update)
+            return
+
+        key = update['context_key']
+        previous = self.pending.pop(key, None)
+        if previous and previous['version'] == update['base_version'] and previous['delta'] is not None:
+            # Encadenar: base de la anterior, versión y checksum de la nueva
+            delta = previous['delta'] + update['delta']
+            if len(delta) > self.max_delta_ops:
+                delta = None  # Demasiado largo: se enviará el valor completo
+            update = {**update, 'base_version': previous['base_version'], 'delta': delta}
+        elif previous:
+            update = {**update, 'delta': None}
+        self.pending[key] = update
+        if len(self.pending) > self.max_pending:
+            dropped_key, _ = self.pending.popitem(last=False)
+            self.stale.add(dropped_key)
+            self.dropped += 1
+
+    def drain(self) -> List[Dict]:
+        """Pendientes; primero los valores completos de las claves `stale` (los deltas ya vistos se ignoran)"""
+        updates = [{'context_key': key, 'delta': None} for key in self.stale]
+        updates += list(self.pending.values()) if self.policy == 'coalesce' else list(self.pending)
+        self.pending.clear()
+        self.stale.clear()
+        return updates
+
+    def __len__(self):
+        return len(self.pending) + len(self.stale)
+
 
 class SyncManager:
-    def __init__(self):
+    def __init__(self, snapshot_interval: int = 20, max_snapshots: int = 5,
+                 outbox_size: int = 256, outbox_policy: str = 'coalesce'):
         self.shared_context = {}
-        self.context_history = []
+        self.history = {}  # clave -> ContextHistory
+        self.context_history = deque(maxlen=1000)  # Auditoría ligera (sin valores)
         self.subscriptions = {}
-        self.conflict_resolution = 'last_write_wins'
-        # Lazy initialization of Queue to ensure it attaches to the correct loop
-        self.sync_queue = None
+        self.key_subscribers = {}  # clave -> {agent_id}: evita recorrer todas las suscripciones
+        self.transports = {}       # agent_id -> coroutine send(str)
+        self.outboxes = {}         # agent_id -> SubscriberOutbox
+        self.outbox_size = outbox_size
+        self.outbox_policy = outbox_policy
+        # Relojes vectoriales; valores CRDT se fusionan y el resto usa LWW determinista
+        self.conflict_resolution = 'vector_clock'
+        self.crdt_replicas = {}    # clave -> CRDT local (escrituras sin ida y vuelta)
+        self.local_clocks = {}     # clave -> reloj de las escrituras locales aún no replicadas de vuelta
+        self.listeners = []        # callback(context_key, version, agent_id) en cada cambio
+        self.read_keys = set()     # Claves leídas localmente (el agente se suscribe a ellas)
+        self.read_listeners = []   # callback(context_key) la primera vez que se lee una clave
+        self.snapshot_interval = snapshot_interval
+        self.max_snapshots = max_snapshots
+        # Lazy initialization of Event to ensure it attaches to the correct loop
+        self._pending_agents = set()
+        self._wakeup = None
         
-    def _ensure_queue(self):
-        if self.sync_queue is None:
-            self.sync_queue = asyncio.Queue()
+    def _ensure_event(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
 
     async def update_context(self, agent_id: str, context_key: str, 
-                            value: Any, metadata: Dict = None):
-        self._ensure_queue()
-        timestamp = datetime.now()
+                            value: Any, metadata: Dict = None,
+                            vclock: Dict = None, timestamp: datetime = None):
+        """
+        Actualiza una clave compartida.
+        
+        `vclock` es el reloj vectorial del escritor remoto; sin él se trata como
+        escritura local y se incrementa el reloj de `agent_id`.
+        """
+        timestamp = timestamp or datetime.now()
+        # Copia propia: si el llamante muta su objeto después, no altera el estado ni el historial
+        value = copy.deepcopy(value)
+        existing = self.shared_context.get(context_key)
         
-        if context_key in self.shared_context:
-            existing = self.shared_context[context_key]
-            if self._has_conflict(existing, value, timestamp):
+        if existing:
+            if is_crdt_value(existing['value']) and is_crdt_value(value):
+                # Los CRDT convergen por merge: no hay conflicto que resolver
+                value = self._merge_crdt_values(existing['value'], value)
+            elif self._has_conflict(existing, vclock) is None:
+                return existing  # Escritura ya vista u obsoleta
+            elif self._has_conflict(existing, vclock):
                 value = await self._resolve_conflict(existing, value, agent_id, timestamp)
+            clock = VectorClock(existing.get('vclock')).merge(VectorClock(vclock))
+            delta = json_diff(existing['value'], value)
+            if not delta:
+                existing['vclock'] = clock.to_dict()
+                return existing
+        else:
+            clock = VectorClock(vclock)
+            delta = [{'op': 'replace', 'path': '', 'value': value}]
         
+        if vclock is None:
+            clock.increment(agent_id)
+        
+        version = self._get_next_version(context_key)
         self.shared_context[context_key] = {
             'value': value,
             'updated_by': agent_id,
             'timestamp': timestamp.isoformat(),
-            'version': self._get_next_version(context_key),
+            'version': version,
             'metadata': metadata or {},
+            'vclock': clock.to_dict(),
+            # El checksum se calcula una sola vez, al escribir
             'checksum': self._calculate_checksum(value)
         }
         
+        history = self.history.get(context_key)
+        if history is None:
+            history = self.history[context_key] = ContextHistory(self.snapshot_interval, self.max_snapshots)
+        history.record(version, value, delta)
+        
         self.context_history.append({
             'key': context_key,
-            'value': value,
+            'version': version,
             'agent': agent_id,
             'timestamp': timestamp.isoformat(),
-            'action': 'update'
+            'action': 'update',
+            'ops': len(delta)
         })
         
-        await self._notify_subscribers(context_key, agent_id)
+        self._notify_listeners(context_key, version, agent_id)
+        await self._notify_subscribers(context_key, agent_id, delta)
         return self.shared_context[context_key]
     
     def subscribe(self, agent_id: str, context_keys: List[str]):
         if agent_id not in self.subscriptions:
             self.subscriptions[agent_id] = set()
         self.subscriptions[agent_id].update(context_keys)
+        for key in context_keys:
+            self.key_subscribers.setdefault(key, set()).add(agent_id)
+    
+    def unsubscribe(self, agent_id: str, context_keys: List[str] = None):
+        keys = context_keys if context_keys is not None else list(self.subscriptions.get(agent_id, ()))
+        for key in keys:
+            subscribers = self.key_subscribers.get(key)
+            if subscribers:
+                subscribers.discard(agent_id)
+                if not subscribers:
+                    del self.key_subscribers[key]
+        if agent_id in self.subscriptions:
+            self.subscriptions[agent_id].difference_update(keys)
+    
+    def add_listener(self, callback):
+        """Registra un callback síncrono que se llama con (clave, versión, agente) en cada cambio"""
+        self.listeners.append(callback)
+    
+    def _notify_listeners(self, context_key: str, version: int, agent_id: str):
+        for callback in self.listeners:
+            try:
+                callback(context_key, version, agent_id)
+            except Exception as e:
+                print(f"Sync listener error: {e}")
+    
+    def add_read_listener(self, callback):
+        """Registra un callback síncrono que se llama con la clave la primera vez que se lee"""
+        self.read_listeners.append(callback)
+    
+    def note_read(self, context_key: str):
+        if context_key in self.read_keys:
+            return
+        self.read_keys.add(context_key)
+        for callback in self.read_listeners:
+            try:
+                callback(context_key)
+            except Exception as e:
+                print(f"Sync read listener error: {e}")
+    
+    def get_version(self, context_key: str) -> int:
+        context = self.shared_context.get(context_key)
+        return context['version'] if context else 0
+    
+    def register_transport(self, agent_id: str, send):
+        """Asocia la conexión por la que se entregan las actualizaciones (p.ej. websocket.send)"""
+        self.transports[agent_id] = send
+        if self.outboxes.get(agent_id):
+            self._schedule(agent_id)
     
-    async def _notify_subscribers(self, context_key: str, updater_agent: str):
-        self._ensure_queue()
-        for agent_id, subscribed_keys in self.subscriptions.items():
-            if context_key in subscribed_keys and agent_id != updater_agent:
-                await self.sync_queue.put({
-                    'type': 'CONTEXT_UPDATE',
-                    'target_agent': agent_id,
-                    'context_key': context_key,
-                    'value': self.shared_context[context_key],
-                    'updated_by': updater_agent
-                })
-    
-    def get_context(self, context_key: str, agent_id: str = None) -> Dict:
+    def unregister_transport(self, agent_id: str):
+        self.transports.pop(agent_id, None)
+    
+    def _schedule(self, agent_id: str):
+        self._ensure_event()
+        self._pending_agents.add(agent_id)
+        self._wakeup.set()
+    
+    async def _notify_subscribers(self, context_key: str, updater_agent: str, delta: List[Dict]):
+        subscribers = self.key_subscribers.get(context_key)
+        if not subscribers:
+            return
+        context = self.shared_context[context_key]
+        update = {
+            'context_key': context_key,
+            'version': context['version'],
+            'base_version': context['version'] - 1,
+            'delta': delta,
+            'checksum': context['checksum'],
+            'vclock': context['vclock'],
+            'updated_by': updater_agent
+        }
+        for agent_id in subscribers:
+            if agent_id == updater_agent:
+                continue
+            outbox = self.outboxes.get(agent_id)
+            if outbox is None:
+                outbox = self.outboxes[agent_id] = SubscriberOutbox(self.outbox_size, self.outbox_policy)
+            outbox.put(update)
+            self._schedule(agent_id)
+    
+    def full_update(self, context_key: str) -> Optional[Dict]:
+        """Actualización con el valor completo (respuesta a un resync)"""
+        context = self.shared_context.get(context_key)
+        if not context:
+            return None
+        return {
+            'context_key': context_key,
+            'version': context['version'],
+            'base_version': 0,
+            'delta': [{'op': 'replace', 'path': '', 'value': context['value']}],
+            'checksum': context['checksum'],
+            'vclock': context['vclock'],
+            'updated_by': context['updated_by']
+        }
+    
+    def apply_remote_update(self, message: Dict) -> bool:
+        """
+        Aplica un CONTEXT_UPDATE replicado (delta) a la copia local.
+        
+        Devuelve False si la versión local no coincide con `base_version`:
+        el llamante debe pedir la clave completa (resync).
+        """
+        key = message['context_key']
+        local = self.shared_context.get(key)
+        local_version = local['version'] if local else 0
+        if message['version'] <= local_version:
+            return True  # Ya aplicado
+        delta = message['delta']
+        is_full = len(delta) == 1 and delta[0]['path'] == '' and delta[0]['op'] != 'remove'
+        if local_version != message['base_version'] and not is_full:
+            return False
+        value = apply_patch(local['value'] if local else None, delta)
+        self.shared_context[key] = {
+            'value': value,
+            'updated_by': message.get('updated_by'),
+            'timestamp': datetime.now().isoformat(),
+            'version': message['version'],
+            'metadata': message.get('metadata', {}),
+            'vclock': message.get('vclock', {}),
+            'checksum': message.get('checksum')
+        }
+        history = self.history.get(key)
+        if history is None:
+            history = self.history[key] = ContextHistory(self.snapshot_interval, self.max_snapshots)
+        # Un valor completo (o una réplica con huecos) arranca desde un snapshot
+        history.record(message['version'], value, delta, snapshot=is_full)
+        
+        self._notify_listeners(key, message['version'], message.get('updated_by'))
+        
+        # Las réplicas CRDT locales absorben el estado remoto sin perder sus escrituras
+        replica = self.crdt_replicas.get(key)
+        remote = crdt_from_dict(value)
+        if replica is not None and remote is not None and remote.type_name == replica.type_name:
+            replica.merge(remote)
+        return True
+    
+    def get_context(self, context_key: str, agent_id: str = None, verify: bool = False) -> Dict:
         if context_key not in self.shared_context: return None
         context = self.shared_context[context_key]
-        if not self._verify_checksum(context): return None
+        if verify and not self._verify_checksum(context): return None
         return context
     
-    def _has_conflict(self, existing: Dict, new_value: Any, timestamp: datetime) -> bool:
-        existing_time = datetime.fromisoformat(existing['timestamp'])
-        possible_conflict = (timestamp - existing_time).total_seconds() < 1
-        return possible_conflict and existing['value'] != new_value
+    def verify_context(self, context_key: str) -> bool:
+        """Verificación de integridad bajo demanda (re-serializa y re-hashea)"""
+        context = self.shared_context.get(context_key)
+        return bool(context) and self._verify_checksum(context)
+    
+    def get_context_version(self, context_key: str, version: int) -> Any:
+        """Reconstruye el valor de una versión concreta desde el snapshot más cercano"""
+        context = self.shared_context.get(context_key)
+        if context and context['version'] == version:
+            return copy.deepcopy(context['value'])
+        if context_key not in self.history:
+            raise KeyError(context_key)
+        return self.history[context_key].get_version(version)
+    
+    def get_crdt(self, context_key: str, crdt_type: str) -> CRDT:
+        """Réplica local de un CRDT: se modifica sin locks ni esperar al coordinador"""
+        self.note_read(context_key)
+        replica = self.crdt_replicas.get(context_key)
+        if replica is None:
+            shared = self.shared_context.get(context_key)
+            replica = crdt_from_dict(shared['value']) if shared else None
+            if replica is None or replica.type_name != crdt_type:
+                replica = new_crdt(crdt_type)
+            self.crdt_replicas[context_key] = replica
+        return replica
+    
+    def publish_crdt(self, agent_id: str, context_key: str) -> Dict:
+        """
+        Estado de la réplica local listo para CONTEXT_SYNC (valor, reloj y
+        timestamp del escritor). No toca `shared_context`: las versiones de
+        esa copia son las del coordinador y solo cambian con sus réplicas.
+        """
+        shared = self.shared_context.get(context_key)
+        clock = VectorClock(shared['vclock'] if shared else None)
+        clock.merge(VectorClock(self.local_clocks.get(context_key))).increment(agent_id)
+        self.local_clocks[context_key] = clock.to_dict()
+        return {
+            'value': self.crdt_replicas[context_key].to_dict(),
+            'vclock': clock.to_dict(),
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def _merge_crdt_values(self, existing: Dict, incoming: Dict) -> Dict:
+        current, other = crdt_from_dict(existing), crdt_from_dict(incoming)
+        if current.type_name != other.type_name:
+            return incoming
+        return current.merge(other).to_dict()
+    
+    def _has_conflict(self, existing: Dict, vclock: Dict = None) -> Optional[bool]:
+        """True si la escritura es concurrente, False si la sucede, None si es obsoleta"""
+        if vclock is None:
+            return False
+        order = VectorClock(vclock).compare(VectorClock(existing.get('vclock')))
+        if order in ('before', 'equal'):
+            return None
+        return order == 'concurrent'
     
     async def _resolve_conflict(self, existing: Dict, new_value: Any, agent_id: str, timestamp: datetime) -> Any:
-        return new_value
+        """LWW determinista: gana (timestamp, agent_id) mayor en todas las réplicas"""
+        if (timestamp.isoformat(), agent_id) >= (existing['timestamp'], existing['updated_by'] or ''):
+            return new_value
+        return existing['value']
     
     def _calculate_checksum(self, value: Any) -> str:
         serialized = json.dumps(value, sort_keys=True, default=str)
@@ -92,41 +441,148 @@ class SyncManager:
         return self.shared_context[context_key].get('version', 0) + 1 if context_key in self.shared_context else 1
     
     async def start_sync_worker(self):
-        self._ensure_queue()
+        """Entrega por lotes: un CONTEXT_UPDATE_BATCH por agente con todo lo pendiente"""
+        self._ensure_event()
         while True:
-            try:
-                msg = await self.sync_queue.get()
-                # Simulate processing
-                await asyncio.sleep(0.01)
-                self.sync_queue.task_done()
-            except Exception as e:
-                print(f"Sync error: {e}")
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            agents, self._pending_agents = self._pending_agents, set()
+            sends = []
+            for agent_id in agents:
+                send = self.transports.get(agent_id)
+                outbox = self.outboxes.get(agent_id)
+                if send is None or not outbox:
+                    continue  # Sin conexión: se conserva (acotado) hasta que vuelva
+                updates = [u if u['delta'] is not None else self.full_update(u['context_key'])
+                           for u in outbox.drain()]
+                updates = [u for u in updates if u]
+                if not updates:
+                    continue
+                sends.append(self._deliver(agent_id, send, updates))
+            if sends:
+                await asyncio.gather(*sends)
+    
+    async def _deliver(self, agent_id: str, send, updates: List[Dict]):
+        try:
+            await send(json.dumps({'type': 'CONTEXT_UPDATE_BATCH', 'updates': updates}, default=str))
+        except Exception as e:
+            print(f"Sync error ({agent_id}): {e}")
+            self.unregister_transport(agent_id)
+            # No entregadas: se reenvían completas cuando vuelva la conexión
+            outbox = self.outboxes.get(agent_id)
+            if outbox is not None:
+                outbox.mark_stale(u['context_key'] for u in updates)
+
+class LocalCache:
+    """Caché local de un agente: LRU acotada, TTL y versión de SyncManager por entrada"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.data = OrderedDict()  # clave -> (valor, expira_en, versión)
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'invalidated': 0}
+
+    def get(self, key: str, current_version: int):
+        entry = self.data.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return _MISS
+        value, expires_at, version = entry
+        if expires_at and time.time() > expires_at:
+            del self.data[key]
+            self.stats['expired'] += 1
+            self.stats['misses'] += 1
+            return _MISS
+        if version != current_version:
+            # Otro agente actualizó la clave: la copia local está obsoleta
+            del self.data[key]
+            self.stats['invalidated'] += 1
+            self.stats['misses'] += 1
+            return _MISS
+        self.data.move_to_end(key)
+        self.stats['hits'] += 1
+        return value
+
+    def put(self, key: str, value: Any, ttl: Optional[int], version: int):
+        self.data[key] = (value, time.time() + ttl if ttl else None, version)
+        self.data.move_to_end(key)
+        while len(self.data) > self.max_entries:
+            self.data.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def invalidate(self, key: str) -> bool:
+        if self.data.pop(key, None) is not None:
+            self.stats['invalidated'] += 1
+            return True
+        return False
+
+
+_MISS = object()
+
 
 class DistributedCache:
-    def __init__(self, sync_manager: SyncManager):
+    def __init__(self, sync_manager: SyncManager, telemetry=None, max_entries: int = 1024):
         self.sync = sync_manager
+        self.telemetry = telemetry
+        self.max_entries = max_entries
         self.local_caches = {}
+        self._exported = {}  # agent_id -> stats ya volcadas a telemetría
+        # Invalidación push: cada cambio de versión expulsa las copias de otros agentes
+        self.sync.add_listener(self._on_context_update)
         
-    def register_agent_cache(self, agent_id: str):
-        self.local_caches[agent_id] = {'data': {}, 'hits': 0, 'misses': 0}
+    def register_agent_cache(self, agent_id: str, max_entries: int = None):
+        self.local_caches[agent_id] = LocalCache(max_entries or self.max_entries)
+    
+    def _on_context_update(self, key: str, version: int, updated_by: str):
+        for agent_id, local in self.local_caches.items():
+            if agent_id != updated_by:
+                local.invalidate(key)
     
     async def get(self, agent_id: str, key: str) -> Any:
-        if agent_id in self.local_caches:
-            local = self.local_caches[agent_id]
-            if key in local['data']:
-                local['hits'] += 1
-                return local['data'][key]
-            local['misses'] += 1
+        self.sync.note_read(key)
+        local = self.local_caches.get(agent_id)
+        if local is not None:
+            # Comprobación de versión en lectura (cubre réplicas sin push)
+            value = local.get(key, self.sync.get_version(key))
+            if value is not _MISS:
+                return value
         
         shared = self.sync.get_context(key)
         if shared:
-            if agent_id in self.local_caches:
-                self.local_caches[agent_id]['data'][key] = shared['value']
+            ttl = shared['metadata'].get('ttl')
+            if ttl:
+                # El TTL también aplica a la copia compartida
+                ttl -= (datetime.now() - datetime.fromisoformat(shared['timestamp'])).total_seconds()
+                if ttl <= 0:
+                    return None
+            if local is not None:
+                local.put(key, shared['value'], ttl, shared['version'])
             return shared['value']
         return None
     
     async def set(self, agent_id: str, key: str, value: Any, ttl: int = 3600, shared: bool = True):
-        if agent_id in self.local_caches:
-            self.local_caches[agent_id]['data'][key] = value
+        version = self.sync.get_version(key)
         if shared:
-            await self.sync.update_context(agent_id, key, value, {'ttl': ttl})
+            entry = await self.sync.update_context(agent_id, key, value, {'ttl': ttl})
+            version = entry['version']
+        local = self.local_caches.get(agent_id)
+        if local is not None:
+            local.put(key, value, ttl, version)
+    
+    def get_stats(self) -> Dict[str, Dict]:
+        return {agent_id: dict(local.stats, size=len(local.data))
+                for agent_id, local in self.local_caches.items()}
+    
+    def export_stats(self):
+        """Vuelca a TelemetrySystem los incrementos desde la última exportación"""
+        if self.telemetry is None:
+            return
+        counter = self.telemetry.counter('antigravity_distributed_cache_events',
+                                         'Eventos de la caché distribuida', ['agent_id', 'event'])
+        for agent_id, local in self.local_caches.items():
+            previous = self._exported.setdefault(agent_id, {})
+            for event, count in local.stats.items():
+                if count > previous.get(event, 0):
+                    counter.labels(agent_id, event).inc(count - previous.get(event, 0))
+                    previous[event] = count
+            self.telemetry.gauge('antigravity_distributed_cache_entries', 'Entradas en caché local',
+                                 ['agent_id']).labels(agent_id).set(len(local.data))
@@ -0,0 +1,281 @@
+# task_analytics.py
+"""
+Analítica columnar del historial de tareas.
+
+TaskAnalytics mantiene el historial en columnas NumPy (códigos de
+agente/tipo/estado, duración y recorded_at) que crecen por bloques.
+`sync()` añade solo lo nuevo de PersistentMemory: filas de particiones
+vivas por encima de la última rowid leída (una tarea reemplazada con
+INSERT OR REPLACE sobrescribe su fila, no se cuenta dos veces) y
+segmentos archivados aún no cargados. Los agregados por grupo (conteo, tasa de éxito, media y
+cuantiles de duración) y el throughput por intervalo se calculan para
+todos los grupos en una sola pasada vectorizada.
+"""
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from history_segments import Segment
+from persistent_memory import PersistentMemory
+
+GROUP_COLUMNS = ('agent_id', 'task_type', 'status')
+MAX_BUCKETS = 2000  # Serie de throughput: si el intervalo pedido da más, se ensancha
+
+
+class TaskAnalytics:
+    """Columnas del historial con diccionarios por columna categórica"""
+
+    def __init__(self, capacity: int = 4096):
+        self._size = 0
+        self._codes = {name: np.empty(capacity, dtype=np.int32) for name in GROUP_COLUMNS}
+        self._duration = np.empty(capacity, dtype=np.float64)
+        self._recorded_at = np.empty(capacity, dtype=np.float64)
+        self._values: Dict[str, List[str]] = {name: [] for name in GROUP_COLUMNS}
+        self._index: Dict[str, Dict[str, int]] = {name: {} for name in GROUP_COLUMNS}
+        # Progreso de sync(): rowid leída por partición viva y particiones ya cargadas de segmento
+        self._rowids: Dict[str, int] = {}
+        self._task_rows: Dict[str, Dict[str, int]] = {}  # partición viva -> task_id -> fila
+        self._closed = set()
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, extra: int):
+        needed = self._size + extra
+        capacity = len(self._duration)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in GROUP_COLUMNS:
+            self._codes[name] = np.resize(self._codes[name], capacity)
+        self._duration = np.resize(self._duration, capacity)
+        self._recorded_at = np.resize(self._recorded_at, capacity)
+
+    def _encode(self, name: str, values) -> np.ndarray:
+        """Códigos de un bloque de valores (np.unique y luego un dict por valor distinto)"""
+        uniques, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        index, names = self._index[name], self._values[name]
+        mapping = np.empty(len(uniques), dtype=np.int32)
+        for i, value in enumerate(uniques.tolist()):
+            if value not in index:
+                index[value] = len(names)
+                names.append(value)
+            mapping[i] = index[value]
+        return mapping[inverse.reshape(-1)]
+
+    def extend(self, agent_ids: Sequence[str], task_types: Sequence[str], statuses: Sequence[str],
+               durations: Sequence[Optional[float]], recorded_at: Sequence[float]):
+        """Añade un bloque de filas dadas por columnas (duración None/NaN si se desconoce)"""
+        count = len(recorded_at)
+        if not count:
+            return
+        self._reserve(count)
+        end = self._size + count
+        self._write(slice(self._size, end), agent_ids, task_types, statuses, durations, recorded_at)
+        self._size = end
+
+    def _write(self, rows, agent_ids, task_types, statuses, durations, recorded_at):
+        """Escribe columnas en las filas `rows` (slice o índices)"""
+        for name, values in zip(GROUP_COLUMNS, (agent_ids, task_types, statuses)):
+            self._codes[name][rows] = self._encode(name, [v or '' for v in values])
+        self._duration[rows] = np.array(
+            [np.nan if d is None else d for d in durations], dtype=np.float64)
+        self._recorded_at[rows] = recorded_at
+
+    def append(self, agent_id: str, task_type: str, status: str, duration: Optional[float],
+               recorded_at: Optional[float] = None):
+        self.extend([agent_id], [task_type], [status], [duration], [recorded_at or time.time()])
+
+    def sync(self, memory: PersistentMemory) -> int:
+        """Carga lo nuevo de la memoria (incremental); devuelve las filas añadidas"""
+        before = self._size
+        conn = memory._get_connection()
+        try:
+            for name in memory.list_partitions():
+                if name in self._closed:
+                    continue
+                rows = conn.execute(
+                    f"SELECT rowid, task_id, agent_id, task_type, status, duration, recorded_at FROM {name} "
+                    "WHERE rowid > ? ORDER BY rowid", (self._rowids.get(name, 0),)
+                ).fetchall()
+                if rows:
+                    self._load_rows(name, rows)
+                    self._rowids[name] = rows[-1][0]
+        finally:
+            conn.close()
+
+        for path in memory.segments():
+            name = path.stem
+            if name in self._closed:
+                continue
+            # Partición ya leída viva: sus filas están cargadas (se asume que no cambió al archivarse)
+            if name not in self._rowids:
+                with Segment(path) as segment:
+                    self._extend_segment(segment)
+            self._closed.add(name)
+            self._rowids.pop(name, None)
+            self._task_rows.pop(name, None)
+        return self._size - before
+
+    def _load_rows(self, partition: str, rows: List[tuple]):
+        """
+        Filas nuevas de una partición viva. INSERT OR REPLACE da rowid nueva a
+        una tarea ya leída: esa se sobrescribe en su fila en vez de añadirse.
+        """
+        positions = self._task_rows.setdefault(partition, {})
+        fresh, replaced = [], []
+        for row in rows:
+            (replaced if row[1] in positions else fresh).append(row)
+        if replaced:
+            index = np.fromiter((positions[row[1]] for row in replaced), dtype=np.int64, count=len(replaced))
+            self._write(index, *zip(*(row[2:] for row in replaced)))
+        if fresh:
+            start = self._size
+            self.extend(*zip(*(row[2:] for row in fresh)))
+            positions.update((row[1], start + i) for i, row in enumerate(fresh))
+
+    def _extend_segment(self, segment: Segment):
+        """Añade un segmento reutilizando sus códigos de diccionario (sin decodificar filas)"""
+        count = segment.rows
+        if not count:
+            return
+        self._reserve(count)
+        end = self._size + count
+        for name in GROUP_COLUMNS:
+            dictionary, codes = segment.dictionary(name)
+            self._codes[name][self._size:end] = self._encode(name, dictionary)[codes]
+        self._duration[self._size:end] = segment.numeric('duration')
+        self._recorded_at[self._size:end] = segment.numeric('recorded_at')
+        self._size = end
+
+    def _window(self, since: Optional[float], until: Optional[float]) -> np.ndarray:
+        recorded = self._recorded_at[:self._size]
+        mask = np.ones(self._size, dtype=bool)
+        if since is not None:
+            mask &= recorded > since
+        if until is not None:
+            mask &= recorded <= until
+        return mask
+
+    def _rows(self, since: Optional[float], until: Optional[float]) -> np.ndarray:
+        """Índices de las filas de la ventana, ordenados por duración (nulos al final)"""
+        rows = np.flatnonzero(self._window(since, until))
+        return rows[np.argsort(self._duration[rows], kind='stable')]
+
+    def aggregate(self, by: Iterable[str] = ('agent_id',), since: Optional[float] = None,
+                  until: Optional[float] = None, quantiles: Sequence[float] = (0.5, 0.95)) -> List[Dict]:
+        """
+        Agregados por grupo en una pasada: tareas, completadas, tasa de éxito,
+        duración media y cuantiles (interpolación lineal, ignorando nulos).
+        """
+        return self._aggregate(self._rows(since, until), tuple(by), quantiles)
+
+    def _aggregate(self, rows: np.ndarray, by: Sequence[str], quantiles: Sequence[float]) -> List[Dict]:
+        keys = np.zeros(len(rows), dtype=np.int64)
+        for name in by:
+            keys = keys * max(len(self._values[name]), 1) + self._codes[name][rows]
+        groups, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        size = len(groups)
+
+        counts = np.bincount(inverse, minlength=size)
+        completed_code = self._index['status'].get('completed', -1)
+        completed = np.bincount(inverse, weights=self._codes['status'][rows] == completed_code, minlength=size)
+
+        durations = self._duration[rows]
+        valid = ~np.isnan(durations)
+        group_of, durations = inverse[valid], durations[valid]
+        valid_counts = np.bincount(group_of, minlength=size)
+        sums = np.bincount(group_of, weights=durations, minlength=size)
+        # Las filas ya van por duración: una ordenación estable por grupo (radix con uint16)
+        # deja cada grupo en un tramo contiguo y ordenado para los cuantiles
+        group_of = group_of.astype(np.uint16 if size <= 1 << 16 else np.int64)
+        durations = durations[np.argsort(group_of, kind='stable')]
+        starts = np.concatenate(([0], np.cumsum(valid_counts)[:-1])).astype(np.int64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / valid_counts
+        quantile_values = {}
+        for q in quantiles:
+            last = starts + np.maximum(valid_counts - 1, 0)
+            position = starts + q * (last - starts)
+            low = np.floor(position).astype(np.int64)
+            high = np.minimum(low + 1, last)
+            if len(durations):
+                # Grupos sin duraciones: índices recortados y resultado descartado abajo
+                low_c, high_c = np.minimum(low, len(durations) - 1), np.minimum(high, len(durations) - 1)
+                values = durations[low_c] + (durations[high_c] - durations[low_c]) * (position - low)
+            else:
+                values = np.full(size, np.nan)
+            quantile_values[q] = np.where(valid_counts > 0, values, np.nan)
+
+        # Decodifica las claves compuestas (de la última columna a la primera)
+        labels = {}
+        remaining = groups.copy()
+        for name in reversed(by):
+            radix = max(len(self._values[name]), 1)
+            codes, remaining = remaining % radix, remaining // radix
+            labels[name] = [self._values[name][c] for c in codes.tolist()]
+
+        report = []
+        for i in range(size):
+            row = {name: labels[name][i] for name in by}
+            row.update({
+                'tasks': int(counts[i]),
+                'completed': int(completed[i]),
+                'success_rate': float(completed[i] / counts[i]),
+                'avg_duration': _number(means[i])
+            })
+            for q in quantiles:
+                row[f"p{q * 100:g}_duration"] = _number(quantile_values[q][i])
+            report.append(row)
+        return report
+
+    def throughput(self, bucket_seconds: float = 3600, since: Optional[float] = None,
+                   until: Optional[float] = None, by: Optional[str] = None,
+                   max_buckets: int = MAX_BUCKETS) -> Dict:
+        """
+        Tareas registradas por intervalo de `bucket_seconds` (serie densa,
+        opcionalmente por columna). El intervalo se ensancha si la serie
+        pasaría de `max_buckets` puntos.
+        """
+        if not bucket_seconds or bucket_seconds <= 0:
+            raise ValueError(f"bucket_seconds debe ser positivo: {bucket_seconds}")
+        mask = self._window(since, until)
+        recorded = self._recorded_at[:self._size][mask]
+        if not len(recorded):
+            return {'bucket_seconds': bucket_seconds, 'start': None, 'series': {}}
+        span = float(recorded.max() - recorded.min())
+        if span / bucket_seconds >= max_buckets:
+            bucket_seconds = float(np.ceil(span / (max_buckets - 1)))
+        buckets = np.floor(recorded / bucket_seconds).astype(np.int64)
+        first = int(buckets.min())
+        buckets -= first
+        width = int(buckets.max()) + 1
+        if by is None:
+            series = {'all': np.bincount(buckets, minlength=width).tolist()}
+        else:
+            codes = self._codes[by][:self._size][mask]
+            radix = max(len(self._values[by]), 1)
+            grid = np.bincount(codes.astype(np.int64) * width + buckets, minlength=radix * width)
+            grid = grid.reshape(radix, width)
+            series = {self._values[by][c]: grid[c].tolist() for c in np.flatnonzero(grid.any(axis=1))}
+        return {'bucket_seconds': bucket_seconds, 'start': first * bucket_seconds, 'series': series}
+
+    def fleet_report(self, since: Optional[float] = None, bucket_seconds: float = 3600,
+                     quantiles: Sequence[float] = (0.5, 0.95)) -> Dict:
+        """Informe de flota: por agente, por tipo, por agente y tipo, y throughput por intervalo"""
+        rows = self._rows(since, None)
+        return {
+            'generated_at': time.time(),
+            'since': since,
+            'tasks': len(rows),
+            'agents': self._aggregate(rows, ('agent_id',), quantiles),
+            'task_types': self._aggregate(rows, ('task_type',), quantiles),
+            'agent_task_types': self._aggregate(rows, ('agent_id', 'task_type'), quantiles),
+            'throughput': self.throughput(bucket_seconds, since, by='task_type')
+        }
+
+def _number(value) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
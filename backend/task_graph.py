@@ -0,0 +1,144 @@
+# task_graph.py
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+
+class TaskGraphError(ValueError):
+    """Grafo de tareas inválido (ids duplicados, dependencias inexistentes o ciclos)"""
+
+
+class TaskGraph:
+    """
+    Grafo de tareas (DAG) con seguimiento incremental de dependencias.
+
+    Cada tarea declara `depends_on` (ids locales al grafo). Se mantiene un
+    contador de dependencias pendientes (grado de entrada) por tarea: al
+    completarse una, se decrementa el de sus dependientes y las que llegan
+    a cero quedan listas, con los resultados de sus dependencias en
+    `upstream`. Los ids que circulan fuera del grafo son '<graph_id>:<id>'.
+    """
+
+    def __init__(self, graph_id: str, tasks: List[Dict], submitted_by: str = None):
+        self.graph_id = graph_id
+        self.submitted_by = submitted_by
+        self.tasks: Dict[str, Dict] = {}
+        self.dependents: Dict[str, List[str]] = {}
+        self.in_degree: Dict[str, int] = {}
+        self.results: Dict[str, Any] = {}
+        self.status: Dict[str, str] = {}
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+        for task in tasks:
+            local_id = str(task.get('id', ''))
+            if not local_id:
+                raise TaskGraphError("Toda tarea del grafo necesita 'id'")
+            if local_id in self.tasks:
+                raise TaskGraphError(f"Id duplicado en el grafo: {local_id}")
+            self.tasks[local_id] = task
+            self.dependents[local_id] = []
+
+        for local_id, task in self.tasks.items():
+            deps = list(dict.fromkeys(task.get('depends_on') or []))
+            for dep in deps:
+                if dep not in self.tasks:
+                    raise TaskGraphError(f"{local_id} depende de una tarea inexistente: {dep}")
+                self.dependents[dep].append(local_id)
+            self.in_degree[local_id] = len(deps)
+            self.status[local_id] = 'pending'
+
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        """Kahn: si no se pueden visitar todas las tareas hay un ciclo"""
+        degree = dict(self.in_degree)
+        queue = deque(t for t, d in degree.items() if d == 0)
+        visited = 0
+        while queue:
+            node = queue.popleft()
+            visited += 1
+            for child in self.dependents[node]:
+                degree[child] -= 1
+                if degree[child] == 0:
+                    queue.append(child)
+        if visited != len(self.tasks):
+            raise TaskGraphError("El grafo de tareas tiene ciclos")
+
+    def global_id(self, local_id: str) -> str:
+        return f"{self.graph_id}:{local_id}"
+
+    def local_id(self, task_id: str) -> str:
+        return task_id.split(':', 1)[1] if task_id.startswith(f"{self.graph_id}:") else task_id
+
+    def _dispatchable(self, local_id: str) -> Dict:
+        """Tarea lista para encolar, con ids globales y los resultados de sus dependencias"""
+        task = self.tasks[local_id]
+        self.status[local_id] = 'ready'
+        deps = task.get('depends_on') or []
+        return {
+            **task,
+            'id': self.global_id(local_id),
+            'graph_id': self.graph_id,
+            'depends_on': [self.global_id(d) for d in deps],
+            'upstream': {d: self.results.get(d) for d in deps},
+            'description': task.get('description', local_id),
+            'type': task.get('type', 'general')
+        }
+
+    def ready_tasks(self) -> List[Dict]:
+        """Tareas sin dependencias (las primeras en despacharse)"""
+        return [self._dispatchable(t) for t, d in self.in_degree.items() if d == 0]
+
+    def complete(self, task_id: str, result: Any) -> List[Dict]:
+        """Marca una tarea como completada y devuelve las que pasan a estar listas"""
+        local_id = self.local_id(task_id)
+        if self.status.get(local_id) in (None, 'completed', 'failed', 'cancelled'):
+            return []
+        self.status[local_id] = 'completed'
+        self.results[local_id] = result
+        ready = []
+        for child in self.dependents[local_id]:
+            self.in_degree[child] -= 1
+            if self.in_degree[child] == 0 and self.status[child] == 'pending':
+                ready.append(self._dispatchable(child))
+        self._check_done()
+        return ready
+
+    def fail(self, task_id: str, error: Any = None) -> List[str]:
+        """Marca una tarea como fallida y cancela todos sus descendientes"""
+        local_id = self.local_id(task_id)
+        self.status[local_id] = 'failed'
+        self.results[local_id] = error
+        cancelled = []
+        queue = deque(self.dependents[local_id])
+        while queue:
+            node = queue.popleft()
+            if self.status[node] == 'pending':
+                self.status[node] = 'cancelled'
+                cancelled.append(node)
+                queue.extend(self.dependents[node])
+        self._check_done()
+        return cancelled
+
+    def _check_done(self):
+        if self.finished_at is None and self.is_done:
+            self.finished_at = time.time()
+
+    @property
+    def is_done(self) -> bool:
+        return all(s in ('completed', 'failed', 'cancelled') for s in self.status.values())
+
+    @property
+    def succeeded(self) -> bool:
+        return all(s == 'completed' for s in self.status.values())
+
+    def summary(self) -> Dict:
+        return {
+            'graph_id': self.graph_id,
+            'tasks': len(self.tasks),
+            'status': dict(self.status),
+            'results': dict(self.results),
+            'succeeded': self.succeeded,
+            'duration': (self.finished_at or time.time()) - self.started_at
+        }
@@ -1,13 +1,36 @@
 # task_router.py
+import os
 from typing import List, Dict, Optional
 import numpy as np
 from datetime import datetime, timedelta
 
+from intelligent_cache import task_fingerprint
+from streaming_stats import BloomFilter, LogBucketSketch
+from telemetry import monitor
+
 class IntelligentTaskRouter:
-    def __init__(self):
+    # Un acierto de caché evita ejecutar: pesa más que un par de tareas de carga
+    CACHE_AFFINITY_BONUS = 40
+    CONTEXT_AFFINITY_BONUS = 15
+    # Predicción de latencia: muestras mínimas para fiarse de un sketch y
+    # fracción del tiempo de servicio que cuesta un acierto de caché
+    MIN_DURATION_SAMPLES = 3
+    DEFAULT_SERVICE_TIME = 1.0
+    CACHED_SERVICE_FACTOR = 0.05
+
+    def __init__(self, telemetry=None, objective: Optional[str] = None,
+                 high_priority_quantile: Optional[float] = None):
+        self.telemetry = telemetry
         self.agents = {}
         self.task_history = []
         self.routing_stats = {}
+        # 'score' (por defecto): puntuación heurística; 'latency' (opt-in): mínimo tiempo
+        # de finalización previsto
+        self.objective = objective or os.getenv('ROUTING_OBJECTIVE', 'score')
+        self.high_priority_quantile = high_priority_quantile or float(
+            os.getenv('ROUTING_HIGH_PRIORITY_QUANTILE', '0.95')
+        )
+        self.fleet_durations: Dict[str, LogBucketSketch] = {}  # Previa para agentes sin historial
         
     def register_agent(self, agent_id: str, capabilities: List[str], 
                        performance_profile: Optional[Dict] = None):
@@ -22,9 +45,32 @@ class IntelligentTaskRouter:
             'failed_tasks': 0,
             'avg_duration': 0,
             'specializations': {},
-            'performance_profile': performance_profile or {}
+            'performance_profile': performance_profile or {},
+            'cache_filter': None,
+            'context_filter': None,
+            'durations': {}  # tipo de tarea ('*' = todas) -> LogBucketSketch
         }
+    
+    def update_agent_affinity(self, agent_id: str, summaries: Dict):
+        """Guarda los filtros de Bloom (caché y contexto) que el agente anuncia en HEARTBEAT"""
+        agent = self.agents.get(agent_id)
+        if not agent:
+            return
+        for name in ('cache', 'context'):
+            if name not in summaries:
+                continue
+            try:
+                agent[f'{name}_filter'] = BloomFilter.from_dict(summaries[name]) if summaries[name] else None
+            except (KeyError, TypeError, ValueError):
+                agent[f'{name}_filter'] = None
+    
+    def cache_holders(self, task: Dict, fingerprint: Optional[str] = None) -> List[str]:
+        """Agentes con probable resultado en caché para la tarea (falsos positivos posibles)"""
+        fingerprint = fingerprint or task_fingerprint(task)
+        return [agent_id for agent_id, agent in self.agents.items()
+                if agent['cache_filter'] is not None and fingerprint in agent['cache_filter']]
         
+    @monitor('router.route_task')
     def route_task(self, task: Dict) -> str:
         """Rutea una tarea al mejor agente disponible"""
         eligible_agents = self._find_eligible_agents(task)
@@ -32,41 +78,114 @@ class IntelligentTaskRouter:
         if not eligible_agents:
             raise Exception(f"No hay agentes disponibles para: {task['type']}")
         
-        # Calcular scores para cada agente
+        fingerprint = task_fingerprint(task)
         scored_agents = []
-        for agent_id in eligible_agents:
-            score = self._calculate_agent_score(agent_id, task)
-            scored_agents.append((agent_id, score))
-        
-        # Ordenar por score descendente
-        scored_agents.sort(key=lambda x: x[1], reverse=True)
+        if self.objective == 'latency':
+            # Menor tiempo de finalización previsto
+            quantile = self.objective_quantile(task)
+            for agent_id in eligible_agents:
+                predicted = self.predict_completion(agent_id, task, quantile, fingerprint)
+                scored_agents.append((agent_id, predicted))
+            scored_agents.sort(key=lambda x: x[1])
+        else:
+            # Calcular scores para cada agente
+            for agent_id in eligible_agents:
+                score = self._calculate_agent_score(agent_id, task, fingerprint)
+                scored_agents.append((agent_id, score))
+            
+            # Ordenar por score descendente
+            scored_agents.sort(key=lambda x: x[1], reverse=True)
         
         best_agent = scored_agents[0][0]
         
         # Actualizar estado del agente
-        self.agents[best_agent]['status'] = 'busy'
-        self.agents[best_agent]['current_load'] += 1
+        self.record_assignment(best_agent)
         
         # Registrar decisión de routing
         self._log_routing_decision(task, best_agent, scored_agents)
         
         return best_agent
     
+    def record_assignment(self, agent_id: str):
+        """Cuenta una tarea asignada al agente (también las asignadas sin route_task)"""
+        agent = self.agents.get(agent_id)
+        if agent:
+            agent['status'] = 'busy'
+            agent['current_load'] += 1
+    
+    def objective_quantile(self, task: Dict) -> float:
+        """Cuantil a minimizar: la mediana, o la cola (p95) para alta prioridad"""
+        return self.high_priority_quantile if task.get('priority') == 'high' else 0.5
+    
+    def release_assignment(self, agent_id: str, count: int = 1):
+        """Descuenta tareas asignadas que el agente no llegó a ejecutar (revocadas)"""
+        agent = self.agents.get(agent_id)
+        if agent:
+            agent['current_load'] = max(0, agent['current_load'] - count)
+            if agent['current_load'] == 0:
+                agent['status'] = 'idle'
+    
+    def mark_disconnected(self, agent_id: str):
+        """Agente sin conexión: no recibe tareas hasta que vuelva a registrarse"""
+        agent = self.agents.get(agent_id)
+        if agent:
+            agent['status'] = 'disconnected'
+            agent['current_load'] = 0
+    
+    def predict_completion(self, agent_id: str, task: Dict, quantile: float = 0.5,
+                           fingerprint: Optional[str] = None) -> float:
+        """
+        Tiempo de finalización previsto (s) = espera en cola + servicio.
+
+        El servicio es el cuantil pedido de las duraciones del agente para
+        ese tipo de tarea; la espera, las tareas que exceden sus slots de
+        concurrencia por su duración mediana.
+        """
+        agent = self.agents[agent_id]
+        service = self.expected_service_time(agent_id, task, quantile)
+        if agent['cache_filter'] is not None and (fingerprint or task_fingerprint(task)) in agent['cache_filter']:
+            service *= self.CACHED_SERVICE_FACTOR
+        context_keys = task.get('context_keys') or []
+        if agent['context_filter'] is not None and context_keys:
+            # Contexto ya replicado: se ahorra la resincronización inicial
+            present = sum(1 for key in context_keys if key in agent['context_filter'])
+            service *= 1 - 0.2 * present / len(context_keys)
+        slots = max(1, int(agent['performance_profile'].get('max_concurrent_tasks', 1)))
+        backlog = max(0, agent['current_load'] - slots + 1)
+        wait = backlog / slots * self._service_time(agent, '*', 0.5)
+        return wait + service
+    
+    def expected_service_time(self, agent_id: str, task: Dict, quantile: float = 0.5) -> float:
+        """Duración esperada de la tarea en el agente, sin contar espera en cola"""
+        return self._service_time(self.agents[agent_id], task.get('type', 'general'), quantile)
+    
+    def _service_time(self, agent: Dict, task_type: str, quantile: float) -> float:
+        """Cuantil de duración: del agente, si no de la flota, si no del agente en general"""
+        for sketch in (agent['durations'].get(task_type), self.fleet_durations.get(task_type),
+                       agent['durations'].get('*'), self.fleet_durations.get('*')):
+            if sketch is not None and sketch.count >= self.MIN_DURATION_SAMPLES:
+                return sketch.quantile(quantile)
+        return self.DEFAULT_SERVICE_TIME
+    
     def _find_eligible_agents(self, task: Dict) -> List[str]:
         """Encuentra agentes elegibles para una tarea"""
         required_capability = task.get('type', 'general')
         
         eligible = []
         for agent_id, agent in self.agents.items():
-            # Debe estar idle o con baja carga
-            if agent['status'] == 'idle' or agent['current_load'] < 3:
+            if agent['status'] == 'disconnected':
+                continue
+            # Debe estar idle o con baja carga (al menos 3 tareas, o sus slots de concurrencia)
+            slots = agent['performance_profile'].get('max_concurrent_tasks', 0)
+            if agent['status'] == 'idle' or agent['current_load'] < max(3, slots):
                 # Debe tener la capacidad requerida
                 if required_capability in agent['capabilities'] or 'general' in agent['capabilities']:
                     eligible.append(agent_id)
         
         return eligible
     
-    def _calculate_agent_score(self, agent_id: str, task: Dict) -> float:
+    def _calculate_agent_score(self, agent_id: str, task: Dict,
+                               fingerprint: Optional[str] = None) -> float:
         """Calcula score de idoneidad de un agente para una tarea"""
         agent = self.agents[agent_id]
         score = 100.0
@@ -98,7 +217,10 @@ class IntelligentTaskRouter:
         if self._has_similar_context(agent_id, task):
             score += 15
         
-        # 6. Tiempo desde última tarea (bonus para distribuir carga)
+        # 6. Afinidad: resultado probablemente en su caché / contexto ya replicado
+        score += self._affinity_bonus(agent, task, fingerprint or task_fingerprint(task))
+        
+        # 7. Tiempo desde última tarea (bonus para distribuir carga)
         last_task_time = agent.get('last_task_time')
         if last_task_time:
             idle_time = (datetime.now() - last_task_time).seconds
@@ -126,6 +248,16 @@ class IntelligentTaskRouter:
         
         return False
     
+    def _affinity_bonus(self, agent: Dict, task: Dict, fingerprint: str) -> float:
+        bonus = 0.0
+        if agent['cache_filter'] is not None and fingerprint in agent['cache_filter']:
+            bonus += self.CACHE_AFFINITY_BONUS
+        context_keys = task.get('context_keys') or []
+        if agent['context_filter'] is not None and context_keys:
+            present = sum(1 for key in context_keys if key in agent['context_filter'])
+            bonus += self.CONTEXT_AFFINITY_BONUS * present / len(context_keys)
+        return bonus
+    
     def report_task_completion(self, agent_id: str, task: Dict, 
                                success: bool, duration: float):
         """Reporta completación de tarea para actualizar estadísticas"""
@@ -150,8 +282,15 @@ class IntelligentTaskRouter:
         else:
             agent['avg_duration'] = (agent['avg_duration'] * 0.8) + (duration * 0.2)
         
-        # Actualizar especialización
+        # Distribuciones de duración (agente y flota) para predecir latencia
         task_type = task.get('type', 'general')
+        for durations in (agent['durations'], self.fleet_durations):
+            for key in (task_type, '*'):
+                if key not in durations:
+                    durations[key] = LogBucketSketch(relative_accuracy=0.02)
+                durations[key].add(duration)
+        
+        # Actualizar especialización
         if task_type not in agent['specializations']:
             agent['specializations'][task_type] = {
                 'total': 0,
@@ -2,40 +2,340 @@
 import time
 from datetime import datetime
 from collections import defaultdict, deque
-import statistics
+import atexit
+import functools
+import inspect
 import json
-from typing import Dict, List
+import re
+import sys
+import threading
+import weakref
+from bisect import bisect_left
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+from streaming_stats import RunningMoments, LogBucketSketch
+
+
+class MetricSeries:
+    """
+    Serie de una métrica con agregados en streaming.
+
+    Mantiene momentos y sketch de cuantiles sobre todas las observaciones y,
+    además, por franjas de `slot_seconds` para poder consultar ventanas de
+    tiempo combinando solo las franjas necesarias.
+    """
+
+    def __init__(self, slot_seconds: int = 60, retention_seconds: int = 3600,
+                 relative_accuracy: float = 0.01):
+        self.slot_seconds = slot_seconds
+        self.retention_seconds = retention_seconds
+        self.relative_accuracy = relative_accuracy
+        self.moments = RunningMoments()
+        self.sketch = LogBucketSketch(relative_accuracy)
+        self.slots = deque()  # [inicio_franja, RunningMoments, LogBucketSketch]
+        self.last_timestamp = None
+
+    def add(self, value: float, timestamp: float = None):
+        timestamp = timestamp or time.time()
+        self.moments.add(value)
+        self.sketch.add(value)
+
+        slot_start = int(timestamp // self.slot_seconds) * self.slot_seconds
+        if not self.slots or self.slots[-1][0] != slot_start:
+            self.slots.append([slot_start, RunningMoments(), LogBucketSketch(self.relative_accuracy)])
+            cutoff = timestamp - self.retention_seconds - self.slot_seconds
+            while self.slots and self.slots[0][0] < cutoff:
+                self.slots.popleft()
+        slot = self.slots[-1]
+        slot[1].add(value)
+        slot[2].add(value)
+        self.last_timestamp = timestamp
+
+    def _window_slots(self, time_window: int):
+        cutoff = time.time() - time_window
+        return [slot for slot in self.slots if slot[0] + self.slot_seconds > cutoff]
+
+    def window_moments(self, time_window: int = None) -> RunningMoments:
+        if not time_window:
+            return self.moments
+        moments = RunningMoments()
+        for slot in self._window_slots(time_window):
+            moments.merge(slot[1])
+        return moments
+
+    def window(self, time_window: int = None):
+        """Devuelve (momentos, sketch) para la ventana pedida (None = histórico)"""
+        if not time_window:
+            return self.moments, self.sketch
+        moments = RunningMoments()
+        sketch = LogBucketSketch(self.relative_accuracy)
+        for slot in self._window_slots(time_window):
+            moments.merge(slot[1])
+            sketch.merge(slot[2])
+        return moments, sketch
+
+def sanitize_metric_name(name: str) -> str:
+    """Convierte un nombre libre ('task.shell.duration') en uno válido para Prometheus"""
+    name = re.sub(r'[^a-zA-Z0-9_:]', '_', name)
+    return f"_{name}" if name[:1].isdigit() else name
+
+
+def sanitize_label_name(name: str) -> str:
+    """Nombre de etiqueta válido para Prometheus: [a-zA-Z_][a-zA-Z0-9_]*"""
+    name = re.sub(r'[^a-zA-Z0-9_]', '_', str(name)) or '_'
+    return f"_{name}" if name[0].isdigit() else name
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence) -> str:
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{k}="{_escape_label_value(v)}"' for k, v in zip(labelnames, values))
+    return '{' + pairs + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricFamily:
+    """
+    Familia de series con etiquetas (counter, gauge, histogram).
+
+    Cada combinación de valores de etiquetas crea una serie hija que se cachea,
+    de modo que `labels(...)` es una búsqueda en un dict. La exposición guarda
+    el texto ya renderizado y solo lo rehace si alguna serie cambió.
+    """
+
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str = '', labelnames: Sequence[str] = ()):
+        self.name = sanitize_metric_name(name)
+        self.documentation = documentation or name
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._rendered = ''
+
+    def labels(self, *values, **kwargs):
+        """Devuelve (y cachea) la serie para esos valores de etiquetas"""
+        key = tuple(str(kwargs[n]) for n in self.labelnames) if kwargs else tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} espera etiquetas {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child(_format_labels(self.labelnames, key)))
+        return child
+
+    def _default_child(self):
+        return self.labels()
+
+    def _new_child(self, label_str: str):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        if not self._dirty and not self._has_callbacks():
+            return self._rendered
+        self._dirty = False
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for child in list(self._children.values()):
+            child.render_into(self.name, lines)
+        self._rendered = '\n'.join(lines)
+        return self._rendered
+
+    def _has_callbacks(self) -> bool:
+        return False
+
+
+class _CounterChild:
+    __slots__ = ('family', 'label_str', 'value')
+
+    def __init__(self, family, label_str):
+        self.family = family
+        self.label_str = label_str
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        if amount < 0:
+            raise ValueError("Un counter solo puede incrementarse")
+        self.value += amount
+        self.family._dirty = True
+
+    def render_into(self, name: str, lines: List[str]):
+        lines.append(f"{name}_total{self.label_str} {_format_value(self.value)}")
+
+
+class Counter(MetricFamily):
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str = '', labelnames: Sequence[str] = ()):
+        super().__init__(re.sub(r'_total$', '', name), documentation, labelnames)
+
+    def _new_child(self, label_str):
+        return _CounterChild(self, label_str)
+
+    def inc(self, amount: float = 1):
+        self._default_child().inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ('family', 'label_str', 'value', 'function')
+
+    def __init__(self, family, label_str):
+        self.family = family
+        self.label_str = label_str
+        self.value = 0
+        self.function = None
+
+    def set(self, value: float):
+        self.value = value
+        self.family._dirty = True
+
+    def inc(self, amount: float = 1):
+        self.set(self.value + amount)
+
+    def dec(self, amount: float = 1):
+        self.set(self.value - amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """Calcula el valor en el momento del scrape (p.ej. tamaño de una cola)"""
+        self.function = function
+        self.family._dirty = True
+
+    def render_into(self, name: str, lines: List[str]):
+        value = self.function() if self.function else self.value
+        lines.append(f"{name}{self.label_str} {_format_value(value)}")
+
+
+class Gauge(MetricFamily):
+    type_name = 'gauge'
+
+    def _new_child(self, label_str):
+        return _GaugeChild(self, label_str)
+
+    def _has_callbacks(self) -> bool:
+        return any(child.function for child in self._children.values())
+
+    def set(self, value: float):
+        self._default_child().set(value)
+
+    def inc(self, amount: float = 1):
+        self._default_child().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default_child().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default_child().set_function(function)
+
+
+class _HistogramChild:
+    __slots__ = ('family', 'label_str', 'bucket_counts', 'sum', 'count')
+
+    def __init__(self, family, label_str):
+        self.family = family
+        self.label_str = label_str
+        self.bucket_counts = [0] * len(family.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect_left(self.family.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.family._dirty = True
+
+    def render_into(self, name: str, lines: List[str]):
+        cumulative = 0
+        prefix = self.label_str[:-1] + ',' if self.label_str else '{'
+        for bound, count in zip(self.family.buckets, self.bucket_counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{prefix}le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{name}_sum{self.label_str} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{self.label_str} {self.count}")
+
+
+class Histogram(MetricFamily):
+    type_name = 'histogram'
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+    def __init__(self, name: str, documentation: str = '', labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = None):
+        buckets = sorted(buckets or self.DEFAULT_BUCKETS)
+        if buckets[-1] != float('inf'):
+            buckets.append(float('inf'))
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self, label_str):
+        return _HistogramChild(self, label_str)
+
+    def observe(self, value: float):
+        self._default_child().observe(value)
+
 
 class TelemetrySystem:
+    SUMMARY_QUANTILES = (0.5, 0.95, 0.99)
+    MAX_LABEL_KEYS = 10000
+
     def __init__(self):
-        self.metrics = defaultdict(lambda: {
-            'count': 0,
-            'sum': 0,
-            'min': float('inf'),
-            'max': float('-inf'),
-            'values': deque(maxlen=1000)  # Últimos 1000 valores
-        })
+        self.metrics = defaultdict(MetricSeries)
+        # Series por combinación de tags: {nombre: {(('k', 'v'), ...): MetricSeries}}
+        self.labelled_metrics = {}
+        self._label_keys = {}  # tags crudos -> label_key saneado
+        self.families = {}
+        self._exposition_cache = {}
         
         self.events = deque(maxlen=10000)  # Últimos 10000 eventos
+        self.logs = deque(maxlen=2000)  # Ring aparte: los logs no desplazan eventos
         self.alerts = []
         self.thresholds = {}
         
     def record_metric(self, name: str, value: float, tags: Dict = None):
         """Registra una métrica"""
-        metric = self.metrics[name]
+        series = self.metrics[name]
+        series.add(value)
         
-        metric['count'] += 1
-        metric['sum'] += value
-        metric['min'] = min(metric['min'], value)
-        metric['max'] = max(metric['max'], value)
-        metric['values'].append({
-            'value': value,
-            'timestamp': time.time(),
-            'tags': tags or {}
-        })
+        # Series por combinación de tags; las observaciones sin tags solo van a
+        # la agregada (se exponen como agregada menos las series con tags)
+        if tags:
+            children = self.labelled_metrics.get(name)
+            if children is None:
+                children = self.labelled_metrics[name] = {}
+            label_key = self._label_key(tags)
+            child = children.get(label_key)
+            if child is None:
+                child = children[label_key] = MetricSeries()
+            child.add(value)
         
         # Verificar alertas
-        self._check_thresholds(name, value)
+        if name in self.thresholds:
+            self._check_thresholds(name, value)
+    
+    def _label_key(self, tags: Dict) -> tuple:
+        """Clave de series saneada, cacheada por tupla de tags crudos"""
+        try:
+            raw = tuple(tags.items())
+            label_key = self._label_keys.get(raw)
+        except TypeError:  # Valores no hashables: sin caché
+            raw = label_key = None
+        if label_key is None:
+            label_key = tuple(sorted((sanitize_label_name(k), str(v)) for k, v in tags.items()))
+            if raw is not None:
+                if len(self._label_keys) >= self.MAX_LABEL_KEYS:
+                    self._label_keys.clear()
+                self._label_keys[raw] = label_key
+        return label_key
     
     def record_event(self, event_type: str, details: Dict):
         """Registra un evento"""
@@ -45,37 +345,69 @@ class TelemetrySystem:
             'timestamp': datetime.now().isoformat()
         })
     
-    def get_metric_summary(self, name: str, time_window: int = None) -> Dict:
-        """Obtiene resumen de métrica"""
+    def counter(self, name: str, documentation: str = '', labelnames: Sequence[str] = ()) -> Counter:
+        """Obtiene o crea un counter con etiquetas"""
+        return self._get_family(Counter, name, documentation, labelnames)
+    
+    def gauge(self, name: str, documentation: str = '', labelnames: Sequence[str] = ()) -> Gauge:
+        """Obtiene o crea un gauge con etiquetas"""
+        return self._get_family(Gauge, name, documentation, labelnames)
+    
+    def histogram(self, name: str, documentation: str = '', labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = None) -> Histogram:
+        """Obtiene o crea un histograma con etiquetas"""
+        return self._get_family(Histogram, name, documentation, labelnames, buckets=buckets)
+    
+    def _get_family(self, cls, name, documentation, labelnames, **kwargs):
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = cls(name, documentation, labelnames, **kwargs)
+        elif not isinstance(family, cls):
+            raise ValueError(f"La métrica {name} ya existe como {family.type_name}")
+        return family
+    
+    def record_log(self, record):
+        """Guarda un LogRecord sin formatear en el ring de logs"""
+        self.logs.append(record)
+    
+    def get_recent_logs(self, limit: int = 100) -> List[Dict]:
+        return [record.to_dict() for record in list(self.logs)[-limit:]]
+    
+    def get_metric_summary(self, name: str, time_window: int = None, tags: Dict = None) -> Dict:
+        """Obtiene resumen de métrica (opcionalmente de una combinación de tags)"""
         if name not in self.metrics:
             return None
         
-        metric = self.metrics[name]
-        values = list(metric['values'])
+        series = self.metrics[name]
+        if tags:
+            label_key = self._label_key(tags)
+            series = self.labelled_metrics.get(name, {}).get(label_key)
+            if series is None:
+                return None
         
-        # Filtrar por ventana de tiempo si se especifica
-        if time_window:
-            cutoff = time.time() - time_window
-            values = [v for v in values if v['timestamp'] > cutoff]
+        # Con ventana de tiempo se combinan solo las franjas recientes
+        moments, sketch = series.window(time_window)
         
-        if not values:
+        if moments.count == 0:
             return None
         
-        numeric_values = [v['value'] for v in values]
-        
         return {
             'name': name,
-            'count': len(values),
-            'sum': sum(numeric_values),
-            'mean': statistics.mean(numeric_values),
-            'median': statistics.median(numeric_values),
-            'std_dev': statistics.stdev(numeric_values) if len(numeric_values) > 1 else 0,
-            'min': min(numeric_values),
-            'max': max(numeric_values),
-            'p95': self._percentile(numeric_values, 95),
-            'p99': self._percentile(numeric_values, 99)
+            'count': moments.count,
+            'sum': moments.total,
+            'mean': moments.mean,
+            'median': self._clamp(sketch.quantile(0.5), moments),
+            'std_dev': moments.std_dev,
+            'min': moments.min,
+            'max': moments.max,
+            'p95': self._clamp(sketch.quantile(0.95), moments),
+            'p99': self._clamp(sketch.quantile(0.99), moments)
         }
     
+    def _clamp(self, value: float, moments: RunningMoments) -> float:
+        """Ajusta la estimación del sketch al rango observado"""
+        return min(max(value, moments.min), moments.max)
+    
     def set_threshold(self, metric_name: str, threshold_type: str, 
                      value: float, alert_message: str):
         """Establece umbral para alertas"""
@@ -98,8 +430,8 @@ class TelemetrySystem:
         elif threshold['type'] == 'min' and value < threshold['value']:
             triggered = True
         elif threshold['type'] == 'avg':
-            summary = self.get_metric_summary(metric_name, time_window=300)
-            if summary and summary['mean'] > threshold['value']:
+            moments = self.metrics[metric_name].window_moments(time_window=300)
+            if moments.count and moments.mean > threshold['value']:
                 triggered = True
         
         if triggered:
@@ -113,114 +445,442 @@ class TelemetrySystem:
             self.alerts.append(alert)
             print(f"🚨 ALERTA: {threshold['message']} (valor: {value})")
     
-    def _percentile(self, values: List[float], percentile: int) -> float:
-        """Calcula percentil"""
-        if not values:
-            return 0
-        sorted_values = sorted(values)
-        index = int(len(sorted_values) * (percentile / 100))
-        return sorted_values[min(index, len(sorted_values) - 1)]
-    
     def get_dashboard_data(self) -> Dict:
         """Obtiene datos para dashboard"""
+        flush_monitors()
         return {
             'metrics': {
                 name: self.get_metric_summary(name, time_window=3600)
                 for name in self.metrics.keys()
             },
             'recent_events': list(self.events)[-100:],
+            'recent_logs': self.get_recent_logs(50),
             'active_alerts': self.alerts[-10:],
             'timestamp': datetime.now().isoformat()
         }
     
     def export_metrics(self, format: str = 'prometheus') -> str:
         """Exporta métricas en formato estándar"""
+        flush_monitors()
         if format == 'prometheus':
-            lines = []
-            for name, metric in self.metrics.items():
-                summary = self.get_metric_summary(name)
-                if summary:
-                    lines.append(f"# HELP {name} Metric {name}")
-                    lines.append(f"# TYPE {name} gauge")
-                    lines.append(f"{name}{{stat=\"mean\"}} {summary['mean']}")
-                    lines.append(f"{name}{{stat=\"max\"}} {summary['max']}")
-                    lines.append(f"{name}{{stat=\"min\"}} {summary['min']}")
-            return "\n".join(lines)
+            blocks = [family.render() for family in list(self.families.values())]
+            blocks.extend(self._render_series(name) for name in list(self.metrics))
+            return "\n".join(block for block in blocks if block) + "\n"
         
         return json.dumps(self.get_dashboard_data(), indent=2)
+    
+    def _render_series(self, name: str) -> str:
+        """Expone una métrica de record_metric como summary, cacheando el texto"""
+        aggregate = self.metrics[name].moments
+        children = self.labelled_metrics.get(name, {})
+        # El número total de observaciones sirve de versión: si no cambia, no se re-renderiza
+        version = aggregate.count
+        cached = self._exposition_cache.get(name)
+        if cached and cached[0] == version:
+            return cached[1]
+        if not version:
+            return ''
+        
+        prom_name = sanitize_metric_name(name)
+        lines = [f"# HELP {prom_name} Metric {name}", f"# TYPE {prom_name} summary"]
+        # Observaciones sin tags = agregada menos las series con tags
+        untagged_count = aggregate.count - sum(series.moments.count for series in children.values())
+        if untagged_count > 0:
+            if not children:  # Todo sin tags: los cuantiles de la agregada son los suyos
+                series = self.metrics[name]
+                for q in self.SUMMARY_QUANTILES:
+                    value = self._clamp(series.sketch.quantile(q), aggregate)
+                    lines.append(f"{prom_name}{_format_labels(['quantile'], [q])} {_format_value(value)}")
+            untagged_sum = aggregate.total - sum(series.moments.total for series in children.values())
+            lines.append(f"{prom_name}_sum {_format_value(untagged_sum)}")
+            lines.append(f"{prom_name}_count {untagged_count}")
+        for label_key, series in children.items():
+            moments = series.moments
+            if not moments.count:
+                continue
+            labelnames = [k for k, _ in label_key]
+            values = [v for _, v in label_key]
+            for q in self.SUMMARY_QUANTILES:
+                label_str = _format_labels(labelnames + ['quantile'], values + [q])
+                value = self._clamp(series.sketch.quantile(q), moments)
+                lines.append(f"{prom_name}{label_str} {_format_value(value)}")
+            label_str = _format_labels(labelnames, values)
+            lines.append(f"{prom_name}_sum{label_str} {_format_value(moments.total)}")
+            lines.append(f"{prom_name}_count{label_str} {moments.count}")
+        
+        text = "\n".join(lines)
+        self._exposition_cache[name] = (version, text)
+        return text
 
 
 # Decorador para instrumentar funciones
-def monitor(metric_name: str = None, telemetry: TelemetrySystem = None):
-    """Decorador para monitorear ejecución de funciones"""
+_monitor_stats = set()  # Acumuladores (por hilo y destino) de todas las funciones; sobreviven a su hilo
+
+
+class _CallStats:
+    """
+    Acumulador por hilo, función y TelemetrySystem destino. Solo su hilo
+    escribe contadores y añade muestras; `flush()` puede llamarse desde
+    cualquier hilo: va con lock, solo lee los contadores y recorta del
+    principio las muestras ya leídas (las que se añadan mientras tanto se
+    conservan).
+    """
+
+    __slots__ = ('name', 'telemetry', 'calls', 'errors', 'flushed_calls', 'flushed_errors',
+                 'samples', 'last_flush', 'lock')
+
+    MAX_SAMPLES = 1024
+
+    def __init__(self, name: str, telemetry: 'TelemetrySystem'):
+        self.name = name
+        self.telemetry = weakref.ref(telemetry)  # No mantiene viva la instancia instrumentada
+        self.calls = 0
+        self.errors = 0
+        self.flushed_calls = 0
+        self.flushed_errors = 0
+        self.samples = []
+        self.last_flush = time.perf_counter_ns()
+        self.lock = threading.Lock()
+
+    def record_error(self, error: Exception, duration_ns: int):
+        self.errors += 1
+        telemetry = self.telemetry()
+        if telemetry:
+            telemetry.record_event('function_error', {
+                'function': self.name,
+                'error': str(error),
+                'duration': duration_ns / 1e9
+            })
+
+    def flush(self, now_ns: int = None):
+        """Vuelca lo acumulado a TelemetrySystem (counters + histograma)"""
+        with self.lock:
+            self.last_flush = now_ns or time.perf_counter_ns()
+            telemetry = self.telemetry()
+            if telemetry is None:
+                return
+            calls = self.calls - self.flushed_calls
+            errors = self.errors - self.flushed_errors
+            count = len(self.samples)
+            samples = self.samples[:count]
+            del self.samples[:count]
+            self.flushed_calls += calls
+            self.flushed_errors += errors
+
+        if calls - errors:
+            telemetry.counter('antigravity_function_calls', 'Llamadas instrumentadas',
+                              ['function', 'status']).labels(self.name, 'success').inc(calls - errors)
+        if errors:
+            telemetry.counter('antigravity_function_calls', 'Llamadas instrumentadas',
+                              ['function', 'status']).labels(self.name, 'error').inc(errors)
+        if samples:
+            histogram = telemetry.histogram('antigravity_function_duration_seconds',
+                                            'Duración de llamadas muestreadas', ['function'],
+                                            buckets=MONITOR_BUCKETS).labels(self.name)
+            for duration_ns in samples:
+                histogram.observe(duration_ns / 1e9)
+
+
+MONITOR_BUCKETS = (1e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+def flush_monitors():
+    """Vuelca los acumuladores de todos los hilos (p.ej. antes de exportar o al cerrar)"""
+    for stats in list(_monitor_stats):
+        stats.flush()
+    _prune_monitors()
+
+
+def _prune_monitors():
+    """Olvida los acumuladores cuyo TelemetrySystem ya no existe"""
+    for stats in [s for s in _monitor_stats if s.telemetry() is None]:
+        _monitor_stats.discard(stats)
+
+
+def monitor(metric_name: str = None, telemetry: TelemetrySystem = None,
+            sample_rate: float = 1.0, flush_interval: float = 1.0):
+    """
+    Decorador para monitorear ejecución de funciones (sync y async).
+
+    Cuenta todas las llamadas pero solo cronometra 1 de cada 1/sample_rate.
+    Los datos se pre-agregan por hilo y destino y se vuelcan a `telemetry`
+    cada `flush_interval` segundos. Si no se pasa `telemetry`, en métodos
+    se usa en cada llamada el atributo `telemetry` de la instancia (sin
+    destino la llamada no se contabiliza).
+    """
+    every = max(1, round(1 / sample_rate)) if sample_rate > 0 else 1
+    interval_ns = int(flush_interval * 1e9)
+    perf_counter_ns = time.perf_counter_ns
+    max_samples = _CallStats.MAX_SAMPLES
+
     def decorator(func):
-        def wrapper(*args, **kwargs):
-            name = metric_name or f"{func.__module__}.{func.__name__}"
-            start = time.time()
-            
+        name = metric_name or f"{func.__module__}.{func.__qualname__}"
+        local = threading.local()
+
+        def get_stats(args):
+            target = telemetry or (getattr(args[0], 'telemetry', None) if args else None)
+            if target is None:
+                return None
             try:
-                result = func(*args, **kwargs)
-                duration = time.time() - start
-                
-                if telemetry:
-                    telemetry.record_metric(f"{name}.duration", duration)
-                    telemetry.record_metric(f"{name}.success", 1)
-                    telemetry.record_event('function_call', {
-                        'function': name,
-                        'duration': duration,
-                        'status': 'success'
-                    })
-                
+                by_target = local.stats
+            except AttributeError:
+                by_target = local.stats = {}
+            # Clave id(): un WeakKeyDictionary crea un weakref en cada búsqueda
+            stats = by_target.get(id(target))
+            if stats is None:
+                stats = by_target[id(target)] = _CallStats(name, target)
+                weakref.finalize(target, by_target.pop, id(target), None)
+                _prune_monitors()
+                _monitor_stats.add(stats)
+            return stats
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                stats = get_stats(args)
+                if stats is None:
+                    return await func(*args, **kwargs)
+                calls = stats.calls = stats.calls + 1
+                if calls % every:
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        stats.record_error(e, 0)
+                        raise
+                start = perf_counter_ns()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    stats.record_error(e, perf_counter_ns() - start)
+                    raise
+                end = perf_counter_ns()
+                if len(stats.samples) < max_samples:
+                    stats.samples.append(end - start)
+                if end - stats.last_flush > interval_ns:
+                    stats.flush(end)
                 return result
-            
-            except Exception as e:
-                duration = time.time() - start
-                
-                if telemetry:
-                    telemetry.record_metric(f"{name}.error", 1)
-                    telemetry.record_event('function_error', {
-                        'function': name,
-                        'error': str(e),
-                        'duration': duration
-                    })
-                
-                raise
-        
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                stats = get_stats(args)
+                if stats is None:
+                    return func(*args, **kwargs)
+                calls = stats.calls = stats.calls + 1
+                if calls % every:
+                    try:
+                        return func(*args, **kwargs)
+                    except Exception as e:
+                        stats.record_error(e, 0)
+                        raise
+                start = perf_counter_ns()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    stats.record_error(e, perf_counter_ns() - start)
+                    raise
+                end = perf_counter_ns()
+                if len(stats.samples) < max_samples:
+                    stats.samples.append(end - start)
+                if end - stats.last_flush > interval_ns:
+                    stats.flush(end)
+                return result
+
+        def flush():
+            for stats in list(getattr(local, 'stats', {}).values()):
+                stats.flush()
+
+        wrapper.flush = flush
         return wrapper
     return decorator
 
 
 # Sistema de Logging Estructurado
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+
+class LogRecord:
+    """
+    Entrada de log. StructuredLogger la crea ya formateada (tras filtrar por
+    nivel): los sinks la escriben en otro hilo más tarde y unos argumentos
+    mutables podrían haber cambiado para entonces.
+    """
+
+    __slots__ = ('timestamp', 'agent_id', 'level', 'message', 'args', 'fields')
+
+    def __init__(self, timestamp: float, agent_id: str, level: str, message, args: tuple, fields: Dict):
+        self.timestamp = timestamp
+        self.agent_id = agent_id
+        self.level = level
+        self.message = message
+        self.args = args
+        self.fields = fields
+
+    def get_message(self) -> str:
+        message = self.message() if callable(self.message) else self.message
+        if self.args:
+            try:
+                message = message % self.args
+            except (TypeError, ValueError):
+                message = f"{message} {self.args}"
+        return str(message)
+
+    def to_dict(self) -> Dict:
+        return {
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat(),
+            'agent_id': self.agent_id,
+            'level': self.level,
+            'message': self.get_message(),
+            **self.fields
+        }
+
+
+class BufferedSink:
+    """
+    Sink con buffer acotado vaciado por un hilo en segundo plano.
+
+    `emit` solo hace un append a un deque, así que escribir logs no bloquea
+    el event loop; el formateo y la E/S ocurren en el hilo de volcado.
+    """
+
+    def __init__(self, flush_interval: float = 0.5, max_buffer: int = 10000):
+        self.flush_interval = flush_interval
+        self._buffer = deque(maxlen=max_buffer)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def emit(self, record: LogRecord):
+        self._buffer.append(record)
+        if record.level == 'ERROR':
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                sys.stderr.write(f"⚠️ Error volcando logs: {e}\n")
+
+    def flush(self):
+        with self._lock:
+            records = []
+            while self._buffer:
+                records.append(self._buffer.popleft())
+            if records:
+                self.write(records)
+
+    def write(self, records: List[LogRecord]):
+        raise NotImplementedError
+
+
+class ConsoleSink(BufferedSink):
+    """Salida legible por consola ([NIVEL] [agente] mensaje)"""
+
+    def write(self, records: List[LogRecord]):
+        sys.stdout.write(''.join(
+            f"[{r.level}] [{r.agent_id}] {r.get_message()}\n" for r in records
+        ))
+        sys.stdout.flush()
+
+
+class JsonLinesSink(BufferedSink):
+    """Fichero JSON-lines con rotación por tamaño (fichero.1, fichero.2, ...)"""
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backup_count: int = 5,
+                 flush_interval: float = 0.5, max_buffer: int = 10000):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(flush_interval, max_buffer)
+
+    def write(self, records: List[LogRecord]):
+        data = ''.join(json.dumps(r.to_dict(), default=str) + '\n' for r in records)
+        if self.path.exists() and self.path.stat().st_size + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(data)
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            source = self.path.with_name(f"{self.path.name}.{i}")
+            if source.exists():
+                source.replace(self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backup_count > 0:
+            self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+
+_default_sink = None
+_default_sink_lock = threading.Lock()
+
+
+def default_console_sink() -> ConsoleSink:
+    """ConsoleSink compartido por los loggers sin sinks propios (un solo hilo de volcado)"""
+    global _default_sink
+    with _default_sink_lock:
+        if _default_sink is None:
+            _default_sink = ConsoleSink()
+        return _default_sink
+
+
 class StructuredLogger:
-    def __init__(self, agent_id: str, telemetry: TelemetrySystem):
+    def __init__(self, agent_id: str, telemetry: TelemetrySystem,
+                 level: str = 'INFO', sinks: List[BufferedSink] = None):
         self.agent_id = agent_id
         self.telemetry = telemetry
+        self.level = LOG_LEVELS.get(level.upper(), LOG_LEVELS['INFO'])
+        self.sinks = sinks if sinks is not None else [default_console_sink()]
         
-    def log(self, level: str, message: str, **kwargs):
-        """Log estructurado"""
-        log_entry = {
-            'timestamp': datetime.now().isoformat(),
-            'agent_id': self.agent_id,
-            'level': level,
-            'message': message,
-            **kwargs
-        }
+    def is_enabled(self, level: str) -> bool:
+        return LOG_LEVELS.get(level, 0) >= self.level
         
-        print(f"[{level}] [{self.agent_id}] {message}")
+    def log(self, level: str, message, *args, **kwargs):
+        """
+        Log estructurado.
         
-        self.telemetry.record_event(f"log.{level}", log_entry)
+        El nivel se filtra antes de construir nada; `message` puede llevar
+        argumentos estilo % o ser un callable que devuelve el texto. El texto
+        se construye en la llamada (solo si el nivel está activo).
+        """
+        if LOG_LEVELS.get(level, 0) < self.level:
+            return
+        
+        # Se formatea aquí: el sink escribe en otro hilo y los argumentos pueden mutar después
+        record = LogRecord(time.time(), self.agent_id, level, message, args, {
+            key: value.copy() if isinstance(value, (dict, list, set)) else value
+            for key, value in kwargs.items()
+        })
+        record.message, record.args = record.get_message(), ()
+        for sink in self.sinks:
+            sink.emit(record)
+        
+        self.telemetry.record_log(record)
         
         if level == 'ERROR':
-            self.telemetry.record_metric(f"errors.{self.agent_id}", 1)
+            self.telemetry.record_metric("errors", 1, tags={'agent_id': self.agent_id})
+    
+    def info(self, message, *args, **kwargs):
+        if self.level <= 20:
+            self.log('INFO', message, *args, **kwargs)
     
-    def info(self, message: str, **kwargs):
-        self.log('INFO', message, **kwargs)
+    def warning(self, message, *args, **kwargs):
+        if self.level <= 30:
+            self.log('WARNING', message, *args, **kwargs)
     
-    def warning(self, message: str, **kwargs):
-        self.log('WARNING', message, **kwargs)
+    def error(self, message, *args, **kwargs):
+        if self.level <= 40:
+            self.log('ERROR', message, *args, **kwargs)
     
-    def error(self, message: str, **kwargs):
-        self.log('ERROR', message, **kwargs)
+    def debug(self, message, *args, **kwargs):
+        if self.level <= 10:
+            self.log('DEBUG', message, *args, **kwargs)
     
-    def debug(self, message: str, **kwargs):
-        self.log('DEBUG', message, **kwargs)
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
@@ -0,0 +1,121 @@
+# traffic_recorder.py
+import atexit
+import gzip
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Iterator, Optional
+
+
+class TrafficRecorder:
+    """
+    Graba tráfico entrante como trazas JSON Lines compactas para reproducirlo.
+
+    Cada línea es {"t": segundos desde el inicio, "s": origen ('ws'/'http'),
+    "c": id de conexión, "e": evento ('open'/'msg'/'close'/'report'),
+    "m": mensaje}. Los mensajes WebSocket se guardan tal cual llegaron, sin
+    re-serializar. Con extensión .gz la traza se comprime.
+
+    Cada proceso escribe su propio fichero (`trafico.<pid>.jsonl.gz`): varios
+    workers añadiendo al mismo gzip lo corromperían. Tras un fork, el hijo
+    abre el suyo en la primera escritura.
+    """
+
+    def __init__(self, path: str, flush_every: int = 100, flush_interval: float = 1.0):
+        self.base_path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._connections = itertools.count(1)
+        self._pid = None
+        self._open()
+        atexit.register(self.close)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=self._before_fork, after_in_parent=self._lock.release,
+                                after_in_child=self._after_fork_in_child)
+
+    def _before_fork(self):
+        # Buffers vacíos al hacer fork: el hijo no puede reescribir datos del padre
+        self._lock.acquire()
+        if not self._file.closed:
+            self._file.flush()
+
+    def _after_fork_in_child(self):
+        # El gzip heredado se suelta sin escribir su cierre en el fichero del padre
+        inherited = getattr(self._file, 'buffer', None)
+        if isinstance(inherited, gzip.GzipFile):
+            inherited.fileobj = None
+        self._lock.release()
+
+    def _open(self):
+        """Abre el fichero de este proceso y escribe la entrada de inicio"""
+        self._pid = os.getpid()
+        self.path = pid_path(self.base_path, self._pid)
+        self._file = gzip.open(self.path, 'at', encoding='utf-8') if self.path.endswith('.gz') \
+            else open(self.path, 'a', encoding='utf-8')
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._file.write(json.dumps({'t': round(self._last_flush - self._start, 6), 'e': 'start',
+                                     'wall': time.time()}) + '\n')
+
+    @classmethod
+    def from_env(cls, variable: str) -> Optional['TrafficRecorder']:
+        """Grabador opcional: solo si la variable de entorno indica un fichero"""
+        path = os.getenv(variable)
+        return cls(path) if path else None
+
+    def new_connection(self) -> int:
+        return next(self._connections)
+
+    def record(self, source: str, event: str, message: Any = None, connection: int = None):
+        entry = {'t': round(time.monotonic() - self._start, 6), 's': source, 'e': event}
+        if connection is not None:
+            entry['c'] = connection
+        if message is not None:
+            entry['m'] = message
+        self._write(entry)
+
+    def _write(self, entry: dict):
+        line = json.dumps(entry, separators=(',', ':'), ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()  # Hijo de un fork: fichero propio
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self._pending += 1
+            now = time.monotonic()
+            if self._pending >= self.flush_every or now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._pending = 0
+                self._last_flush = now
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def pid_path(path: str, pid: int) -> str:
+    """'dir/trafico.jsonl.gz' -> 'dir/trafico.<pid>.jsonl.gz'"""
+    directory, name = os.path.split(path)
+    stem, dot, extensions = name.partition('.')
+    return os.path.join(directory, f"{stem}.{pid}{dot}{extensions}")
+
+
+def read_trace(path: str) -> Iterator[dict]:
+    """Itera las entradas de una traza (texto o .gz)"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        # Si el proceso grabador murió sin cerrar, la traza acaba truncada:
+        # se devuelve todo lo que se pudo leer hasta ese punto
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        except (EOFError, json.JSONDecodeError):
+            return
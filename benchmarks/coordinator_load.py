@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+# coordinator_load.py
+"""
+Benchmark de carga del MasterCoordinator.
+
+Arranca el coordinador en un proceso aparte sobre un puerto local, conecta
+N agentes simulados que hablan el protocolo real (AGENT_REGISTER,
+TASK_REQUEST, TASK_COMPLETE, HEARTBEAT) e inyecta M tareas vía
+TASK_DELEGATION como inject_mission.py. Mide throughput, latencia de
+asignación (inyección → TASK_ASSIGNMENT) y CPU/memoria del coordinador,
+y escribe el resultado en JSON para compararlo con una línea base.
+
+Uso:
+    python benchmarks/coordinator_load.py --agents 1,10,50 --tasks 2000 --output baseline.json
+    python benchmarks/coordinator_load.py --agents 10 --tasks 2000 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import psutil
+import websockets
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, 'backend')
+
+CAPABILITIES = ['shell_commands', 'data_processing', 'file_operations', 'general']
+
+
+def serve_coordinator(port, shards=1):
+    """Punto de entrada del proceso hijo: coordinador real escuchando en `port`"""
+    sys.path.insert(0, BACKEND_DIR)
+    if shards > 1:
+        from sharded_coordinator import main as sharded_main
+        sharded_main(['--shards', str(shards), '--host', '127.0.0.1', '--port', str(port),
+                      '--shard-base-port', str(free_port_block(shards))])
+        return
+    from master_coordinator import MasterCoordinator
+
+    async def run():
+        coordinator = MasterCoordinator()
+        asyncio.create_task(coordinator.sync_manager.start_sync_worker())
+        await coordinator.start_server('127.0.0.1', port)
+
+    asyncio.run(run())
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def free_port_block(count):
+    """Primer puerto de un bloque de `count` puertos libres consecutivos"""
+    while True:
+        base = free_port()
+        try:
+            for offset in range(count):
+                with socket.socket() as s:
+                    s.bind(('127.0.0.1', base + offset))
+            return base
+        except OSError:
+            continue
+
+
+async def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"El coordinador no abrió el puerto {port}")
+
+
+class SimulatedAgent:
+    """Agente que ejecuta tareas de forma simulada (sleep opcional) y pide más al terminar"""
+
+    def __init__(self, agent_id, uri, stats, task_duration, heartbeat_interval, idle_poll):
+        self.agent_id = agent_id
+        self.uri = uri
+        self.stats = stats
+        self.task_duration = task_duration
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_poll = idle_poll
+        self.busy = 0
+        self.ws = None
+
+    async def run(self, ready):
+        async with websockets.connect(self.uri, max_size=None) as ws:
+            self.ws = ws
+            await ws.send(json.dumps({
+                'type': 'AGENT_REGISTER',
+                'agent': {
+                    'agent_id': self.agent_id,
+                    'type': 'benchmark',
+                    'capabilities': CAPABILITIES,
+                    'max_concurrent_tasks': 1,
+                    'supports_batches': True
+                }
+            }))
+            ready.set()
+            workers = [asyncio.create_task(self._heartbeat()), asyncio.create_task(self._idle_requests())]
+            try:
+                async for message in ws:
+                    data = json.loads(message)
+                    if data.get('type') == 'TASK_ASSIGNMENT':
+                        self._on_assignment(data['task'])
+                    elif data.get('type') == 'TASK_BATCH_ASSIGNMENT':
+                        self._on_batch(data)
+            except websockets.exceptions.ConnectionClosed:
+                pass
+            finally:
+                for worker in workers:
+                    worker.cancel()
+
+    def _on_assignment(self, task):
+        injected_at = task.get('bench_injected_at')
+        if injected_at:
+            self.stats['latencies'].append(time.time() - injected_at)
+        self.busy += 1
+        asyncio.create_task(self._execute(task))
+
+    def _on_batch(self, batch):
+        now = time.time()
+        for task in batch['tasks']:
+            if task.get('bench_injected_at'):
+                self.stats['latencies'].append(now - task['bench_injected_at'])
+        self.busy += 1
+        asyncio.create_task(self._execute_batch(batch))
+
+    async def _execute_batch(self, batch):
+        results = []
+        for task in batch['tasks']:
+            if self.task_duration:
+                await asyncio.sleep(self.task_duration)
+            results.append({'task_id': task['id'], 'result': {'status': 'completed'},
+                            'duration': self.task_duration})
+        await self.ws.send(json.dumps({
+            'type': 'TASK_BATCH_COMPLETE',
+            'agent_id': self.agent_id,
+            'batch_id': batch['batch_id'],
+            'results': results
+        }))
+        self.busy -= 1
+        self._on_completed(len(results))
+        await self.ws.send(json.dumps({'type': 'TASK_REQUEST', 'agent_id': self.agent_id}))
+
+    def _on_completed(self, count):
+        self.stats['completed'] += count
+        self.stats['last_completion'] = time.monotonic()
+        if self.stats['completed'] >= self.stats['expected']:
+            self.stats['done'].set()
+
+    async def _execute(self, task):
+        if self.task_duration:
+            await asyncio.sleep(self.task_duration)
+        await self.ws.send(json.dumps({
+            'type': 'TASK_COMPLETE',
+            'agent_id': self.agent_id,
+            'task': task,
+            'result': {'status': 'completed'}
+        }))
+        self.busy -= 1
+        self._on_completed(1)
+        await self.ws.send(json.dumps({'type': 'TASK_REQUEST', 'agent_id': self.agent_id}))
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await self.ws.send(json.dumps({
+                'type': 'HEARTBEAT',
+                'agent_id': self.agent_id,
+                'status': 'busy' if self.busy else 'idle'
+            }))
+
+    async def _idle_requests(self):
+        # Igual que el _auto_request_worker del CLI, pero con periodo corto
+        while True:
+            await asyncio.sleep(self.idle_poll)
+            if not self.busy:
+                await self.ws.send(json.dumps({'type': 'TASK_REQUEST', 'agent_id': self.agent_id}))
+
+
+async def inject_tasks(uri, count, rate, agent_ids, stats):
+    """Inyecta tareas por TASK_DELEGATION repartiendo el destino entre los agentes"""
+    interval = 1.0 / rate if rate else 0
+
+    async def count_rejections(ws):
+        async for message in ws:
+            if json.loads(message).get('type') == 'TASK_REJECTED':
+                stats['rejected'] += 1
+                stats['expected'] -= 1
+                if stats['completed'] >= stats['expected']:
+                    stats['done'].set()
+
+    async with websockets.connect(uri, max_size=None) as ws:
+        reader = asyncio.create_task(count_rejections(ws))
+        start = time.monotonic()
+        for i in range(count):
+            await ws.send(json.dumps({
+                'type': 'TASK_DELEGATION',
+                'from': 'BENCHMARK',
+                'to': agent_ids[i % len(agent_ids)],
+                'task': {
+                    'id': f"bench_{i}",
+                    'type': CAPABILITIES[i % len(CAPABILITIES)],
+                    'description': f"Benchmark task {i}",
+                    'estimated_duration': 0.1,
+                    'bench_injected_at': time.time()
+                }
+            }))
+            if interval:
+                delay = start + (i + 1) * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        stats['injection_end'] = time.monotonic()
+        await stats['done'].wait()
+        reader.cancel()
+
+
+def process_tree(proc):
+    """El coordinador y, en modo shardeado, sus procesos shard"""
+    try:
+        return [proc] + proc.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def tree_cpu_seconds(proc):
+    total = 0.0
+    for p in process_tree(proc):
+        try:
+            times = p.cpu_times()
+            total += times.user + times.system
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+async def sample_process(proc, samples, stop):
+    last_cpu, last_time = tree_cpu_seconds(proc), time.monotonic()
+    while not stop.is_set():
+        await asyncio.sleep(0.25)
+        cpu, now = tree_cpu_seconds(proc), time.monotonic()
+        rss = 0
+        for p in process_tree(proc):
+            try:
+                rss += p.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        samples.append(((cpu - last_cpu) / (now - last_time) * 100, rss))
+        last_cpu, last_time = cpu, now
+
+
+def percentile_ms(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 3) if values else None
+
+
+async def run_scenario(n_agents, n_tasks, rate, task_duration, heartbeat_interval, idle_poll, timeout,
+                       shards=1):
+    port = free_port()
+    uri = f"ws://127.0.0.1:{port}"
+    # Sin límite de ritmo por emisor salvo que se pida: el inyector es un único emisor
+    env = {**os.environ, 'COORDINATOR_SUBMIT_RATE': os.getenv('COORDINATOR_SUBMIT_RATE', '0')}
+    child = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve-coordinator', str(port), '--shards', str(shards)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env
+    )
+    proc = psutil.Process(child.pid)
+    try:
+        await wait_for_port(port)
+        stats = {'latencies': [], 'completed': 0, 'expected': n_tasks, 'rejected': 0,
+                 'last_completion': None, 'done': asyncio.Event()}
+        agents = [SimulatedAgent(f"bench-agent-{i}", uri, stats, task_duration, heartbeat_interval, idle_poll)
+                  for i in range(n_agents)]
+        readies = [asyncio.Event() for _ in agents]
+        agent_tasks = [asyncio.create_task(a.run(r)) for a, r in zip(agents, readies)]
+        await asyncio.gather(*(r.wait() for r in readies))
+        await asyncio.sleep(0.5 if shards == 1 else 1.5)  # Registro (y sondeo de shards) completado
+
+        samples, stop = [], asyncio.Event()
+        sampler = asyncio.create_task(sample_process(proc, samples, stop))
+        cpu_before = tree_cpu_seconds(proc)
+        start = time.monotonic()
+        injector = asyncio.create_task(inject_tasks(uri, n_tasks, rate, [a.agent_id for a in agents], stats))
+        try:
+            await asyncio.wait_for(asyncio.shield(injector), timeout)
+        except asyncio.TimeoutError:
+            injector.cancel()
+        injection_time = stats.get('injection_end', time.monotonic()) - start
+        cpu_after = tree_cpu_seconds(proc)
+        stop.set()
+        await sampler
+        for task in agent_tasks:
+            task.cancel()
+        await asyncio.gather(*agent_tasks, return_exceptions=True)
+    finally:
+        child.terminate()
+        child.wait(timeout=10)
+
+    elapsed = (stats['last_completion'] or time.monotonic()) - start
+    latencies = stats['latencies']
+    cpu_seconds = cpu_after - cpu_before
+    return {
+        'agents': n_agents,
+        'shards': shards,
+        'tasks': n_tasks,
+        'completed': stats['completed'],
+        'rejected': stats['rejected'],
+        'duration_s': round(elapsed, 3),
+        'injection_s': round(injection_time, 3),
+        'throughput_tps': round(stats['completed'] / elapsed, 2) if elapsed > 0 else None,
+        'assign_latency_ms': {
+            'p50': percentile_ms(latencies, 50),
+            'p90': percentile_ms(latencies, 90),
+            'p99': percentile_ms(latencies, 99),
+            'max': percentile_ms(latencies, 100),
+            'mean': round(float(np.mean(latencies)) * 1000, 3) if latencies else None
+        },
+        'coordinator': {
+            'cpu_seconds': round(cpu_seconds, 3),
+            'cpu_percent_avg': round(float(np.mean([s[0] for s in samples])), 1) if samples else None,
+            'rss_mb_peak': round(max(s[1] for s in samples) / 1024 / 1024, 1) if samples else None
+        }
+    }
+
+
+# Métricas comparables: (ruta, True si mayor es mejor)
+COMPARED_METRICS = [
+    (('throughput_tps',), True),
+    (('assign_latency_ms', 'p50'), False),
+    (('assign_latency_ms', 'p99'), False),
+    (('coordinator', 'cpu_seconds'), False),
+    (('coordinator', 'rss_mb_peak'), False),
+]
+
+
+def compare(report, baseline, tolerance):
+    """Compara escenario a escenario (mismo nº de agentes y tareas); devuelve las regresiones"""
+    regressions = []
+    def scenario_key(s):
+        return s['agents'], s.get('shards', 1), s['tasks']
+
+    base_by_key = {scenario_key(s): s for s in baseline.get('scenarios', [])}
+    for scenario in report['scenarios']:
+        base = base_by_key.get(scenario_key(scenario))
+        if not base:
+            print(f"  (sin línea base para {scenario['agents']} agentes / {scenario['tasks']} tareas)")
+            continue
+        for path, higher_is_better in COMPARED_METRICS:
+            current, previous = scenario, base
+            for field in path:
+                current, previous = (current or {}).get(field), (previous or {}).get(field)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            worse = -change if higher_is_better else change
+            name = '.'.join(path)
+            flag = '❌' if worse > tolerance else '✅'
+            print(f"  {flag} agents={scenario['agents']:<4} {name:<24} {previous:>10} → {current:>10} ({change:+.1%})")
+            if worse > tolerance:
+                regressions.append((scenario['agents'], name, previous, current))
+    return regressions
+
+
+async def main_async(args):
+    scenarios = []
+    for n_agents in [int(a) for a in args.agents.split(',')]:
+        print(f"▶ {n_agents} agentes, {args.tasks} tareas...")
+        result = await run_scenario(n_agents, args.tasks, args.rate, args.task_duration,
+                                    args.heartbeat_interval, args.idle_poll, args.timeout, args.shards)
+        lat = result['assign_latency_ms']
+        print(f"  {result['completed']}/{result['tasks']} completadas ({result['rejected']} rechazadas), "
+              f"{result['throughput_tps']} tareas/s, "
+              f"p50={lat['p50']}ms p99={lat['p99']}ms, CPU={result['coordinator']['cpu_seconds']}s, "
+              f"RSS={result['coordinator']['rss_mb_peak']}MB")
+        scenarios.append(result)
+
+    return {
+        'benchmark': 'coordinator_load',
+        'timestamp': datetime.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'config': {
+            'rate': args.rate,
+            'task_duration': args.task_duration,
+            'heartbeat_interval': args.heartbeat_interval,
+            'idle_poll': args.idle_poll,
+            'batch': args.batch
+        },
+        'scenarios': scenarios
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de carga del coordinador')
+    parser.add_argument('--agents', default='1,10,50', help='Lista de nº de agentes (separados por comas)')
+    parser.add_argument('--tasks', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=0, help='Tareas/s inyectadas (0 = máximo)')
+    parser.add_argument('--task-duration', type=float, default=0, help='Ejecución simulada por tarea (s)')
+    parser.add_argument('--heartbeat-interval', type=float, default=5)
+    parser.add_argument('--idle-poll', type=float, default=0.5)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', help='Fichero JSON donde guardar el resultado')
+    parser.add_argument('--compare', help='Línea base JSON con la que comparar')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Empeoramiento relativo tolerado')
+    parser.add_argument('--shards', type=int, default=1, help='>1 usa el coordinador shardeado')
+    parser.add_argument('--batch', type=int, default=1, help='Tareas máximas por lote (1 = sin lotes)')
+    parser.add_argument('--serve-coordinator', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_coordinator:
+        serve_coordinator(args.serve_coordinator, args.shards)
+        return
+
+    # El coordinador hijo hereda el entorno
+    os.environ['COORDINATOR_BATCH_MAX_TASKS'] = str(args.batch)
+    report = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Resultado guardado en {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"📊 Comparación con {args.compare} (tolerancia {args.tolerance:.0%}):")
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
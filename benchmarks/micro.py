@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# micro.py
+"""
+Micro-benchmarks de los caminos calientes del backend.
+
+Cada benchmark prepara su estado (setup) y devuelve la función a medir.
+El runner calibra el número de iteraciones por ronda, repite varias
+rondas y reporta min/mediana/media/desviación por llamada. Los resultados
+se guardan como línea base JSON y se comparan con una anterior:
+
+    python benchmarks/micro.py --save benchmarks/baselines/micro.json
+    python benchmarks/micro.py --compare benchmarks/baselines/micro.json
+    python benchmarks/micro.py -k router --rounds 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'backend'))
+
+from intelligent_cache import IntelligentCache
+from persistent_memory import PersistentMemory
+from sync_manager import SyncManager
+from task_analytics import TaskAnalytics
+from task_router import IntelligentTaskRouter
+from telemetry import TelemetrySystem
+
+BENCHMARKS = []
+TASK_TYPES = ['shell_commands', 'data_processing', 'file_operations', 'code_generation', 'api_calls']
+WORDS = "deploy build test analyze report fetch parse sync index compress upload verify".split()
+
+
+def benchmark(name, **cases):
+    """Registra un benchmark; `cases` es {parámetro: [valores]} emparejados por posición"""
+    def decorator(setup):
+        params = [dict(zip(cases, values)) for values in zip(*cases.values())] if cases else [{}]
+        for p in params:
+            suffix = ','.join(f"{k}={v}" for k, v in p.items())
+            BENCHMARKS.append((f"{name}[{suffix}]" if suffix else name, setup, p))
+        return setup
+    return decorator
+
+
+def _description(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(8))
+
+
+@benchmark('router.route_task', agents=[10, 100, 1000], history=[100, 1000, 10000])
+def bench_route_task(tmp, agents, history):
+    rng = random.Random(1)
+    router = IntelligentTaskRouter()
+    for i in range(agents):
+        router.register_agent(f"agent-{i}", rng.sample(TASK_TYPES, 3) + ['general'])
+    for i in range(history):
+        task = {'id': f"h{i}", 'type': rng.choice(TASK_TYPES), 'description': _description(rng)}
+        router.report_task_completion(f"agent-{rng.randrange(agents)}", task, True, rng.uniform(0.1, 5))
+    task = {'id': 'bench', 'type': 'data_processing', 'description': _description(rng), 'priority': 'high'}
+
+    def run():
+        agent_id = router.route_task(task)
+        agent = router.agents[agent_id]
+        agent['current_load'] -= 1
+        agent['status'] = 'idle'
+    return run
+
+
+@benchmark('cache.get', entries=[100, 1000, 10000])
+def bench_cache_get(tmp, entries):
+    cache = IntelligentCache(cache_dir=os.path.join(tmp, 'cache'), max_size_mb=1000)
+    _fill_cache(cache, entries)
+    keys = [f"key-{i}" for i in range(0, entries, max(1, entries // 100))]
+    cycle = iter(range(1 << 62))
+    return lambda: cache.get(keys[next(cycle) % len(keys)])
+
+
+@benchmark('cache.set', entries=[100, 1000, 10000])
+def bench_cache_set(tmp, entries):
+    cache = IntelligentCache(cache_dir=os.path.join(tmp, 'cache'), max_size_mb=1000)
+    _fill_cache(cache, entries)
+    value = {'status': 'completed', 'stdout': 'x' * 512}
+    cycle = iter(range(1 << 62))
+    return lambda: cache.set(f"key-{next(cycle) % entries}", value)
+
+
+def _fill_cache(cache, entries):
+    value = {'status': 'completed', 'stdout': 'x' * 512}
+    for i in range(entries):
+        cache.set(f"key-{i}", value)
+
+
+@benchmark('memory.store_task', rows=[100000])
+def bench_store_task(tmp, rows):
+    memory = _filled_memory(tmp, rows)
+    cycle = iter(range(1 << 62))
+
+    def run():
+        i = next(cycle)
+        memory.store_task({
+            'task_id': f"bench-{i}", 'agent_id': 'agent-0', 'task_type': 'shell_commands',
+            'description': 'bench', 'status': 'completed', 'start_time': datetime.now().isoformat(),
+            'end_time': datetime.now().isoformat(), 'duration': 1.0, 'result': {'code': 0}
+        })
+    return run
+
+
+@benchmark('memory.get_agent_performance', rows=[100000])
+def bench_agent_performance(tmp, rows):
+    memory = _filled_memory(tmp, rows)
+    return lambda: memory.get_agent_performance('agent-3', days=7)
+
+
+@benchmark('analytics.fleet_report', rows=[100000])
+def bench_fleet_report(tmp, rows):
+    analytics = TaskAnalytics()
+    analytics.sync(_filled_memory(tmp, rows))
+    since = time.time() - 7 * 86400
+    return lambda: analytics.fleet_report(since=since)
+
+
+def _filled_memory(tmp, rows):
+    """Carga `rows` filas de historial en bloque (el setup no se mide)"""
+    memory = PersistentMemory(os.path.join(tmp, 'memory.db'))
+    rng = random.Random(2)
+    now = time.time()
+    memory.store_tasks([{
+        'task_id': f"row-{i}", 'agent_id': f"agent-{i % 50}", 'task_type': rng.choice(TASK_TYPES),
+        'description': 'bench', 'status': 'completed', 'start_time': None, 'end_time': None,
+        'duration': rng.uniform(0.1, 10), 'recorded_at': now - rng.uniform(0, 14 * 86400)
+    } for i in range(rows)])
+    return memory
+
+
+@benchmark('telemetry.get_dashboard_data', metrics=[10, 100, 1000])
+def bench_dashboard_data(tmp, metrics):
+    telemetry = TelemetrySystem()
+    rng = random.Random(3)
+    for i in range(metrics):
+        for _ in range(100):
+            telemetry.record_metric(f"metric.{i}", rng.uniform(0, 100), tags={'agent_id': f"agent-{i % 5}"})
+    return telemetry.get_dashboard_data
+
+
+@benchmark('sync.update_context', value_kb=[1, 100, 1000])
+def bench_update_context(tmp, value_kb):
+    sync = SyncManager()
+    loop = asyncio.new_event_loop()
+    # Diccionario de ~value_kb KB con claves de 1 KB; cada llamada cambia una clave
+    value = {f"k{i}": 'x' * 1024 for i in range(value_kb)}
+    for agent in ('agent-a', 'agent-b'):
+        sync.subscribe(agent, ['shared'])
+    loop.run_until_complete(sync.update_context('agent-a', 'shared', value))
+    cycle = iter(range(1 << 62))
+
+    def run():
+        i = next(cycle)
+        updated = dict(value)
+        updated[f"k{i % value_kb}"] = str(i)
+        loop.run_until_complete(sync.update_context('agent-a', 'shared', updated))
+    return run
+
+
+def measure(func, rounds, min_time):
+    """Tiempos por llamada (s) de `rounds` rondas, cada una de al menos `min_time` segundos"""
+    func()  # Calentamiento
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or iterations >= 1 << 20:
+            break
+        iterations *= 2 if elapsed < min_time / 10 else max(2, int(min_time / max(elapsed, 1e-9)) + 1)
+
+    samples = [elapsed / iterations]
+    for _ in range(rounds - 1):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        samples.append((time.perf_counter() - start) / iterations)
+    return samples, iterations
+
+
+def run_benchmarks(pattern, rounds, min_time):
+    results = {}
+    for name, setup, params in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        with tempfile.TemporaryDirectory() as tmp:
+            func = setup(tmp, **params)
+            samples, iterations = measure(func, rounds, min_time)
+        us = [s * 1e6 for s in samples]
+        results[name] = {
+            'params': params,
+            'iterations': iterations,
+            'rounds': rounds,
+            'min_us': round(min(us), 3),
+            'median_us': round(statistics.median(us), 3),
+            'mean_us': round(statistics.mean(us), 3),
+            'stddev_us': round(statistics.stdev(us), 3) if len(us) > 1 else 0.0
+        }
+        r = results[name]
+        print(f"  {name:<52} {r['median_us']:>12.1f} µs  (min {r['min_us']:.1f}, ±{r['stddev_us']:.1f}, "
+              f"{iterations}×{rounds})")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Informe de cambios respecto a la línea base; devuelve las regresiones.
+
+    Se compara el mínimo por llamada, menos sensible al ruido de la máquina
+    que la mediana.
+    """
+    regressions = []
+    base = baseline.get('results', {})
+    print(f"\n{'benchmark':<52} {'base µs':>12} {'actual µs':>12} {'cambio':>9}")
+    for name, r in results.items():
+        if name not in base:
+            print(f"{name:<52} {'—':>12} {r['min_us']:>12.1f} {'nuevo':>9}")
+            continue
+        previous = base[name]['min_us']
+        change = (r['min_us'] - previous) / previous if previous else 0.0
+        flag = ' ❌' if change > tolerance else (' 🚀' if change < -tolerance else '')
+        print(f"{name:<52} {previous:>12.1f} {r['min_us']:>12.1f} {change:>+8.1%}{flag}")
+        if change > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks del backend')
+    parser.add_argument('-k', dest='pattern', help='Solo benchmarks cuyo nombre contenga este texto')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='Duración mínima de cada ronda (s)')
+    parser.add_argument('--save', help='Guardar resultados como línea base JSON')
+    parser.add_argument('--compare', help='Línea base JSON con la que comparar')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Empeoramiento relativo tolerado')
+    args = parser.parse_args()
+
+    print("⏱  Micro-benchmarks (tiempo por llamada)")
+    results = run_benchmarks(args.pattern, args.rounds, args.min_time)
+    report = {
+        'benchmark': 'micro',
+        'timestamp': datetime.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'results': results
+    }
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        if args.pattern and os.path.exists(args.save):
+            # Con -k solo se actualizan los benchmarks ejecutados
+            with open(args.save) as f:
+                previous = json.load(f)
+            previous['results'].update(results)
+            report['results'] = previous['results']
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Línea base guardada en {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# replay_traffic.py
+"""
+Reproduce trazas grabadas con TrafficRecorder contra un coordinador y/o dashboard.
+
+Las conexiones WebSocket de la traza se recrean como agentes simulados
+que envían exactamente los mensajes grabados (y descartan lo que reciben);
+los reportes HTTP se re-envían a /reports. El orden global de eventos se
+conserva; el ritmo se escala con --speed (1 = tiempo real, N = N veces
+más rápido, 0 = tan rápido como sea posible).
+
+Grabación:
+    COORDINATOR_RECORD_PATH=trafico-ws.jsonl.gz python backend/master_coordinator.py
+    DASHBOARD_RECORD_PATH=trafico-http.jsonl.gz python backend/dashboard_server.py
+
+Cada proceso grabador escribe su propio fichero con el pid como sufijo
+(trafico-ws.<pid>.jsonl.gz); se reproduce uno por ejecución.
+
+Reproducción:
+    python benchmarks/replay_traffic.py trafico-ws.<pid>.jsonl.gz --coordinator ws://localhost:8766 --speed 10
+    python benchmarks/replay_traffic.py trafico-http.<pid>.jsonl.gz --dashboard http://localhost:5000 --speed 0
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import aiohttp
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from traffic_recorder import read_trace
+
+
+class Replayer:
+    def __init__(self, coordinator_url=None, dashboard_url=None, speed=1.0, max_inflight_reports=64):
+        self.coordinator_url = coordinator_url
+        self.dashboard_url = dashboard_url.rstrip('/') if dashboard_url else None
+        self.speed = speed
+        self.connections = {}
+        self.drains = []
+        self.reports = set()
+        self.max_inflight_reports = max_inflight_reports
+        self.report_slots = None  # Se crea en run(), dentro del loop (en 3.9 se liga al crearse)
+        self.stats = {'ws_messages': 0, 'ws_connections': 0, 'reports': 0, 'received': 0,
+                      'errors': 0, 'skipped': 0, 'max_lag_ms': 0.0}
+
+    async def run(self, trace_path):
+        start = time.monotonic()
+        self.report_slots = asyncio.Semaphore(self.max_inflight_reports)
+        async with aiohttp.ClientSession() as self.session:
+            for entry in read_trace(trace_path):
+                if entry.get('e') == 'start':
+                    continue
+                if self.speed:
+                    due = start + entry['t'] / self.speed
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        self.stats['max_lag_ms'] = max(self.stats['max_lag_ms'], -delay * 1000)
+                await self.dispatch(entry)
+            if self.reports:
+                await asyncio.gather(*self.reports)
+            for ws in list(self.connections.values()):
+                await ws.close()
+            await asyncio.gather(*self.drains, return_exceptions=True)
+        self.stats['duration_s'] = round(time.monotonic() - start, 3)
+        self.stats['max_lag_ms'] = round(self.stats['max_lag_ms'], 3)
+        return self.stats
+
+    async def dispatch(self, entry):
+        source, event = entry.get('s'), entry.get('e')
+        if source == 'ws' and self.coordinator_url:
+            await self._ws_event(entry['c'], event, entry.get('m'))
+        elif source == 'http' and event == 'report' and self.dashboard_url:
+            await self.report_slots.acquire()
+            task = asyncio.create_task(self._post_report(entry['m']))
+            self.reports.add(task)
+            task.add_done_callback(self.reports.discard)
+        else:
+            self.stats['skipped'] += 1
+
+    async def _ws_event(self, connection, event, message):
+        try:
+            if event == 'open':
+                ws = await websockets.connect(self.coordinator_url, max_size=None)
+                self.connections[connection] = ws
+                self.drains.append(asyncio.create_task(self._drain(ws)))
+                self.stats['ws_connections'] += 1
+            elif event == 'msg':
+                ws = self.connections.get(connection)
+                if ws is None:
+                    # Traza empezada con la conexión ya abierta
+                    await self._ws_event(connection, 'open', None)
+                    ws = self.connections[connection]
+                await ws.send(message)
+                self.stats['ws_messages'] += 1
+            elif event == 'close':
+                ws = self.connections.pop(connection, None)
+                if ws:
+                    await ws.close()
+        except (OSError, websockets.exceptions.WebSocketException):
+            self.stats['errors'] += 1
+            self.connections.pop(connection, None)
+
+    async def _drain(self, ws):
+        try:
+            async for _ in ws:
+                self.stats['received'] += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def _post_report(self, data):
+        try:
+            async with self.session.post(f"{self.dashboard_url}/reports", json=data) as response:
+                await response.read()
+                self.stats['reports'] += 1
+        except aiohttp.ClientError:
+            self.stats['errors'] += 1
+        finally:
+            self.report_slots.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reproduce trazas de tráfico grabadas')
+    parser.add_argument('trace', help='Traza JSON Lines (.jsonl o .jsonl.gz)')
+    parser.add_argument('--coordinator', help='URL WebSocket del coordinador (ej. ws://localhost:8766)')
+    parser.add_argument('--dashboard', help='URL base del dashboard (ej. http://localhost:5000)')
+    parser.add_argument('--speed', type=float, default=1.0, help='Factor de velocidad (0 = máximo)')
+    args = parser.parse_args()
+
+    if not args.coordinator and not args.dashboard:
+        parser.error('Indica --coordinator y/o --dashboard')
+
+    replayer = Replayer(args.coordinator, args.dashboard, args.speed)
+    stats = asyncio.run(replayer.run(args.trace))
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
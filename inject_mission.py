@@ -21,9 +21,20 @@ async def send_mission():
     
     print(f"📡 Conectando a {uri}...")
     async with websockets.connect(uri) as websocket:
-        print("📤 Enviando Misión Alpha...")
-        await websocket.send(json.dumps(mission))
-        print("✅ Misión enviada con éxito.")
+        for attempt in range(3):
+            print("📤 Enviando Misión Alpha...")
+            await websocket.send(json.dumps(mission))
+            # El coordinador solo responde si rechaza la tarea (cola llena o límite de ritmo)
+            try:
+                reply = json.loads(await asyncio.wait_for(websocket.recv(), timeout=1.0))
+            except asyncio.TimeoutError:
+                reply = {}
+            if reply.get('type') != 'TASK_REJECTED':
+                print("✅ Misión enviada con éxito.")
+                return
+            print(f"⏳ Misión rechazada ({reply['reason']}), reintento en {reply['retry_after']}s")
+            await asyncio.sleep(reply['retry_after'])
+        print("❌ Misión rechazada tras 3 intentos.")
 
 if __name__ == "__main__":
     asyncio.run(send_mission())